@@ -0,0 +1,225 @@
+"""Compute daily changes, growth factors, R and doubling times for many
+regions at once.
+
+The functions in oscovida.py (`compute_daily_change`, `compute_growth_factor`,
+`compute_R`, `compute_doubling_time`) work on one pandas Series. The functions
+here do the same computations on a 2d array of shape (regions, dates) of
+cumulative numbers, one region per row, with NumPy operations over all rows
+at once.
+
+Rows may start and end at different dates: values before the first and
+after the last date of a region must be NaN (see `region_matrix`). The
+results are arrays of the same shape as the input, and a region's row holds
+the same numbers as the Series returned by the per-series function, at the
+same dates, and NaN for all other dates.
+
+Example:
+
+    table = get_country_table("cases")
+    values = region_matrix(table)
+    change, smooth, smooth2 = daily_change(values)
+    i = table.positions("Germany")[0]
+    smooth[i]  # == compute_daily_change(cases_germany)[1][0].values
+"""
+
+import numpy as np
+import scipy.signal
+
+
+def region_matrix(table):
+    """Return values of RegionTable `table` as float array, with NaN before
+    the first and after the last date of each region."""
+    values = np.array(table.values, dtype=float)
+    if table.first is not None:
+        dates = np.arange(values.shape[1])
+        outside = (dates < np.asarray(table.first)[:, None]) | \
+            (dates > np.asarray(table.last)[:, None])
+        values[outside] = np.nan
+    return values
+
+
+def _shift(values, periods):
+    """Like pandas.Series.shift, along the date axis."""
+    result = np.full(values.shape, np.nan)
+    if periods > 0:
+        result[:, periods:] = values[:, :-periods]
+    elif periods < 0:
+        result[:, :periods] = values[:, -periods:]
+    else:
+        result[:] = values
+    return result
+
+
+def _ffill(values):
+    """Replace NaN by the last valid value before it in the same row."""
+    n = values.shape[1]
+    index = np.where(np.isnan(values), 0, np.arange(n))
+    np.maximum.accumulate(index, axis=1, out=index)
+    return values[np.arange(values.shape[0])[:, None], index]
+
+
+def diff(values):
+    """Like pandas.Series.diff, along the date axis."""
+    return values - _shift(values, 1)
+
+
+def pct_change(values):
+    """Like pandas.Series.pct_change (missing values are forward filled)."""
+    filled = _ffill(values)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return filled / _shift(filled, 1) - 1
+
+
+def _window_sums(values, weights):
+    """Return weighted sums over trailing windows: for every date j, the sum
+    of weights[k] * values[j - len(weights) + 1 + k]."""
+    n = len(weights)
+    result = np.zeros(values.shape)
+    for k in range(n):
+        # same order of summation as pandas (roll_weighted_mean)
+        lag = n - 1 - k
+        if lag == 0:
+            result += values * weights[k]
+        else:
+            result[:, lag:] += values[:, :-lag] * weights[k]
+    return result
+
+
+def rolling_weighted_mean(values, weights, min_periods=None, center=False):
+    """Weighted mean over a moving window, like
+    `pandas.Series.rolling(len(weights), win_type=..., center=center,
+    min_periods=min_periods).mean(...)`: NaN values are ignored, and the
+    result is NaN where fewer than `min_periods` (default: window size)
+    values are available."""
+    n = len(weights)
+    offset = (n - 1) // 2 if center else 0
+    if offset:
+        padding = np.full((values.shape[0], offset), np.nan)
+        values = np.concatenate([values, padding], axis=1)
+
+    valid = ~np.isnan(values)
+    sums = _window_sums(np.where(valid, values, 0.0), weights)
+    total_weights = _window_sums(valid.astype(float), weights)
+    counts = _window_sums(valid.astype(float), np.ones(n))
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = sums / total_weights
+    result[(counts < (min_periods or n)) | (total_weights == 0)] = np.nan
+    return result[:, offset:]
+
+
+def rolling_gaussian_mean(values, window, std, min_periods=None, center=True):
+    """Like `pandas.Series.rolling(window, win_type="gaussian", center=center,
+    min_periods=min_periods).mean(std=std)` for every row."""
+    weights = scipy.signal.windows.gaussian(window, std=std)
+    return rolling_weighted_mean(values, weights, min_periods=min_periods,
+                                 center=center)
+
+
+def rolling_mean(values, window, min_periods=None, center=False):
+    """Like `pandas.Series.rolling(window, center=center,
+    min_periods=min_periods).mean()` for every row."""
+    return rolling_weighted_mean(values, np.ones(window), min_periods=min_periods,
+                                 center=center)
+
+
+def daily_change(values):
+    """Batched `compute_daily_change`: returns arrays (change, smooth, smooth2)."""
+    change = diff(values)
+    valid = ~np.isnan(change)
+
+    smooth = rolling_gaussian_mean(change, 9, std=3, min_periods=1)
+    smooth[~valid] = np.nan
+    smooth2 = rolling_gaussian_mean(smooth, 4, std=2, min_periods=1)
+    smooth2[~valid] = np.nan
+
+    return change, smooth, smooth2
+
+
+def growth_factor(values):
+    """Batched `compute_growth_factor`: returns arrays (growth, smooth)."""
+    _, smooth, _ = daily_change(values)
+    valid = ~np.isnan(diff(values))
+
+    f = pct_change(smooth) + 1
+    f[np.isposinf(f) | ~valid] = np.nan
+
+    f_smoothed = rolling_gaussian_mean(f, 7, std=2, min_periods=3)
+    f_smoothed[~valid] = np.nan
+    return f, f_smoothed
+
+
+def R_from_daily_change(change, tau=4):
+    """Batched `compute_R`, for an array of daily changes."""
+    mean4d = rolling_mean(change, tau)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        R = mean4d / _shift(mean4d, tau)
+    R2 = _shift(R, -tau)
+    R2[(_shift(mean4d, tau) == 0.0) & (mean4d == 0)] = 1.0
+    return R2
+
+
+def reproduction_number(values, tau=4):
+    """Estimate R from cumulative numbers in the same way as
+    `plot_reproduction_number`."""
+    smooth_diff = rolling_gaussian_mean(diff(values), 7, std=4)
+    smooth_diff[np.isnan(values)] = np.nan
+    R = R_from_daily_change(smooth_diff, tau=tau)
+    R[np.isnan(values)] = np.nan
+    return R
+
+
+def _compact(values, keep):
+    """Move the values where `keep` is True to the start of each row (keeping
+    their order), and fill the rest with NaN. Returns the compacted array and
+    the column each compacted value came from (for `_expand`)."""
+    order = np.argsort(~keep, axis=1, kind="stable")
+    rows = np.arange(values.shape[0])[:, None]
+    compacted = values[rows, order]
+    compacted[~keep[rows, order]] = np.nan
+    return compacted, order
+
+
+def _expand(compacted, order, keep):
+    """Inverse of `_compact`: NaN for values that were not kept."""
+    rows = np.arange(compacted.shape[0])[:, None]
+    result = np.full(compacted.shape, np.nan)
+    result[rows, order] = compacted
+    result[~keep] = np.nan
+    return result
+
+
+def doubling_time(values, minchange=0.5):
+    """Batched `compute_doubling_time`: returns arrays (dtime, dtime_smooth).
+
+    As in `compute_doubling_time`, days on which the smoothed daily change is
+    below `minchange` are dropped before the ratios of subsequent days are
+    computed, so values are only available for the remaining days. For
+    regions where the per-series function returns None, the rows are NaN.
+    """
+    change, smooth, _ = daily_change(values)
+    keep = ~np.isnan(values) & ~(smooth < minchange)
+    reduced, order = _compact(values, keep)
+
+    ratio = pct_change(reduced) + 1
+    ratio_smooth = pct_change(rolling_gaussian_mean(reduced, 7, std=3, min_periods=7)) + 1
+    compacted_keep = np.take_along_axis(keep, order, axis=1)
+    ratio[~compacted_keep] = np.nan
+    ratio_smooth[~compacted_keep] = np.nan
+    ratio[np.isposinf(ratio)] = np.nan
+    ratio_smooth[np.isposinf(ratio_smooth)] = np.nan
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        dtime = np.log(2) / np.log(ratio)
+        dtime_smooth = np.log(2) / np.log(ratio_smooth)
+    dtime[np.isposinf(dtime)] = np.nan
+    dtime_smooth[np.isposinf(dtime_smooth)] = np.nan
+
+    # same checks as in compute_doubling_time
+    failed = (keep.sum(axis=1) <= 1) | np.isnan(ratio).all(axis=1) | \
+        np.isnan(ratio_smooth).all(axis=1) | np.isnan(dtime_smooth).all(axis=1) | \
+        np.isnan(dtime).all(axis=1)
+    dtime[failed] = np.nan
+    dtime_smooth[failed] = np.nan
+
+    return _expand(dtime, order, keep), _expand(dtime_smooth, order, keep)
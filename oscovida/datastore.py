@@ -0,0 +1,318 @@
+"""Local on-disk store for (region x date) tables.
+
+Tables are kept as plain NumPy arrays that are memory-mapped when loaded, so
+that opening a table takes milliseconds and no text needs to be parsed. This
+matters because the report generation starts one notebook kernel per region,
+and each of those kernels needs the same data.
+
+Layout on disk (one directory per table):
+
+    cachedir/store/<name>/CURRENT           - name of the current version
+    cachedir/store/<name>/<version>/values.npy
+    cachedir/store/<name>/<version>/dates.npy
+    cachedir/store/<name>/<version>/labels.json
+    cachedir/store/<name>/<version>/info.json
+    cachedir/store/<name>/<version>/meta.pkl  (optional)
+
+A new version is written to its own directory and only then made current by
+atomically replacing the CURRENT file, so that readers (possibly in other
+processes) never see a partially written table.
+"""
+
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import pandas as pd
+
+
+store_location = os.path.join("cachedir", "store")
+
+# tables loaded in this process: name -> (version, RegionTable)
+_loaded = {}
+
+
+class RegionTable:
+    """Numbers for many regions as a (regions x dates) matrix.
+
+    - labels: one label per row (labels may repeat, for example the Johns
+      Hopkins data has one row per province for some countries)
+    - dates: datetime64[D] array with one entry per column
+    - values: 2d array of shape (len(labels), len(dates))
+    - meta: optional DataFrame with non-date columns (one row per region)
+    - columns: optional original column labels of the date columns, used to
+      re-create the wide table as it was read from the csv file
+    - first, last: optional arrays with the position of the first and last date
+      for which a region has data (default: all dates)
+    - source_version: for tables derived from another table in the store, the
+      version of that table (used to decide when to re-compute)
+    """
+
+    def __init__(self, labels, dates, values, meta=None, columns=None,
+                 index_name=None, column_order=None, first=None, last=None,
+                 source_version=None):
+        self.labels = list(labels)
+        self.dates = np.asarray(dates, dtype="datetime64[D]")
+        self.values = values
+        self.meta = meta
+        self.columns = list(columns) if columns is not None else None
+        self.index_name = index_name
+        self.column_order = list(column_order) if column_order is not None else None
+        self.first = first
+        self.last = last
+        self.source_version = source_version
+        self.version = None
+        self._positions = None
+
+        assert values.shape == (len(self.labels), len(self.dates)), \
+            f"Shape mismatch: {values.shape} vs {len(self.labels)} labels, {len(self.dates)} dates"
+
+    @classmethod
+    def from_wide_frame(cls, df, date_format="%m/%d/%y"):
+        """Create table from a DataFrame as read from the Johns Hopkins csv files:
+        one row per region, and one column per date (columns that are not
+        dates are kept in `meta`)."""
+        dates = pd.to_datetime(df.columns, errors="coerce", format=date_format)
+        is_date = np.asarray(dates.notnull())
+        date_columns = df.columns[is_date]
+
+        values = df[date_columns].to_numpy()
+        if values.dtype == object:
+            values = values.astype(float)
+
+        return cls(labels=df.index, dates=dates[is_date].values, values=values,
+                   meta=df[df.columns[~is_date]], columns=date_columns,
+                   index_name=df.index.name, column_order=df.columns)
+
+    def to_wide_frame(self):
+        """Inverse of `from_wide_frame`."""
+        columns = self.columns if self.columns is not None else self.date_index()
+        df = pd.DataFrame(self.values, columns=columns)
+        if self.meta is not None:
+            df = pd.concat([self.meta.reset_index(drop=True), df], axis=1)
+        df.index = pd.Index(self.labels, name=self.index_name)
+        if self.column_order is not None:
+            df = df[self.column_order]
+        return df
+
+    def date_index(self):
+        return pd.DatetimeIndex(self.dates.astype("datetime64[ns]"))
+
+    def positions(self, label):
+        """Return list of row numbers for `label`"""
+        if self._positions is None:
+            positions = {}
+            for i, l in enumerate(self.labels):
+                positions.setdefault(l, []).append(i)
+            self._positions = positions
+        return self._positions[label]
+
+    def __contains__(self, label):
+        try:
+            self.positions(label)
+        except KeyError:
+            return False
+        return True
+
+    def unique_labels(self):
+        """Return labels in order of first appearance, without duplicates."""
+        return list(dict.fromkeys(self.labels))
+
+    def aggregate(self):
+        """Return new table with one row per unique label, summing the values
+        of all rows that share a label (`meta` is dropped)."""
+        labels = self.unique_labels()
+        codes = pd.Index(labels).get_indexer(self.labels)
+        values = np.zeros((len(labels), len(self.dates)), dtype=self.values.dtype)
+        np.add.at(values, codes, np.asarray(self.values))
+        return RegionTable(labels=labels, dates=self.dates, values=values,
+                           index_name=self.index_name)
+
+    def append_days(self, other):
+        """Return new table with the data from this table, followed by the
+        data from `other` for all dates after the last date in this table.
+
+        Raises ValueError if `other` is not an extension of this table, i.e.
+        if the regions are different, or if any data for the dates in this
+        table has been changed in `other`.
+        """
+        n = len(self.dates)
+        if other.labels != self.labels or len(other.dates) < n or \
+                (other.dates[:n] != self.dates).any():
+            raise ValueError("Tables have different regions or dates")
+        if not np.array_equal(np.asarray(other.values[:, :n]), np.asarray(self.values),
+                              equal_nan=True):
+            raise ValueError("Data for existing dates has been changed")
+
+        values = np.concatenate([self.values, other.values[:, n:]], axis=1)
+        return RegionTable(labels=self.labels, dates=other.dates, values=values,
+                           meta=other.meta, columns=other.columns,
+                           index_name=other.index_name, column_order=other.column_order)
+
+    def series(self, label, name=None):
+        """Return data for `label` as pandas Series with dates as index.
+
+        The label must be unique (see `aggregate` to sum over repeated labels).
+        The values are not copied, i.e. for memory-mapped tables the series
+        is backed by the file on disk.
+        """
+        positions = self.positions(label)
+        if len(positions) != 1:
+            raise ValueError(f"{label} appears {len(positions)} times in table")
+        i = positions[0]
+        start = 0 if self.first is None else self.first[i]
+        stop = len(self.dates) if self.last is None else self.last[i] + 1
+        return pd.Series(self.values[i, start:stop],
+                         index=self.date_index()[start:stop], name=name)
+
+    def frame(self, labels):
+        """Return data for all `labels` as one DataFrame with dates as index
+        and one (float) column per label, NaN outside of the dates for which
+        a region has data (see `series`)."""
+        rows = []
+        for label in labels:
+            positions = self.positions(label)
+            if len(positions) != 1:
+                raise ValueError(f"{label} appears {len(positions)} times in table")
+            rows.append(positions[0])
+
+        values = np.asarray(self.values)[rows].T.astype(float)
+        if self.first is not None:
+            day = np.arange(len(self.dates))[:, np.newaxis]
+            values[(day < self.first[rows]) | (day > self.last[rows])] = np.nan
+        return pd.DataFrame(values, index=self.date_index(), columns=list(labels))
+
+
+def _table_path(name):
+    return os.path.join(store_location, name)
+
+
+def table_version(name):
+    """Return version string of table `name` in the store (None if missing)."""
+    try:
+        with open(os.path.join(_table_path(name), "CURRENT")) as f_in:
+            return f_in.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def save_table(name, table):
+    """Write table to store, replacing an existing table with the same name.
+
+    Returns the version string of the new table."""
+    version = uuid.uuid4().hex
+    path = os.path.join(_table_path(name), version)
+    os.makedirs(path)
+
+    np.save(os.path.join(path, "values.npy"), np.ascontiguousarray(table.values))
+    np.save(os.path.join(path, "dates.npy"), table.dates)
+    with open(os.path.join(path, "labels.json"), "w") as f_out:
+        json.dump(table.labels, f_out)
+    if table.first is not None:
+        np.save(os.path.join(path, "first.npy"), np.asarray(table.first))
+        np.save(os.path.join(path, "last.npy"), np.asarray(table.last))
+    if table.meta is not None:
+        table.meta.to_pickle(os.path.join(path, "meta.pkl"))
+    info = {
+        "columns": table.columns,
+        "index_name": table.index_name,
+        "column_order": table.column_order,
+        "source_version": table.source_version,
+    }
+    with open(os.path.join(path, "info.json"), "w") as f_out:
+        json.dump(info, f_out)
+
+    # make new version the current one (atomically)
+    tmp_name = os.path.join(_table_path(name), f"CURRENT.{version}")
+    with open(tmp_name, "w") as f_out:
+        f_out.write(version)
+    old_version = table_version(name)
+    os.replace(tmp_name, os.path.join(_table_path(name), "CURRENT"))
+
+    # Processes that have the old version open keep their memory map
+    # even when the files are removed.
+    if old_version:
+        shutil.rmtree(os.path.join(_table_path(name), old_version), ignore_errors=True)
+
+    table.version = version
+    _loaded[name] = (version, table)
+    return version
+
+
+def update_table(name, table):
+    """Save `table` as `name` in the store. If the table is already in the
+    store and `table` only adds new days to it, merge only the new days.
+
+    Returns the number of new days, or None if the existing table could not
+    be extended and has been replaced. If nothing has changed (0 new days),
+    the table in the store is left untouched, so that its version and any
+    tables derived from it remain valid.
+    """
+    old = load_table(name)
+    if old is None:
+        save_table(name, table)
+        return None
+
+    try:
+        merged = old.append_days(table)
+    except ValueError:
+        save_table(name, table)
+        return None
+
+    new_days = len(merged.dates) - len(old.dates)
+    if new_days > 0:
+        save_table(name, merged)
+    return new_days
+
+
+def load_table(name):
+    """Return table `name` from the store, or None if it doesn't exist.
+
+    Arrays are memory-mapped (read-only). Tables are only read from disk
+    if the version in the store has changed since the last call."""
+    version = table_version(name)
+    if version is None:
+        return None
+    if name in _loaded and _loaded[name][0] == version:
+        return _loaded[name][1]
+
+    try:
+        table = _read_table(os.path.join(_table_path(name), version))
+    except FileNotFoundError:
+        # another process has replaced the version we were about to read
+        return load_table(name)
+
+    table.version = version
+    _loaded[name] = (version, table)
+    return table
+
+
+def _read_table(path):
+    values = np.load(os.path.join(path, "values.npy"), mmap_mode="r")
+    dates = np.load(os.path.join(path, "dates.npy"))
+    with open(os.path.join(path, "labels.json")) as f_in:
+        labels = json.load(f_in)
+    with open(os.path.join(path, "info.json")) as f_in:
+        info = json.load(f_in)
+    meta_path = os.path.join(path, "meta.pkl")
+    meta = pd.read_pickle(meta_path) if os.path.exists(meta_path) else None
+    first_path = os.path.join(path, "first.npy")
+    if os.path.exists(first_path):
+        first = np.load(first_path)
+        last = np.load(os.path.join(path, "last.npy"))
+    else:
+        first = last = None
+
+    return RegionTable(labels=labels, dates=dates, values=values, meta=meta,
+                       columns=info["columns"], index_name=info["index_name"],
+                       column_order=info["column_order"], first=first, last=last,
+                       source_version=info.get("source_version"))
+
+
+def clear_store():
+    """Remove all tables from the store."""
+    _loaded.clear()
+    if os.path.exists(store_location):
+        shutil.rmtree(store_location)
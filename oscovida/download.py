@@ -0,0 +1,177 @@
+"""Download data files, but only if they have changed upstream.
+
+For every downloaded file we remember the ETag and Last-Modified headers
+sent by the server, and send those back (as If-None-Match and
+If-Modified-Since) the next time. If the server replies with "304 Not
+Modified", the local copy is used and nothing is transferred.
+
+Files are kept in cachedir/downloads/<name>, together with a
+<name>.info.json file that holds the headers.
+
+Several files can be downloaded concurrently with `download_many`.
+"""
+
+import concurrent.futures
+import contextlib
+import datetime
+import json
+import os
+import pathlib
+import shutil
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+
+download_location = os.path.join("cachedir", "downloads")
+
+
+def _as_url(url):
+    """Accept local paths as well as URLs"""
+    if urllib.parse.urlparse(url).scheme in ("http", "https", "ftp", "file"):
+        return url
+    return pathlib.Path(url).resolve().as_uri()
+
+
+def _info_path(name):
+    return os.path.join(download_location, name + ".info.json")
+
+
+def download_info(name):
+    """Return dictionary with information about last download of `name`
+    (empty if `name` has not been downloaded yet)."""
+    try:
+        with open(_info_path(name)) as f_in:
+            return json.load(f_in)
+    except FileNotFoundError:
+        return {}
+
+
+def _temporary_path(path):
+    """Return name of a temporary file next to `path`, unique for this process
+    and thread (several may refresh the same file at the same time)."""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.{os.getpid()}-{threading.get_ident()}.tmp")
+
+
+@contextlib.contextmanager
+def _replace_atomically(path, mode="w"):
+    """Yield file to write to, which replaces `path` when it is complete (and
+    is removed if the with-block fails)."""
+    tmp_name = _temporary_path(path)
+    try:
+        with open(tmp_name, mode) as f_out:
+            yield f_out
+        os.replace(tmp_name, path)
+    finally:
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+
+def _save_info(name, info):
+    with _replace_atomically(_info_path(name)) as f_out:
+        json.dump(info, f_out, sort_keys=True, indent=4)
+
+
+def download(url, name, timeout=60):
+    """Download `url` to local file `name` (in download_location), unless
+    the local copy is up to date.
+
+    Returns tuple (path, changed) where `path` is the local file and
+    `changed` is True if new data has been downloaded.
+    """
+    os.makedirs(download_location, exist_ok=True)
+    path = os.path.join(download_location, name)
+    info = download_info(name) if os.path.exists(path) else {}
+
+    request = urllib.request.Request(_as_url(url))
+    if info.get("etag"):
+        request.add_header("If-None-Match", info["etag"])
+    if info.get("last-modified"):
+        request.add_header("If-Modified-Since", info["last-modified"])
+
+    now = datetime.datetime.now().isoformat()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            etag = response.headers.get("ETag")
+            last_modified = response.headers.get("Last-Modified")
+
+            # Not all servers support conditional requests: if the headers
+            # are unchanged, don't download the body.
+            unchanged = bool(info) and bool(etag or last_modified) and \
+                etag == info.get("etag") and last_modified == info.get("last-modified")
+            if not unchanged:
+                with _replace_atomically(path, "wb") as f_out:
+                    shutil.copyfileobj(response, f_out)
+                info = {"url": url, "etag": etag, "last-modified": last_modified,
+                        "downloaded": now}
+    except urllib.error.HTTPError as e:
+        if e.code != 304:
+            raise
+        unchanged = True
+
+    info["checked"] = now
+    _save_info(name, info)
+    return path, not unchanged
+
+
+def _download_with_retries(url, name, timeout, retries):
+    for attempt in range(retries + 1):
+        try:
+            return download(url, name, timeout=timeout)
+        except urllib.error.HTTPError as e:
+            # only server errors are worth trying again
+            if e.code < 500 or attempt == retries:
+                raise
+        except OSError:  # includes URLError and timeouts
+            if attempt == retries:
+                raise
+        time.sleep(2 ** attempt)
+
+
+def download_many(files, workers=None, timeout=60, retries=2, progress=False):
+    """Download files concurrently, with `download` for each.
+
+    - files: dictionary mapping name to url
+    - workers: number of parallel downloads (default: one per file)
+    - timeout: timeout in seconds for connecting and for every read
+    - retries: number of times a download is tried again after a network
+      error or a server error (5xx), waiting 1, 2, 4, ... seconds in between
+    - progress: print a line whenever a download is done
+
+    Returns dictionary mapping name to (path, changed) as returned by
+    `download`. If any download fails after all retries, its exception is
+    raised once all other downloads are finished.
+    """
+    results, errors = {}, {}
+    if not files:
+        return results
+
+    t0 = time.time()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or len(files)) as pool:
+        futures = {pool.submit(_download_with_retries, url, name, timeout, retries): name
+                   for name, url in files.items()}
+        for future in concurrent.futures.as_completed(futures):
+            name = futures[future]
+            try:
+                results[name] = future.result()
+                status = "new data" if results[name][1] else "unchanged"
+            except Exception as e:
+                errors[name] = e
+                status = f"failed ({e})"
+            if progress:
+                print(f"[{len(results) + len(errors)}/{len(files)}] {name}: {status} "
+                      f"after {time.time() - t0:.1f} seconds")
+
+    if errors:
+        raise RuntimeError(f"Could not download {', '.join(errors)}") \
+            from next(iter(errors.values()))
+    return results
+
+
+def clear_downloads():
+    """Remove all downloaded files."""
+    if os.path.exists(download_location):
+        shutil.rmtree(download_location)
@@ -1,11 +1,163 @@
+import contextlib
 import datetime
 import json
 import math
 import os
+import re
+import sqlite3
+import threading
 import pandas as pd
 
 
 MetadataStorageLocation = os.path.join("oscovida-metadata", "regions")
+MetadataDatabase = os.path.join("oscovida-metadata", "regions.sqlite")
+
+# "json": one file per region in MetadataStorageLocation
+# "sqlite": one database for all regions in MetadataDatabase
+MetadataBackend = "json"
+
+
+class _JSONStorage:
+    """Metadata of every region in its own json file."""
+
+    def _path(self, name):
+        return os.path.join(MetadataStorageLocation, name + "-meta.json")
+
+    def names(self):
+        names = []
+        for fname in os.listdir(MetadataStorageLocation):
+            if _is_temporary_file(fname):
+                continue
+            # check this is a valid file:
+            assert fname.endswith("-meta.json")
+            names.append(fname.split("-meta.json")[0])
+        return names
+
+    def load(self, name):
+        if not os.path.exists(self._path(name)):
+            return None
+        with open(self._path(name)) as f_in:
+            return json.load(f_in)
+
+    def load_all(self, category=None, updated_since=None):
+        d = {}
+        for name in self.names():
+            region = self.load(name)
+            if category is not None and region.get("category") != category:
+                continue
+            if updated_since is not None:
+                last_modified = _parse_last_modified(region.get("__last_modified__"))
+                if last_modified is None or last_modified < updated_since:
+                    continue
+            d[name] = region
+        return d
+
+    def save(self, name, d):
+        # check path exists
+        if not os.path.exists(MetadataStorageLocation):
+            os.makedirs(MetadataStorageLocation, exist_ok=True)
+
+        # write to a temporary file and rename, so that the file on disk is
+        # always complete
+        tmp_name = os.path.join(MetadataStorageLocation,
+                                f".{name}-meta.json.{os.getpid()}-{threading.get_ident()}.tmp")
+        with open(tmp_name, 'w') as f_out:
+            json.dump(d, f_out, sort_keys=True, indent=4)
+        os.replace(tmp_name, self._path(name))
+
+    def clear(self):
+        if os.path.exists(MetadataStorageLocation):
+            for name in self.names():
+                os.remove(self._path(name))
+        else:
+            # presumably we run the code in a new place
+
+            # create path
+            os.makedirs(MetadataStorageLocation)
+            # not creating the path here, can lead to a race condition when
+            # multiple processed try to create it when running in parallel
+
+
+class _SQLiteStorage:
+    """Metadata of all regions in one SQLite database, with the category and
+    the time of the last update in indexed columns, so that selecting all
+    regions of one category is a single query."""
+
+    # sqlite connections must not be shared between threads or processes
+    _connections = threading.local()
+
+    def _connection(self):
+        key = (os.getpid(), os.path.abspath(MetadataDatabase))
+        connections = self._connections.__dict__.setdefault("open", {})
+        if key not in connections:
+            os.makedirs(os.path.dirname(MetadataDatabase), exist_ok=True)
+            connection = sqlite3.connect(MetadataDatabase, timeout=60)
+            # readers and the writer don't block each other
+            connection.execute("PRAGMA journal_mode=WAL")
+            with connection:
+                connection.execute(
+                    "CREATE TABLE IF NOT EXISTS regions (name TEXT PRIMARY KEY, "
+                    "category TEXT, last_modified TEXT, data TEXT NOT NULL)")
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS regions_category ON regions(category)")
+                connection.execute(
+                    "CREATE INDEX IF NOT EXISTS regions_last_modified "
+                    "ON regions(last_modified)")
+            connections[key] = connection
+        return connections[key]
+
+    def names(self):
+        rows = self._connection().execute("SELECT name FROM regions")
+        return [name for (name,) in rows]
+
+    def load(self, name):
+        row = self._connection().execute(
+            "SELECT data FROM regions WHERE name = ?", (name,)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def load_all(self, category=None, updated_since=None):
+        query, conditions, parameters = "SELECT name, data FROM regions", [], []
+        if category is not None:
+            conditions.append("category = ?")
+            parameters.append(category)
+        if updated_since is not None:
+            conditions.append("last_modified >= ?")
+            parameters.append(updated_since.isoformat())
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        rows = self._connection().execute(query, parameters)
+        return {name: json.loads(data) for name, data in rows}
+
+    def save(self, name, d):
+        last_modified = _parse_last_modified(d.get("__last_modified__"))
+        if last_modified is not None:
+            last_modified = last_modified.isoformat()
+        # a single statement in its own transaction: atomic
+        with self._connection() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO regions (name, category, last_modified, data) "
+                "VALUES (?, ?, ?, ?)",
+                (name, d.get("category"), last_modified, json.dumps(d, sort_keys=True)))
+
+    def clear(self):
+        with self._connection() as connection:
+            connection.execute("DELETE FROM regions")
+
+
+_backends = {"json": _JSONStorage, "sqlite": _SQLiteStorage}
+
+
+def set_backend(backend):
+    """Select where the metadata is stored: "json" (one file per region,
+    default) or "sqlite" (one database file for all regions)."""
+    global MetadataBackend
+    if backend not in _backends:
+        raise NotImplementedError(f"Unknown metadata backend {backend}")
+    MetadataBackend = backend
+
+
+def _storage():
+    return _backends[MetadataBackend]()
 
 
 class MetadataRegion:
@@ -27,6 +179,20 @@ class MetadataRegion:
       composed the markdwon/html from the metadata
     - also useful for more aggressive parallelisation
 
+    To change several values with only one write to disk, use `update()` or
+    a transaction:
+
+        with m.transaction():
+            m['html'] = ...
+            m['ipynb'] = ...
+
+    Files are replaced atomically, so that readers (in other threads or
+    processes) never see a partially written file.
+
+    By default, every region is stored in its own json file. With
+    `set_backend("sqlite")` all regions are stored in one SQLite database
+    instead, which is faster to query for many regions.
+
     """
 
     def get_all():
@@ -35,29 +201,22 @@ class MetadataRegion:
 
         Return list of names that are stored on disk."""
         regions = []
-        for fname in os.listdir(MetadataStorageLocation):
-            # check this is a valid file:
-            assert fname.endswith("-meta.json")
-
-            region_name = fname.split("-meta.json")[0]
+        for region_name in _storage().names():
             # attempt reading for good measure
             m = MetadataRegion(region_name)
             regions.append(region_name)
         return regions
 
 
-    def get_all_as_dataframe():
+    def get_all_as_dataframe(category=None, updated_since=None):
         """
         Class method.
 
-        Return a Dataframe with all data stored on disk."""
+        Return a Dataframe with all data stored on disk, optionally only for
+        regions of `category`, and/or regions marked as updated at or after
+        the datetime `updated_since`."""
 
-        regions = MetadataRegion.get_all()
-        d = {}
-        for region in regions:
-            index = region
-            m = MetadataRegion(region)
-            d[region] = m.as_dict()
+        d = _storage().load_all(category=category, updated_since=updated_since)
         df = pd.DataFrame(d).T
         return df
 
@@ -69,18 +228,7 @@ class MetadataRegion:
         Class method.
 
         """
-        if os.path.exists(MetadataStorageLocation):
-            for fname in os.listdir(MetadataStorageLocation):
-                # check this is a valid file:
-                assert fname.endswith("-meta.json")
-                os.remove(os.path.join(MetadataStorageLocation, fname))
-        else:
-            # presumably we run the code in a new place
-
-            # create path
-            os.makedirs(MetadataStorageLocation)
-            # not creating the path here, can lead to a race condition when
-            # multiple processed try to create it when running in parallel
+        _storage().clear()
 
 
 
@@ -92,16 +240,13 @@ class MetadataRegion:
         - "w" to delete any existing data
         """
         self.country = country
-
-        # check path exists
-        if not os.path.exists(MetadataStorageLocation):
-            os.makedirs(MetadataStorageLocation)
+        self._in_transaction = False
+        self._storage = _storage()
 
         if mode == "r":
             # have we got an existing record?
-            if os.path.exists(self._storage_path()):
-                self._load()
-            else:
+            self._load()
+            if self._d is None:
                 self._clear()
 
         elif mode == "w":
@@ -125,26 +270,49 @@ class MetadataRegion:
         return hours_ago
 
 
-    def _storage_path(self):
-        return os.path.join(MetadataStorageLocation,
-                            self.country + "-meta.json")
-
-
     def _clear(self):
         self._d = {}
         self._save()
 
 
     def _load(self):
-        with open(self._storage_path()) as f_in:
-            self._d = json.load(f_in)
+        self._d = self._storage.load(self.country)
 
     def mark_as_updated(self):
         self['__last_modified__'] = repr(datetime.datetime.now())
 
     def _save(self):
-        with open(self._storage_path(), 'w') as f_out:
-            json.dump(self._d, f_out, sort_keys=True, indent=4)
+        if self._in_transaction:
+            return  # written at the end of the transaction
+        self._storage.save(self.country, self._d)
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Collect all changes made within the with-block, and write them to
+        disk once at the end. If an exception occurs, the changes are
+        discarded."""
+        if self._in_transaction:  # nested: part of the outer transaction
+            yield self
+            return
+
+        previous = dict(self._d)
+        self._in_transaction = True
+        try:
+            yield self
+        except BaseException:
+            self._d = previous
+            raise
+        finally:
+            self._in_transaction = False
+        self._save()
+
+    def update(self, d):
+        """Set all keys and values from dictionary d (with one write to disk,
+        and none if nothing changes)."""
+        if all(key in self._d and self._d[key] == value for key, value in d.items()):
+            return
+        with self.transaction():
+            self._d.update(d)
 
     def keys(self):
         k = self._d.keys()
@@ -162,6 +330,18 @@ class MetadataRegion:
 
 
 
+def _is_temporary_file(fname):
+    return fname.startswith(".") and fname.endswith(".tmp")
+
+
+def _parse_last_modified(last_modified):
+    """Return datetime from the '__last_modified__' entry (the repr of a
+    datetime), or None."""
+    if not last_modified:
+        return None
+    return datetime.datetime(*map(int, re.findall(r"\d+", last_modified)))
+
+
 
 # Stuff to track:
 
@@ -170,7 +350,7 @@ object-identifier: country name
 
 values:
 - html-name (file)
-- ipynb-name (file)  
+- ipynb-name (file)
 - deaths (current values)
 - cases (current values)
 
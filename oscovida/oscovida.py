@@ -2,36 +2,112 @@
 https://github.com/oscovida/oscovida"""
 
 
+import collections
+import concurrent.futures
+import contextlib
 import datetime
+import functools
+import importlib
+import importlib.util
+import inspect
+import logging
 import math
 import os
-import pytz
+import threading
 import time
 import joblib
 import numpy as np
 import pandas as pd
-import IPython.display
-
-# choose font - can be deactivated
-from matplotlib import rcParams
-rcParams['font.family'] = 'sans-serif'
-rcParams['font.sans-serif'] = ['Inconsolata']
-# need many figures for index.ipynb and germany.ipynb
-rcParams['figure.max_open_warning'] = 50
-from matplotlib.ticker import ScalarFormatter, FuncFormatter
+
+from . import datastore
+from . import download
+
 from bisect import bisect
 
-import matplotlib.pyplot as plt
-plt.style.use('ggplot')
 
-# suppress warning
-from pandas.plotting import register_matplotlib_converters
-register_matplotlib_converters()
+class _LazyModule:
+    """Stand-in for a module that is only imported when one of its
+    attributes is used for the first time (after calling `setup`).
+
+    matplotlib and IPython take longer to import than everything else
+    together, but are not needed to fetch and process data.
+    """
+
+    def __init__(self, name, setup=None):
+        self._name = name
+        self._setup = setup
+        self._module = None
+        self._lock = threading.Lock()
+
+    def _load(self):
+        if self._module is None:
+            # other threads wait until the module is imported (and set up)
+            with self._lock:
+                if self._module is None:
+                    if self._setup is not None:
+                        self._setup()
+                    self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        module = self._load()
+        try:
+            return getattr(module, attr)
+        except AttributeError:
+            # submodule that has not been imported yet
+            if importlib.util.find_spec(f"{self._name}.{attr}") is None:
+                raise AttributeError(attr) from None
+            return importlib.import_module(f"{self._name}.{attr}")
+
+    def __repr__(self):
+        return f"<lazily imported module '{self._name}'>"
+
+
+_plotting_ready = False
+_plotting_lock = threading.Lock()
+
+
+def _setup_plotting():
+    """Configure matplotlib (once), before the first figure is created."""
+    global _plotting_ready
+    if _plotting_ready:
+        return
+
+    # reports drawn in parallel threads must not start before the style is set
+    with _plotting_lock:
+        if _plotting_ready:
+            return
+
+        import matplotlib
+        import matplotlib.style
+        from pandas.plotting import register_matplotlib_converters
+
+        # choose font - can be deactivated
+        matplotlib.rcParams['font.family'] = 'sans-serif'
+        matplotlib.rcParams['font.sans-serif'] = ['Inconsolata']
+        # need many figures for index.ipynb and germany.ipynb
+        matplotlib.rcParams['figure.max_open_warning'] = 50
+        matplotlib.style.use('ggplot')
+
+        # suppress warning
+        register_matplotlib_converters()
+
+        _plotting_ready = True
+
+
+matplotlib = _LazyModule("matplotlib", setup=_setup_plotting)
+plt = _LazyModule("matplotlib.pyplot", setup=_setup_plotting)
+IPython = _LazyModule("IPython")
 
 LW = 3   # line width
 
 base_url = "https://raw.githubusercontent.com/CSSEGISandData/COVID-19/master/csse_covid_19_data/csse_covid_19_time_series/"
 
+# outdated: rki_url = "https://opendata.arcgis.com/datasets/dd4580c810204019a7b8eb3e0b329dd6_0.csv"
+rki_url = "https://www.arcgis.com/sharing/rest/content/items/f10774f1c63e40168479a1feb6c7ca74/data"
+
+hungary_url = "https://raw.githubusercontent.com/sanbrock/covid19/master/datafile.csv"
+
 # set up joblib memory to avoid re-fetching files
 joblib_location = "./cachedir"
 joblib_memory = joblib.Memory(joblib_location, verbose=0)
@@ -52,8 +128,153 @@ def display_binder_link(notebook_name):
 
 
 def clear_cache():
-    """Need to run this before new data for the day is created"""
+    """Remove all cached data, so that all data sources are downloaded again.
+
+    To only download data that has changed upstream, use refresh_data()."""
     joblib_memory.clear()
+    datastore.clear_store()
+    download.clear_downloads()
+    region_cache.clear()
+
+
+class RegionCache:
+    """In-process cache for the data of regions (as returned by
+    get_country_data, germany_get_region, ...), that keeps the `maxsize`
+    most recently used entries.
+
+    Many regions are requested again and again: for example the states of
+    Germany shown in the comparison plot on every page for a Landkreis. The
+    cache is thread-safe; `info()` returns the number of hits and misses.
+    """
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, compute):
+        """Return the value for key, calling compute() if it is not cached."""
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+            self.misses += 1
+
+        value = compute()
+
+        with self._lock:
+            self._entries[key] = value
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return value
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses,
+                    "size": len(self._entries), "maxsize": self.maxsize}
+
+
+region_cache = RegionCache()
+
+
+def _data_version(source):
+    """Return the version of the data of `source` ("jhu", "jhu-us", "rki" or
+    "hungary"): changes whenever the data is fetched again."""
+    if source == "jhu":
+        return tuple(datastore.table_version(name)
+                     for name in ["jhu-cases-global", "jhu-deaths-global"])
+    elif source == "jhu-us":
+        return tuple(datastore.table_version(name)
+                     for name in ["jhu-cases-US", "jhu-deaths-US"])
+    elif source == "rki":
+        # the RKI data is padded up to yesterday
+        return fetch_data_germany_last_execution(), datetime.date.today()
+    elif source == "hungary":
+        return fetch_data_hungary_last_execution()
+    raise NotImplementedError(f"Unknown data source {source}")
+
+
+def _cached_region(source):
+    """Decorator to keep the results of the function in `region_cache`, for
+    its arguments and the version of the data from `source` (see
+    _data_version). `source` can also be a function that returns the source
+    for the arguments.
+
+    Callers get copies of the cached Series, which they are free to change.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+            source_ = source(**arguments.arguments) if callable(source) else source
+            key = (source_, func.__name__, tuple(arguments.arguments.items()),
+                   _data_version(source_))
+            result = region_cache.get(key, lambda: func(*args, **kwargs))
+            return tuple(x.copy() if isinstance(x, pd.Series) else x for x in result)
+        return wrapper
+    return decorator
+
+
+# figures collected by capture_figures(), per thread
+_captured_figures = threading.local()
+
+
+@contextlib.contextmanager
+def capture_figures():
+    """Within the with-block, figures created by the plotting functions in
+    this thread (overview, make_compare_plot, ...) are created without pyplot
+    (as with pyplot=False), and appended to the list returned by the
+    context manager:
+
+        with capture_figures() as figures:
+            overview("Germany")
+        figures[0].savefig("germany.svg")
+
+    This is safe to use in several threads at the same time, and the figures
+    are freed once they are no longer referenced.
+    """
+    figures = []
+    previous = getattr(_captured_figures, "figures", None)
+    _captured_figures.figures = figures
+    try:
+        yield figures
+    finally:
+        _captured_figures.figures = previous
+
+
+def _subplots(nrows=1, ncols=1, pyplot=True, figsize=None, **kwargs):
+    """Like plt.subplots, returns (fig, axes).
+
+    With pyplot=False (or within `capture_figures()`), the figure is created
+    directly as matplotlib.figure.Figure with an Agg canvas. It is not
+    registered with pyplot: it is not shown automatically in notebooks, does
+    not need to be closed with plt.close, and does not touch global pyplot
+    state (so that figures can be created in parallel threads).
+    """
+    captured = getattr(_captured_figures, "figures", None)
+    if pyplot and captured is None:
+        return plt.subplots(nrows, ncols, figsize=figsize, **kwargs)
+
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    fig = matplotlib.figure.Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(nrows, ncols, **kwargs)
+    if captured is not None:
+        captured.append(fig)
+    return fig, axes
 
 
 def double_time_exponential(q2_div_q1, t2_minus_t1=None):
@@ -81,44 +302,112 @@ def fetch_cases_last_execution():
     return datetime.datetime.now().strftime("%d/%m/%Y %H:%M:%S")
 
 
-@joblib_memory.cache
+johns_hopkins_files = {
+    "jhu-cases-global": "time_series_covid19_" + "confirmed" + "_global.csv",
+    "jhu-deaths-global": "time_series_covid19_" + "deaths" + "_global.csv",
+    "jhu-cases-US": "time_series_covid19_" + "confirmed" + "_US.csv",
+    "jhu-deaths-US": "time_series_covid19_" + "deaths" + "_US.csv",
+}
+
+
+def fetch_johns_hopkins_table(name):
+    """Return table `name` (see johns_hopkins_files) from the Johns Hopkins
+    data repository as a datastore.RegionTable.
+
+    The table is read from the local store (see datastore.py) where it is
+    kept as a memory-mapped (region x date) matrix. Only if the table is
+    not in the store yet, the csv file is downloaded and added to the store.
+    """
+    table = datastore.load_table(name)
+    if table is None:
+        refresh_johns_hopkins(name)
+        table = datastore.load_table(name)
+    return table
+
+
+def refresh_johns_hopkins(name, downloaded=None):
+    """Update table `name` (see johns_hopkins_files) in the local store if
+    the csv file has changed upstream (see download.download).
+
+    The Johns Hopkins tables grow by one column every day. If the new data
+    only adds days, only those are merged into the table in the store.
+
+    If the file has already been downloaded, pass (path, changed) as
+    returned by download.download as `downloaded`.
+
+    Returns True if the table in the store has changed."""
+    url = os.path.join(base_url, johns_hopkins_files[name])
+    if downloaded is None:
+        downloaded = download.download(url, johns_hopkins_files[name])
+    path, changed = downloaded
+    if not changed and datastore.table_version(name) is not None:
+        return False
+
+    df = pd.read_csv(path, index_col=1)
+    report_download(url, df)
+    new_days = datastore.update_table(name, datastore.RegionTable.from_wide_frame(df))
+    if new_days is None:
+        print(f"Replaced table {name}")
+    else:
+        print(f"Added {new_days} new days to table {name}")
+    return new_days != 0
+
+
+def fetch_johns_hopkins(name):
+    """Return table `name` from the Johns Hopkins data repository as a
+    DataFrame (one row per region, one column per date)."""
+    return fetch_johns_hopkins_table(name).to_wide_frame()
+
+
 def fetch_deaths():
     """Download deaths from Johns Hopkins data repository"""
-    url = os.path.join(base_url, "time_series_covid19_" + "deaths" + "_global.csv")
-    df = pd.read_csv(url, index_col=1)
-    report_download(url, df)
+    df = fetch_johns_hopkins("jhu-deaths-global")
     fetch_deaths_last_execution()
     return df
 
-@joblib_memory.cache
+
 def fetch_deaths_US():
     """Download deaths for US states from Johns Hopkins data repository"""
-    url = os.path.join(base_url, "time_series_covid19_" + "deaths" + "_US.csv")
-    df = pd.read_csv(url, index_col=1)
-    report_download(url, df)
+    df = fetch_johns_hopkins("jhu-deaths-US")
     # fetch_deaths_last_execution_()
     return df
 
 
-@joblib_memory.cache
 def fetch_cases():
     """Download cases from Johns Hopkins data repository"""
-    url = os.path.join(base_url, "time_series_covid19_" + "confirmed" + "_global.csv")
-    df = pd.read_csv(url, index_col=1)
-    report_download(url, df)
+    df = fetch_johns_hopkins("jhu-cases-global")
     fetch_cases_last_execution()
     return df
 
-@joblib_memory.cache
+
 def fetch_cases_US():
     """Download cases for US status from Johns Hopkins data repository"""
-    url = os.path.join(base_url, "time_series_covid19_" + "confirmed" + "_US.csv")
-    df = pd.read_csv(url, index_col=1)
-    report_download(url, df)
+    df = fetch_johns_hopkins("jhu-cases-US")
     fetch_cases_last_execution()
     return df
 
 
+def get_country_table(kind):
+    """Return datastore.RegionTable with one row per country for `kind`
+    ("cases" or "deaths") from the Johns Hopkins data.
+
+    Some countries report sub areas (i.e. multiple rows per country) such as
+    China, France, United Kingdom, Denmark. For those, the table contains the
+    sum over all regions.
+
+    The table is computed once from the fetched data and kept in the store;
+    it is only re-computed when the fetched data has changed.
+    """
+    source = fetch_johns_hopkins_table(f"jhu-{kind}-global")
+    name = f"jhu-{kind}-countries"
+    table = datastore.load_table(name)
+    if table is None or table.source_version != source.version:
+        table = source.aggregate()
+        table.source_version = source.version
+        datastore.save_table(name, table)
+    return table
+
+
 def get_country_data_johns_hopkins(country):
     """Given a country name, return deaths and cases as a tuple of
     pandas time series. Works for all (?) countries in the world, or at least
@@ -126,62 +415,102 @@ def get_country_data_johns_hopkins(country):
     index and a value.
     """
 
-    deaths = fetch_deaths()
-    cases = fetch_cases()
-
-    assert country in deaths.index, f"{country} not in available countries. These are {sorted(deaths.index)}"
-
-    # Some countries report sub areas (i.e. multiple rows per country) such as China, France, United Kingdom
-    # Denmark. In that case, we sum over all regions.
-    tmp = deaths.loc[country]
-    if len(tmp.shape) == 1:
-        d = deaths.loc[country]
-    elif len(tmp.shape) == 2:   # China, France, United Kingdom, ...
-        d = deaths.loc[country].sum()
-        d.rename("deaths", inplace=True)
-    else:
-        raise ValueError("Unknown data set structure for deaths {country}:", tmp)
-
-    tmp = cases.loc[country]
-    if len(tmp.shape) == 1:
-        c = cases.loc[country]
-    elif len(tmp.shape) == 2:
-        c = cases.loc[country].sum()
-        c.rename("cases", inplace=True)
-    else:
-        raise ValueError("Unknown data set structure for cases {country}:", tmp)
+    deaths = get_country_table("deaths")
+    cases = get_country_table("cases")
 
-    # make date string into timeindex
-    d.index = pd.to_datetime(d.index, errors="coerce", format="%m/%d/%y")
-    c.index = pd.to_datetime(c.index, errors="coerce", format="%m/%d/%y")
-    # drop all rows that don't have data
-    # sanity check: how many do we drop?
-    if c.index.isnull().sum() > 3:
-        print(f"about to drop {c.index.isnull().sum()} entries due to NaT in index", c)
-    c = c[c.index.notnull()]
+    assert country in deaths, f"{country} not in available countries. These are {sorted(deaths.labels)}"
 
-    if d.index.isnull().sum() > 3:
-        print(f"about to drop {d.index.isnull().sum()} entries due to NaT in index", d)
-    d = d[d.index.notnull()]
+    # label data
+    c = cases.series(country, name=country + " cases")
+    d = deaths.series(country, name=country + " deaths")
 
     # check there are no NaN is in the data
     assert c.isnull().sum() == 0, f"{c.isnull().sum()} NaNs in {c}"
     assert d.isnull().sum() == 0, f"{d.isnull().sum()} NaNs in {d}"
 
-    # label data
-    c.name = country + " cases"
-    d.name = country + " deaths"
-
     return c, d
 
 
+def build_US_tables(source):
+    """Given the table of the Johns Hopkins US data (one row per county, see
+    fetch_johns_hopkins_table), return dictionary with datastore.RegionTable
+    objects for the states and the counties:
+
+    {"state": ..., "county": ...}
+
+    The table for the states contains the sum over all rows of each state
+    (including the rows that are not assigned to a county). The rows of the
+    table for the counties are labelled "county, state" (county names are
+    not unique across states), and its meta data contains the state and
+    county for each row.
+    """
+    states = source.meta["Province_State"].astype(str).values
+    counties = source.meta["Admin2"]
+    values = np.asarray(source.values)
+
+    state_table = datastore.RegionTable(labels=states, dates=source.dates, values=values,
+                                        index_name="Province_State").aggregate()
+
+    is_county = counties.notnull().values
+    meta = pd.DataFrame({"Province_State": states[is_county],
+                         "County": counties.values[is_county].astype(str)})
+    meta.index = meta["County"] + ", " + meta["Province_State"]
+    county_table = datastore.RegionTable(labels=meta.index, dates=source.dates,
+                                         values=values[is_county],
+                                         index_name="County").aggregate()
+    county_table.meta = meta[~meta.index.duplicated()].loc[county_table.labels]
+
+    return {"state": state_table, "county": county_table}
+
+
+def get_US_table(level, kind):
+    """Return datastore.RegionTable with cumulative numbers for `kind`
+    ("cases" or "deaths") for all regions of `level` ("state" or "county")
+    in the US (see build_US_tables).
+
+    The tables are computed once from the fetched data and kept in the
+    store; they are only re-computed when the fetched data has changed.
+    """
+    source = fetch_johns_hopkins_table(f"jhu-{kind}-US")
+    name = f"jhu-{kind}-US-{level}"
+    table = datastore.load_table(name)
+    if table is None or table.source_version != source.version:
+        tables = build_US_tables(source)
+        for table_level, t in tables.items():
+            t.source_version = source.version
+            datastore.save_table(f"jhu-{kind}-US-{table_level}", t)
+        table = tables[level]
+    return table
+
+
+def get_US_tables():
+    """Return dictionary with all tables of build_US_tables (for cases and
+    deaths), computing them if necessary. See get_germany_tables."""
+    return {f"jhu-{kind}-US-{level}": get_US_table(level, kind)
+            for level in ["state", "county"]
+            for kind in ["cases", "deaths"]}
+
+
 def get_US_region_list():
     """return list of strings with US state names"""
-    deaths = fetch_deaths_US()
-    return list(deaths.groupby("Province_State").sum().index)
+    return sorted(get_US_table("state", "deaths").labels)
+
 
+def get_US_counties(state=None):
+    """Return sorted list of [state, county] for all counties in the Johns
+    Hopkins US data (or only those in `state`).
+
+    Rows that are not a county ("Unassigned", "Out of AL", ...) are left out.
+    """
+    meta = get_US_table("county", "deaths").meta
+    counties = [[s, county] for s, county in zip(meta["Province_State"], meta["County"])
+                if county != "Unassigned" and not county.startswith("Out of")]
+    if state is not None:
+        counties = [[s, county] for s, county in counties if s == state]
+    return sorted(counties)
 
 
+@_cached_region("jhu-us")
 def get_region_US(state, county=None, debug=False):
     """Given a US state name and county, return deaths and cases as a tuple of pandas time
     series. (Johns Hopkins data set)
@@ -189,51 +518,28 @@ def get_region_US(state, county=None, debug=False):
     If country is None, then sum over all counties in that state (i.e. return
     the numbers for the state.)
 
+    The numbers are taken from the tables of get_US_table.
     """
 
-    if not county is None:
-        raise NotImplementedError("Can only process US states (no counties)")
-
-    deaths = fetch_deaths_US()
-    cases = fetch_cases_US()
-
-    assert state in deaths['Province_State'].values, \
-        f"{state} not in available states. These are {sorted(deaths['Province_State'])}"
-
     if county is None:
-        tmpd = deaths.groupby('Province_State').sum()
-        d = tmpd.loc[state]
-        tmpc = cases.groupby('Province_State').sum()
-        c = tmpc.loc[state]
+        level, label, country = "state", state, f"US-{state}"
     else:
-        raise NotImplementedError("Can't do counties yet.")
-    # Some countries report sub areas (i.e. multiple rows per country) such as China, France, United Kingdom
-    # Denmark. In that case, we sum over all regions.
-
-    # make date string into timeindex
-    d.index = pd.to_datetime(d.index, errors="coerce", format="%m/%d/%y")
-    c.index = pd.to_datetime(c.index, errors="coerce", format="%m/%d/%y")
-    # drop all rows that don't have data
-    # sanity check: how many do we drop?
-    if c.index.isnull().sum() > 3:
-        if debug:
-            print(f"about to drop {c.index.isnull().sum()} entries due to NaT in index", c)
-    c = c[c.index.notnull()]
+        level, label, country = "county", f"{county}, {state}", f"US-{state}-{county}"
 
-    if d.index.isnull().sum() > 3:
-        if debug:
-            print(f"about to drop {d.index.isnull().sum()} entries due to NaT in index", d)
-    d = d[d.index.notnull()]
+    deaths_table = get_US_table(level, "deaths")
+    cases_table = get_US_table(level, "cases")
+
+    assert label in deaths_table, \
+        f"{label} not in available {level}s. These are {sorted(deaths_table.labels)}"
+
+    # label data
+    c = cases_table.series(label, name=country + " cases")
+    d = deaths_table.series(label, name=country + " deaths")
 
     # check there are no NaN is in the data
     assert c.isnull().sum() == 0, f"{c.isnull().sum()} NaNs in {c}"
     assert d.isnull().sum() == 0, f"{d.isnull().sum()} NaNs in {d}"
 
-    # label data
-    country = f"US-{state}"
-    c.name = country + " cases"
-    d.name = country + " deaths"
-
     return c, d
 
 
@@ -278,11 +584,11 @@ def fetch_data_germany(include_last_day=True):
 
     """
 
-    # outdated: datasource = "https://opendata.arcgis.com/datasets/dd4580c810204019a7b8eb3e0b329dd6_0.csv"
-    datasource = "https://www.arcgis.com/sharing/rest/content/items/f10774f1c63e40168479a1feb6c7ca74/data"
+    datasource = rki_url
     t0 = time.time()
     print(f"Please be patient - downloading data from {datasource} ...")
-    germany = pd.read_csv(datasource)
+    path, _ = download.download(datasource, "rki.csv")
+    germany = pd.read_csv(path)
     delta_t = time.time() - t0
     print(f"Completed downloading {len(germany)} rows in {delta_t:.1f} seconds.")
 
@@ -326,6 +632,46 @@ def fetch_data_germany(include_last_day=True):
     return cleaned
 
 
+def fetch_data_germany_totals(include_last_day=True, chunksize=500_000):
+    """Fetch data for Germany from Robert Koch institute, as totals per
+    Landkreis and day.
+
+    Returns a DataFrame like fetch_data_germany, but only with the columns
+    'Bundesland', 'Landkreis', 'AnzahlFall' and 'AnzahlTodesfall', and only
+    one row per Landkreis and date (the sum over all rows for that Landkreis
+    and date in the original data).
+
+    The csv file is read in chunks of `chunksize` rows, and every chunk is
+    summed up before the next one is read, so that the row-level data (millions
+    of rows) is never held in memory at once. Region names and dates are read
+    as categories, and only the distinct dates are parsed.
+    """
+    path, _ = download.download(rki_url, "rki.csv")
+    keys = ["Landkreis", "Bundesland", "Meldedatum"]
+    counts = ["AnzahlFall", "AnzahlTodesfall"]
+
+    totals = []
+    reader = pd.read_csv(path, usecols=keys + counts, chunksize=chunksize,
+                         dtype={"Landkreis": "category", "Bundesland": "category",
+                                "Meldedatum": "category",
+                                "AnzahlFall": np.int64, "AnzahlTodesfall": np.int64})
+    for chunk in reader:
+        totals.append(chunk.groupby(keys, observed=True)[counts].sum().reset_index())
+
+    # the same Landkreis and date can appear in several chunks
+    germany = pd.concat(totals).groupby(keys, observed=True)[counts].sum().reset_index()
+    germany["Meldedatum"] = germany["Meldedatum"].astype("category")
+    dates = pd.to_datetime(germany["Meldedatum"].cat.categories)
+    germany.index = pd.DatetimeIndex(dates[germany["Meldedatum"].cat.codes], name="date")
+    germany = germany.drop(columns="Meldedatum")
+
+    # see fetch_data_germany
+    if include_last_day == False:
+        germany = germany[germany.index != germany.index.max()]
+
+    return germany
+
+
 def pad_cumulative_series_to_yesterday(series):
     """Given a time series with date as index and cumulative cases/deaths as values:
 
@@ -340,6 +686,7 @@ def pad_cumulative_series_to_yesterday(series):
     data point is the last one for which data is provided.
     """
     now = datetime.datetime.now()
+    import pytz
     rki_tz = pytz.timezone('Europe/Berlin')
     now_tz = datetime.datetime.now(rki_tz)
 
@@ -359,6 +706,102 @@ def pad_cumulative_series_to_yesterday(series):
         return series
 
 
+def build_germany_tables(germany):
+    """Given the data from the Robert Koch Institute (see fetch_data_germany
+    or fetch_data_germany_totals),
+    return dictionary with datastore.RegionTable objects of cumulative cases
+    and deaths for each Landkreis and each Bundesland:
+
+    {"rki-landkreis-cases": ..., "rki-landkreis-deaths": ...,
+     "rki-bundesland-cases": ..., "rki-bundesland-deaths": ...}
+
+    All tables share one daily date axis. As the RKI only provides rows for
+    days where numbers change, the tables also record the first and last day
+    with data for each region.
+
+    The table for the Landkreise contains the Bundesland for each Landkreis
+    in its meta data.
+    """
+    dates = pd.DatetimeIndex(germany.index)
+    if dates.tz is not None:
+        dates = dates.tz_localize(None)
+    days = dates.values.astype("datetime64[D]")
+    day0 = days.min()
+    n_days = int((days.max() - day0).astype(int)) + 1
+    day_index = (days - day0).astype(int)
+    date_axis = day0 + np.arange(n_days)
+
+    tables = {}
+    for level, column in [("landkreis", "Landkreis"), ("bundesland", "Bundesland")]:
+        codes, labels = pd.factorize(germany[column], sort=True)
+        n_regions = len(labels)
+        flat_index = codes * n_days + day_index
+
+        # any rows for this region and date?
+        has_data = np.bincount(flat_index, minlength=n_regions * n_days) > 0
+        has_data = has_data.reshape(n_regions, n_days)
+        first = has_data.argmax(axis=1)
+        last = n_days - 1 - has_data[:, ::-1].argmax(axis=1)
+
+        if level == "landkreis":
+            meta = germany[["Landkreis", "Bundesland"]].drop_duplicates("Landkreis")
+            meta = meta.set_index("Landkreis").loc[labels]
+        else:
+            meta = None
+
+        for kind, value_column in [("cases", "AnzahlFall"), ("deaths", "AnzahlTodesfall")]:
+            daily = np.bincount(flat_index, weights=germany[value_column].values,
+                                minlength=n_regions * n_days)
+            cumulative = daily.reshape(n_regions, n_days).cumsum(axis=1).round().astype(np.int64)
+            tables[f"rki-{level}-{kind}"] = datastore.RegionTable(
+                labels=labels, dates=date_axis, values=cumulative, meta=meta,
+                index_name=column, first=first, last=last)
+    return tables
+
+
+def get_germany_table(level, kind):
+    """Return datastore.RegionTable with cumulative numbers for `kind`
+    ("cases" or "deaths") for all regions of `level` ("landkreis" or "bundesland")
+    in Germany.
+
+    The tables are computed once from the data of fetch_data_germany_totals
+    (see build_germany_tables) and kept in the store; they are only
+    re-computed when the data has been fetched again.
+    """
+    name = f"rki-{level}-{kind}"
+    source_version = fetch_data_germany_last_execution()
+    table = datastore.load_table(name)
+    if table is None or table.source_version != source_version:
+        tables = build_germany_tables(fetch_data_germany_totals())
+        for table_name, t in tables.items():
+            t.source_version = source_version
+            datastore.save_table(table_name, t)
+        table = tables[name]
+    return table
+
+
+def get_germany_tables():
+    """Return dictionary with all tables of build_germany_tables, computing
+    them if necessary.
+
+    The tables are memory-mapped from the store, so that all processes that
+    open them share one copy of the data in memory. Call this once before
+    starting parallel workers: the workers then only open the tables, and
+    never need the row-level data from fetch_data_germany.
+    """
+    return {f"rki-{level}-{kind}": get_germany_table(level, kind)
+            for level in ["landkreis", "bundesland"]
+            for kind in ["cases", "deaths"]}
+
+
+def get_germany_regions():
+    """Return sorted list of [Bundesland, Landkreis] for all Landkreise in the
+    RKI data (from the tables in the store, see get_germany_table)."""
+    bundesland = get_germany_table("landkreis", "cases").meta["Bundesland"]
+    return sorted([land, kreis] for kreis, land in bundesland.items())
+
+
+@_cached_region("rki")
 def germany_get_region(state=None, landkreis=None, pad2yesterday=False):
     """ Returns cases and deaths time series for Germany, and a label for the state/kreis.
 
@@ -368,10 +811,13 @@ def germany_get_region(state=None, landkreis=None, pad2yesterday=False):
 
     Landkreis seems unique, so there is no need to provide state and Landkreis.
 
+    The series have one value per day, from the first to the last day for which
+    the RKI has reported data for the region (see get_germany_table). On days
+    without a report, the (cumulative) value is that of the report before.
+
     [Should tidy up names here; maybe go to region and subregion in the function argument name, and
     translate later.]
     """
-    germany = fetch_data_germany()
     """Returns two time series: (cases, deaths)"""
     assert state or landkreis, "Need to provide a value for state or landkreis"
 
@@ -380,54 +826,32 @@ def germany_get_region(state=None, landkreis=None, pad2yesterday=False):
         """We need to check if this is important."""
 
     if state:
-        assert state in germany['Bundesland'].values, \
-            f"{state} not in available German states. These are {sorted(germany['Bundesland'].drop_duplicates())}"
-
-        land = germany[germany['Bundesland'] == state]
-        land = land.set_index(pd.to_datetime(land['Meldedatum']))
-        land.index.name = 'date'
-        land.sort_index(inplace=True)
-
-        # group over multiple rows for the same date
-        # (this will also group over the different landkreise in the state)
-        cases = land["AnzahlFall"].groupby('date').agg('sum').cumsum()
-        region_label = f'Germany-{state}'
-        cases.name = region_label + " cases"
+        cases_table = get_germany_table("bundesland", "cases")
+        assert state in cases_table, \
+            f"{state} not in available German states. These are {sorted(cases_table.labels)}"
+        region, region_label = state, f'Germany-{state}'
 
-        # group over all multiple entries per day
-        deaths = land["AnzahlTodesfall"].groupby('date').agg('sum').cumsum()
-        deaths.name = region_label + " deaths"
+    elif landkreis:
+        cases_table = get_germany_table("landkreis", "cases")
+        assert landkreis in cases_table, \
+            f"{landkreis} not in available German Landkreise. These are {sorted(cases_table.labels)}"
+        region, region_label = landkreis, f'Germany-{landkreis}'
 
-        if pad2yesterday:
-            deaths = pad_cumulative_series_to_yesterday(deaths)
-            cases = pad_cumulative_series_to_yesterday(cases)
-
-        return cases, deaths, region_label
-
-    if landkreis:
-        assert landkreis in germany['Landkreis'].values, \
-            f"{state} not in available German states. These are {sorted(germany['Landkreis'].drop_duplicates())}"
-
-        lk = germany[germany["Landkreis"] == landkreis]
-        lk.index = pd.to_datetime(lk['Meldedatum'])
-        lk.index.name = 'date'
-        lk = lk.sort_index()
-
-        cases = lk["AnzahlFall"].groupby('date').agg('sum').cumsum()
-        region_label = f'Germany-{landkreis}'
-        cases.name = region_label + ' cases'
-
-        deaths = lk["AnzahlTodesfall"].groupby('date').agg('sum').cumsum()
-        deaths.name = region_label + ' deaths'
+    else:
+        raise NotImplemented("Should never get to this point.")
 
-        if pad2yesterday:
-            deaths = pad_cumulative_series_to_yesterday(deaths)
-            cases = pad_cumulative_series_to_yesterday(cases)
+    deaths_table = get_germany_table("landkreis" if landkreis else "bundesland", "deaths")
 
-        return cases, deaths, region_label
+    cases = cases_table.series(region, name=region_label + " cases")
+    deaths = deaths_table.series(region, name=region_label + " deaths")
+    cases.index.name = 'date'
+    deaths.index.name = 'date'
 
-    raise NotImplemented("Should never get to this point.")
+    if pad2yesterday:
+        deaths = pad_cumulative_series_to_yesterday(deaths)
+        cases = pad_cumulative_series_to_yesterday(cases)
 
+    return cases, deaths, region_label
 
 
 @joblib_memory.cache
@@ -442,11 +866,12 @@ def fetch_data_hungary():
 
     Dataset does not contain the number of deaths in each county/capital city.
     """
-    datasource = r'https://raw.githubusercontent.com/sanbrock/covid19/master/datafile.csv'
+    datasource = hungary_url
 
     t0 = time.time()
     print(f"Please be patient - downloading data from {datasource} ...")
-    hungary = pd.read_csv(datasource)
+    path, _ = download.download(datasource, "hungary.csv")
+    hungary = pd.read_csv(path)
     delta_t = time.time() - t0
     print(f"Completed downloading {len(hungary)} rows in {delta_t:.1f} seconds.")
 
@@ -461,6 +886,107 @@ def fetch_data_hungary():
     return hungary
 
 
+def _data_files(sources):
+    """Return dictionary mapping local file name to url for all files of
+    `sources` (see refresh_data)."""
+    files = {}
+    if "jhu" in sources:
+        for filename in johns_hopkins_files.values():
+            files[filename] = os.path.join(base_url, filename)
+    if "rki" in sources:
+        files["rki.csv"] = rki_url
+    if "hungary" in sources:
+        files["hungary.csv"] = hungary_url
+    return files
+
+
+def refresh_data(sources=("jhu", "rki", "hungary"), workers=None, timeout=60,
+                 retries=2, progress=False):
+    """Check the upstream data sources for new data, and only download and
+    process the data that has changed. Use this instead of clear_cache() to
+    update the data.
+
+    - sources: any of "jhu" (Johns Hopkins), "rki" (Robert Koch Institute,
+      Germany) and "hungary"
+
+    All files are downloaded concurrently (see download.download_many for
+    `workers`, `timeout`, `retries` and `progress`).
+
+    Returns dictionary mapping each source to True if its data has changed.
+    """
+    downloaded = download.download_many(_data_files(sources), workers=workers,
+                                        timeout=timeout, retries=retries,
+                                        progress=progress)
+    changed = {}
+    if "jhu" in sources:
+        changed["jhu"] = False
+        for name, filename in johns_hopkins_files.items():
+            changed["jhu"] |= refresh_johns_hopkins(name, downloaded[filename])
+        if changed["jhu"]:
+            fetch_deaths_last_execution.clear(warn=False)
+            fetch_cases_last_execution.clear(warn=False)
+
+    if "rki" in sources:
+        changed["rki"] = downloaded["rki.csv"][1]
+        if changed["rki"]:
+            fetch_data_germany.clear(warn=False)
+            fetch_data_germany_last_execution.clear(warn=False)
+
+    if "hungary" in sources:
+        changed["hungary"] = downloaded["hungary.csv"][1]
+        if changed["hungary"]:
+            fetch_data_hungary.clear(warn=False)
+            fetch_data_hungary_last_execution.clear(warn=False)
+
+    return changed
+
+
+def prefetch_data(sources=("jhu", "rki", "hungary"), workers=None, timeout=60,
+                  retries=2, progress=True):
+    """Download all data (concurrently, see refresh_data) and prepare the
+    tables used by the plots, so that creating the first report doesn't
+    have to wait for any downloads or processing.
+
+    If the data of a source can not be downloaded (e.g. the server is down),
+    a warning is logged and the data downloaded before is used.
+
+    Returns dictionary mapping each source to True if its data has changed.
+    """
+    if not sources:
+        return {}
+
+    # refresh every source on its own, so that a failing one does not keep
+    # the others from being updated
+    with concurrent.futures.ThreadPoolExecutor(max_workers=len(sources)) as pool:
+        futures = {source: pool.submit(refresh_data, (source,), workers=workers,
+                                       timeout=timeout, retries=retries,
+                                       progress=progress)
+                   for source in sources}
+
+    changed = {}
+    for source, future in futures.items():
+        try:
+            changed[source] = future.result()[source]
+        except Exception as e:
+            logging.warning(f"Could not refresh the {source} data, using the "
+                            f"data downloaded before: {e}")
+            changed[source] = False
+
+        try:
+            if source == "jhu":
+                get_country_table("cases")
+                get_country_table("deaths")
+                get_US_tables()
+            elif source == "rki":
+                get_germany_tables()
+            elif source == "hungary":
+                fetch_data_hungary()
+        except Exception as e:
+            logging.warning(f"No {source} data available: {e}")
+
+    return changed
+
+
 def get_counties_hungary():
     # return fetch_data_hungary().columns[1:]
     return ['Bács-Kiskun', 'Baranya', 'Békés', 'Borsod-Abaúj-Zemplén', 'Budapest', 'Csongrád', 'Fejér',
@@ -468,6 +994,7 @@ def get_counties_hungary():
             'Somogy', 'Szabolcs-Szatmár-Bereg', 'Tolna', 'Vas', 'Veszprém', 'Zala']
 
 
+@_cached_region("hungary")
 def get_region_hungary(county):
     """
     Returns cases int time series and label for county in Hungary.
@@ -508,7 +1035,7 @@ def plot_time_step(ax, series, style="-", labels=None, logscale=True):
         ax.set_yscale('log')
     ax.legend()
     ax.set_ylabel("total numbers")
-    ax.yaxis.set_major_formatter(ScalarFormatter())
+    ax.yaxis.set_major_formatter(matplotlib.ticker.ScalarFormatter())
     return ax
 
 
@@ -554,7 +1081,7 @@ def compute_daily_change(series):
     return change, smooth, smooth2
 
 
-def plot_daily_change(ax, series, color, labels=None):
+def plot_daily_change(ax, series, color, labels=None, derived=None):
     """Given a series of data and matplotlib axis ax, plot the
     - difference in the series data from day to day as bars and plot a smooth
     - line to show the overall development
@@ -562,6 +1089,7 @@ def plot_daily_change(ax, series, color, labels=None):
     - series is pandas.Series with data as index, and cumulative cases (or
     deaths)
     - color is color to be used for plotting
+    - derived is the OverviewSeries of series (computed if not given)
 
     See plot_time_step for documentation on other parameters.
     """
@@ -575,8 +1103,10 @@ def plot_daily_change(ax, series, color, labels=None):
 
     ax_label = region + " new " + label
 
+    if derived is None:
+        derived = OverviewSeries(series)
     (change, change_label) , (smooth, smooth_label), \
-        (smooth2, smooth2_label) = compute_daily_change(series)
+        (smooth2, smooth2_label) = derived.daily_change
 
     ax.bar(change.index, change.values, color=color,
            label=ax_label, alpha=bar_alpha, linewidth=LW)
@@ -605,7 +1135,8 @@ def plot_daily_change(ax, series, color, labels=None):
 
 
 
-def compute_doubling_time(series, minchange=0.5, labels=None, debug=False):
+def compute_doubling_time(series, minchange=0.5, labels=None, debug=False,
+                          daily_change=None):
 
     """
     Compute and return doubling time of (assumed exponential) growth, based on two
@@ -625,6 +1156,9 @@ def compute_doubling_time(series, minchange=0.5, labels=None, debug=False):
     If there is not enough data to compute the doubling time, returns
     ((None, message), (None, None)) where 'message' provides
     data for debugging the analysis.
+
+    daily_change is the result of compute_daily_change(series), if already
+    known.
     """
 
     if labels is None:
@@ -636,7 +1170,9 @@ def compute_doubling_time(series, minchange=0.5, labels=None, debug=False):
 
     # only keep values where there is a change of a minumum number
     # get rid of data points where change is small values
-    (f, f_label) , (change_smoothed, smoothed_label), _ = compute_daily_change(series)
+    if daily_change is None:
+        daily_change = compute_daily_change(series)
+    (f, f_label) , (change_smoothed, smoothed_label), _ = daily_change
     sel = change_smoothed < minchange
     reduced = series.drop(f[sel].index, inplace=False)
     if len(reduced) <= 1:   # no data left
@@ -692,12 +1228,16 @@ def compute_doubling_time(series, minchange=0.5, labels=None, debug=False):
     return (dtime, dtime_label), (dtime_smooth, dtime_smooth_label)
 
 
-def plot_doubling_time(ax, series, color, minchange=0.5, labels=None, debug=False):
+def plot_doubling_time(ax, series, color, minchange=0.5, labels=None, debug=False,
+                       derived=None):
     """Plot doubling time of series, assuming series is accumulated cases/deaths as
     function of days.
 
     Returns axis.
 
+    derived is the OverviewSeries of series (computed if not given, its
+    labels and minchange are used if given).
+
     See plot_time_step for documentation on other parameters.
     """
 
@@ -705,8 +1245,9 @@ def plot_doubling_time(ax, series, color, minchange=0.5, labels=None, debug=Fals
         labels = "", ""
     region, label = labels
 
-    (dtime, dtime_label), (dtime_smooth, dtime_smooth_label) = \
-        compute_doubling_time(series, minchange=minchange, debug=debug, labels=labels)
+    if derived is None:
+        derived = OverviewSeries(series, labels=labels, minchange=minchange, debug=debug)
+    (dtime, dtime_label), (dtime_smooth, dtime_smooth_label) = derived.doubling_time
 
     if dtime is None:
         if debug:
@@ -731,7 +1272,7 @@ def plot_doubling_time(ax, series, color, minchange=0.5, labels=None, debug=Fals
     return ax
 
 
-def compute_growth_factor(series):
+def compute_growth_factor(series, daily_change=None):
     """returns (growth, smooth)
 
     where 'growth' is a tuple of (series, label)
@@ -740,11 +1281,15 @@ def compute_growth_factor(series):
     'growth' returns the raw data (with nan's dropped)
     'smooth' makes the data smoother
 
+    daily_change is the result of compute_daily_change(series), if already
+    known.
     """
 
     # start from smooth diffs as used in plot 1
+    if daily_change is None:
+        daily_change = compute_daily_change(series)
     (change, change_label) , (smooth, smooth_label), \
-        (smooth2, smooth2_label) = compute_daily_change(series)
+        (smooth2, smooth2_label) = daily_change
 
     # Compute ratio of yesterday to day
     f = smooth.pct_change() + 1  # compute ratio of subsequent daily changes
@@ -865,13 +1410,14 @@ def min_max_in_past_n_days(series, n, at_least = [0.75, 1.25], alert=[0.1, 100],
 
 def plot_reproduction_number(ax, series, color_g='C1', color_R='C4',
                              yscale_days=28, max_yscale=10,
-                             labels=None):
+                             labels=None, derived=None):
     """
     - series is expected to be time series of cases or deaths
     - label is 'cases' or 'deaths' or whatever is desired as the description
     - country is the name of the region/country
     - color_g is the colour for the growth factor
     - color_R is the colour for the reproduction number
+    - derived is the OverviewSeries of series (computed if not given)
 
     See plot_time_step for documentation on other parameters.
     """
@@ -881,8 +1427,10 @@ def plot_reproduction_number(ax, series, color_g='C1', color_R='C4',
     else:
         region, label = labels
 
+    if derived is None:
+        derived = OverviewSeries(series)
      # get smooth data for growth factor from plot 1 to base this plot on
-    (f, f_label) , (f_smoothed, smoothed_label) = compute_growth_factor(series)
+    (f, f_label) , (f_smoothed, smoothed_label) = derived.growth_factor
 
     label_ = region + " " + label + " daily growth factor " + f_label
     ax.plot(f.index, f.values, 'o', color=color_g, alpha=0.3, label=label_)
@@ -892,12 +1440,7 @@ def plot_reproduction_number(ax, series, color_g='C1', color_R='C4',
             alpha=0.7)
 
 
-    # data for computation or R
-    smooth_diff = series.diff().rolling(7,
-                                        center=True,
-                                        win_type='gaussian').mean(std=4)
-
-    R = compute_R(smooth_diff)
+    R = derived.R
     ax.plot(R.index, R, "-", color=color_R,
             label=region + f" estimated R (using {label})",
             linewidth=4.5, alpha=1)
@@ -928,6 +1471,18 @@ def plot_reproduction_number(ax, series, color_g='C1', color_R='C4',
 
 
 
+def _country_data_source(country, region=None, subregion=None, **kwargs):
+    """Return the data source used by get_country_data (see _data_version)."""
+    if country.lower() == 'germany' and (region is not None or subregion is not None):
+        return "rki"
+    elif country.lower() == 'us' and region is not None:
+        return "jhu-us"
+    elif country.lower() == 'hungary' and region is not None:
+        return "hungary"
+    return "jhu"
+
+
+@_cached_region(_country_data_source)
 def get_country_data(country, region=None, subregion=None, verbose=False, pad_RKI_data_to_yesterday=True):
     """Given the name of a country, get the Johns Hopkins data for cases and deaths,
     and return them as a tuple of pandas.Series objects and a string describing the region:
@@ -938,8 +1493,8 @@ def get_country_data(country, region=None, subregion=None, verbose=False, pad_RK
     the region is provided, the data from all subregions in that region is
     accumulated.
 
-    If the country is "US", get US data (states are available as regions) from Johns Hopkins
-    repository.
+    If the country is "US", get US data (states are available as regions, and
+    counties as subregions) from Johns Hopkins repository.
 
     Returns "cases, deaths, country_region" where country region is a string
     describing the country and region.
@@ -960,6 +1515,7 @@ def get_country_data(country, region=None, subregion=None, verbose=False, pad_RK
     from RKI), so the numbers for the a particular date may increase after one
     or two days (or even later in extreme cases).
 
+    The results are kept in region_cache until the data is fetched again.
     """
 
     if country.lower() == 'germany':
@@ -972,8 +1528,11 @@ def get_country_data(country, region=None, subregion=None, verbose=False, pad_RK
                                                       pad2yesterday=pad_RKI_data_to_yesterday)
     elif country.lower() == 'us' and region != None:
         # load US data
-        c, d = get_region_US(region)
-        country_region = f"United States: {region}"
+        c, d = get_region_US(region, county=subregion)
+        if subregion is None:
+            country_region = f"United States: {region}"
+        else:
+            country_region = f"United States: {subregion} ({region})"
 
     elif country.lower() == 'hungary':
         # region -> térség
@@ -1006,42 +1565,133 @@ def get_country_data(country, region=None, subregion=None, verbose=False, pad_RK
         print(f"get_country_data: deaths[{len_deaths1}] -> [{len_deaths2}]")
     return c, d, country_region
 
+class OverviewSeries:
+    """All series derived from one cumulative series (cases or deaths) that
+    the overview plots show. Each is computed once, and shared by the plot
+    functions (instead of computing the daily change for each of them):
+
+    - daily_change: see compute_daily_change
+    - growth_factor: see compute_growth_factor
+    - R: estimated reproduction number, see compute_R
+    - doubling_time: see compute_doubling_time (uses labels and minchange)
+    """
+
+    def __init__(self, series, labels=None, minchange=0.5, debug=False):
+        self.series = series
+        self.daily_change = compute_daily_change(series)
+        self.growth_factor = compute_growth_factor(series, daily_change=self.daily_change)
+
+        # data for computation or R
+        smooth_diff = series.diff().rolling(7,
+                                            center=True,
+                                            win_type='gaussian').mean(std=4)
+        self.R = compute_R(smooth_diff)
+
+        self.doubling_time = compute_doubling_time(series, minchange=minchange,
+                                                   labels=labels, debug=debug,
+                                                   daily_change=self.daily_change)
+
+
+class OverviewData:
+    """Data of one region for the overview plots and the table of its report:
+    cases, deaths (None if not available), region_label, and the derived
+    series of cases and deaths (OverviewSeries, or None).
+
+    Create it once, and pass it to overview to reuse it:
+
+        data = OverviewData("Germany", subregion="LK Pinneberg")
+        overview("Germany", subregion="LK Pinneberg", data=data)
+        table = data.table()
+    """
+
+    def __init__(self, country, region=None, subregion=None):
+        self.country = country
+        self.region = region
+        self.subregion = subregion
+        self.cases, self.deaths, self.region_label = \
+            get_country_data(country, region=region, subregion=subregion)
+
+        self.cases_derived = OverviewSeries(self.cases, labels=(self.region_label, "cases"))
+        self.deaths_derived = None
+        if self.deaths is not None:
+            self.deaths_derived = OverviewSeries(self.deaths,
+                                                 labels=(self.region_label, "deaths"))
+
+    def table(self):
+        """Return table of cases and deaths, see compose_dataframe_summary."""
+        return compose_dataframe_summary(self.cases, self.deaths)
+
+
 #######################
 
+def _day_numbers(index):
+    """Return integer array with the number of days since the first date of
+    DatetimeIndex `index` (whole days, rounded down)."""
+    nanoseconds = index.asi8 - index.asi8[0]
+    return nanoseconds // pd.Timedelta(days=1).value
+
+
 def day0atleast(v0, series):
-    try:
-        day0 = series[series > v0].index[0]
-    except IndexError:  # means no days found for which series.values > v0
+    """Return series with integer index: the number of days since the first
+    day with a value > v0 (empty series if there is none)."""
+    above = np.flatnonzero(series.values > v0)
+    if len(above) == 0:  # means no days found for which series.values > v0
         # print(f"Haven't found value > {v0} is Series {series.name}")
         result = pd.Series(dtype=object)
         return result
 
-    # compute timedelta
-    timedelta = series.index - day0
-    # convert to int as index
-    t = pd.to_numeric(timedelta.astype("timedelta64[D]").astype(int))
+    days = _day_numbers(series.index)
+    t = pd.Index(days - days[above[0]], name=series.index.name)
     # Assemble new series
     result = pd.Series(index=t, data=series.values)
 
     return result
 
 
-
-
 def align_sets_at(v0, df):
     """Accepts data frame, and aligns so that all enttries close to v0 are on the same row.
 
     Returns new dataframe with integer index (representing days after v0).
+    Columns that never exceed v0 contain only NaN.
     """
-    res = pd.DataFrame()
+    values = df.to_numpy(dtype=float)
+    if values.size == 0:
+        return pd.DataFrame(columns=df.columns, dtype=float)
+
+    # first row in which each column exceeds v0 (if any)
+    above = values > v0
+    crossing = above.any(axis=0)
+    first = above.argmax(axis=0)
 
-    for col in df.columns:
-        # res[col] = day0for(v0, df[col])
-        series = day0atleast(v0, df[col])
-        series.name = col
-        res = pd.merge(res, series, how='outer', left_index=True, right_index=True)
+    # days after v0 for every row (rows) and column (columns)
+    days = _day_numbers(df.index)
+    t = days[:, np.newaxis] - days[first][np.newaxis, :]
+    t = t[:, crossing]
 
-    return res
+    index = np.unique(t)
+    rows = np.searchsorted(index, t)
+    columns = np.broadcast_to(np.flatnonzero(crossing), t.shape)
+
+    res = np.full((len(index), df.shape[1]), np.nan)
+    res[rows, columns] = values[:, crossing]
+
+    return pd.DataFrame(res, index=pd.Index(index, name=df.index.name),
+                        columns=df.columns)
+
+
+def compare_data_from_frame(frame, rolling=7):
+    """Given a DataFrame with accumulated numbers (one column per region, for
+    example from RegionTable.frame), return DataFrame with the smoothed daily
+    change of all columns, computed for all of them at once.
+
+    The result only contains the dates for which the first column has data.
+    """
+    if frame.shape[1] == 0:
+        return pd.DataFrame()
+
+    df = frame.diff().rolling(rolling, center=True).mean()
+    first = frame.iloc[:, 0]
+    return df.loc[first.first_valid_index():first.last_valid_index()]
 
 
 def get_compare_data(countrynames, rolling=7):
@@ -1052,14 +1702,9 @@ def get_compare_data(countrynames, rolling=7):
     - any zero values are removed for italy (data error)
     - apply some smoothing
     """
-    df_c = pd.DataFrame()
-    df_d = pd.DataFrame()
-
-    for countryname in countrynames:
-        c, d = get_country_data_johns_hopkins(countryname)
-
-        df_c[countryname] = c.diff().rolling(rolling, center=True).mean()  # cases
-        df_d[countryname] = d.diff().rolling(rolling, center=True).mean()  # deaths
+    countrynames = list(dict.fromkeys(countrynames))
+    df_c = compare_data_from_frame(get_country_table("cases").frame(countrynames), rolling)
+    df_d = compare_data_from_frame(get_country_table("deaths").frame(countrynames), rolling)
 
     return df_c, df_d
 
@@ -1116,7 +1761,7 @@ def plot_logdiff_time(ax, df, xaxislabel, yaxislabel, style="", labels=True, lab
     ax.set_yscale('log')
     # use integer numbers for values > 1, and decimal presentation below
     # from https://stackoverflow.com/questions/21920233/matplotlib-log-scale-tick-label-number-formatting/33213196
-    ax.yaxis.set_major_formatter(FuncFormatter(lambda y, _: '{:g}'.format(y)))
+    ax.yaxis.set_major_formatter(matplotlib.ticker.FuncFormatter(lambda y, _: '{:g}'.format(y)))
     # ax.set_xscale('log')    # also interesting
     ax.set_ylim(bottom=set_y_axis_limit(df, v0))
     ax.set_xlim(left=-1)  #ax.set_xlim(-1, df.index.max())
@@ -1144,9 +1789,18 @@ def set_y_axis_limit(data, current_lim):
     else:
         return current_lim
 
-def make_compare_plot(main_country, compare_with=["Germany", "Australia", "Poland", "Korea, South",
-                                                  "Belarus", "Switzerland", "US"],
-                     v0c=10, v0d=3):
+# Regions shown in the comparison plots of every country / German Landkreis
+COMPARE_WITH = ["Germany", "Australia", "Poland", "Korea, South",
+                "Belarus", "Switzerland", "US"]
+COMPARE_WITH_LOCAL_GERMANY = ['Bayern',
+                              'Berlin', 'Bremen',
+                              'Hamburg', 'Hessen',
+                              'Nordrhein-Westfalen',
+                              'Sachsen-Anhalt']
+
+
+def make_compare_plot(main_country, compare_with=COMPARE_WITH,
+                     v0c=10, v0d=3, pyplot=True):
     rolling = 7
     df_c, df_d = get_compare_data([main_country] + compare_with, rolling=rolling)
     res_c = align_sets_at(v0c, df_c)
@@ -1161,7 +1815,7 @@ def make_compare_plot(main_country, compare_with=["Germany", "Australia", "Polan
     res_c = res_c.interpolate(method='linear', limit=3)
     res_d = res_d.interpolate(method='linear', limit=3)
 
-    fig, axes = plt.subplots(2, 1, figsize=(10, 6))
+    fig, axes = _subplots(2, 1, figsize=(10, 6), pyplot=pyplot)
     ax=axes[0]
     plot_logdiff_time(ax, res_c, f"days since {v0c} cases",
                       "daily new cases\n(rolling 7-day mean)",
@@ -1231,18 +1885,27 @@ def get_compare_data_germany(region_subregion, compare_with_local, rolling=7):
 
     See unpack_region_subregion for details on region_subregion.
     """
-    df_c = pd.DataFrame()
-    df_d = pd.DataFrame()
-
-    for reg_subreg in [region_subregion] + compare_with_local:
-
-        region, subregion = unpack_region_subregion(reg_subreg)
-        c, d, country_subregion = germany_get_region(state=region, landkreis=subregion)
-
-        label = label_from_region_subregion((region, subregion))
-        df_c[label] = c.diff().rolling(rolling, center=True).mean()  # cases
-        df_d[label] = d.diff().rolling(rolling, center=True).mean()  # deaths
-
+    regions = [unpack_region_subregion(reg_subreg)
+               for reg_subreg in [region_subregion] + compare_with_local]
+
+    # labels of the regions in the tables of each level
+    labels = {"landkreis": {}, "bundesland": {}}
+    for region, subregion in regions:
+        if region and subregion:
+            raise NotImplementedError("Try to use 'None' for the state.")
+        labels["landkreis" if subregion else "bundesland"][subregion or region] = None
+    # ... which are also the labels of the columns
+    columns = list(dict.fromkeys(map(label_from_region_subregion, regions)))
+
+    result = []
+    for kind in ["cases", "deaths"]:
+        frame = pd.concat([get_germany_table(level, kind).frame(list(names))
+                           for level, names in labels.items() if names], axis=1)
+        frame = frame[columns]
+        frame.index.name = 'date'
+        result.append(compare_data_from_frame(frame, rolling))
+
+    df_c, df_d = result
     return df_c, df_d
 
 
@@ -1256,30 +1919,28 @@ def get_compare_data_hungary(region, compare_with_local: list, rolling=7):
     - apply some smoothing
 
     """
-    df_c = pd.DataFrame()
-    # df_d = pd.DataFrame()
-    for reg in [region] + compare_with_local:
-        c, d, country_subregion = get_region_hungary(county=reg)
-        label = str(reg)
-        df_c[label] = c.diff().rolling(rolling, center=True).mean()  # cases
-        # df_d[label] = d.diff().rolling(rolling, center=True).mean()  # deaths
+    counties = list(dict.fromkeys([region] + compare_with_local))
+    for county in counties:
+        if county not in get_counties_hungary():
+            raise ValueError(f'{county} must be one of: \n{get_counties_hungary()}')
+
+    hungary = fetch_data_hungary()
+    hungary = hungary.set_index(pd.to_datetime(hungary['Dátum']))
+    df_c = compare_data_from_frame(hungary[counties].astype(float), rolling)
+    df_c.columns = [str(county) for county in counties]
     return df_c, None
 
 
 def make_compare_plot_germany(region_subregion,
                               compare_with=[],  # "China", "Italy", "Germany"],
-                              compare_with_local=['Bayern',
-                                                  'Berlin', 'Bremen',
-                                                  'Hamburg', 'Hessen',
-                                                  'Nordrhein-Westfalen',
-                                                  'Sachsen-Anhalt'],
+                              compare_with_local=COMPARE_WITH_LOCAL_GERMANY,
     # The 'compare_with_local' subset is chosen to look sensibly on 2 May 2020.
     #                          compare_with_local=['Baden-Württemberg', 'Bayern', 'Berlin',
     #                                              'Brandenburg', 'Bremen', 'Hamburg',
     #                                              'Hessen', 'Mecklenburg-Vorpommern', 'Niedersachsen',
     #                                              'Nordrhein-Westfalen', 'Rheinland-Pfalz', 'Saarland',
     #                                              'Sachsen', 'Sachsen-Anhalt', 'Schleswig-Holstein',  'Thüringen'],
-                              v0c=10, v0d=1):
+                              v0c=10, v0d=1, pyplot=True):
     rolling = 7
     region, subregion = unpack_region_subregion(region_subregion)
     df_c1, df_d1 = get_compare_data_germany((region, subregion), compare_with_local, rolling=rolling)
@@ -1304,7 +1965,7 @@ def make_compare_plot_germany(region_subregion,
     res_d = res_d.interpolate(method='linear', limit=7)
 
 
-    fig, axes = plt.subplots(2, 1, figsize=(10, 6))
+    fig, axes = _subplots(2, 1, figsize=(10, 6), pyplot=pyplot)
     ax=axes[0]
     plot_logdiff_time(ax, res_c, f"days since {v0c} cases",
                       "daily new cases\n(rolling 7-day mean)",
@@ -1343,7 +2004,7 @@ def choose_random_counties(exclude_region, size) -> list:
     return choosen
 
 
-def make_compare_plot_hungary(region: str, compare_with_local: list, v0c=10):
+def make_compare_plot_hungary(region: str, compare_with_local: list, v0c=10, pyplot=True):
     rolling = 7
 
     df_c1, _ = get_compare_data_hungary(region, compare_with_local, rolling=rolling)
@@ -1356,7 +2017,7 @@ def make_compare_plot_hungary(region: str, compare_with_local: list, v0c=10):
     res_c = align_sets_at(v0c, df_c1)
     res_c = res_c.interpolate(method='linear', limit=7)
 
-    fig, axes = plt.subplots(2, 1, figsize=(10, 6))
+    fig, axes = _subplots(2, 1, figsize=(10, 6), pyplot=pyplot)
     plot_logdiff_time(axes[0], res_c, f"days since {v0c} cases",
                       "daily new cases\n(rolling 7-day mean)",
                       v0=v0c, highlight={res_c.columns[0]: "C1"}, labeloffset=0.5)
@@ -1384,26 +2045,43 @@ def plot_no_data_available(ax, mimic_subplot, text):
     ax.set_xticklabels([])
 
 
-def overview(country, region=None, subregion=None, savefig=False):
-    c, d, region_label = get_country_data(country, region=region, subregion=subregion)
+def overview(country, region=None, subregion=None, savefig=False, pyplot=True,
+             data=None):
+    """Create overview plots for region. Returns (axes, cases, deaths).
+
+    With pyplot=False, the figures are not created through pyplot (see
+    `_subplots`): use axes[0].figure and axes[-1].figure to access them.
+
+    data is the OverviewData of the region, if already computed (for
+    example to also show its table).
+    """
+    if data is None:
+        data = OverviewData(country, region=region, subregion=subregion)
+    c, d, region_label = data.cases, data.deaths, data.region_label
     print(c.name)
-    fig, axes = plt.subplots(6, 1, figsize=(10, 15), sharex=False)
+    fig, axes = _subplots(6, 1, figsize=(10, 15), sharex=False, pyplot=pyplot)
 
     plot_time_step(ax=axes[0], series=c, style="-C1", labels=(region_label, "cases"))
-    plot_daily_change(ax=axes[1], series=c, color="C1", labels=(region_label, "cases"))
+    plot_daily_change(ax=axes[1], series=c, color="C1", labels=(region_label, "cases"),
+                      derived=data.cases_derived)
     # data cleaning
     if country == "China":
         axes[1].set_ylim(0, 5000)
     elif country == "Spain":   # https://github.com/oscovida/oscovida/issues/44
         axes[1].set_ylim(bottom=0)
-    plot_reproduction_number(axes[3], series=c, color_g="C1", color_R="C5", labels=(region_label, "cases"))
-    plot_doubling_time(axes[5], series=c, color="C1", labels=(region_label, "cases"))
+    plot_reproduction_number(axes[3], series=c, color_g="C1", color_R="C5", labels=(region_label, "cases"),
+                             derived=data.cases_derived)
+    plot_doubling_time(axes[5], series=c, color="C1", labels=(region_label, "cases"),
+                       derived=data.cases_derived)
 
     if d is not None:
         plot_time_step(ax=axes[0], series=d, style="-C0", labels=(region_label, "deaths"))
-        plot_daily_change(ax=axes[2], series=d, color="C0", labels=(region_label, "deaths"))
-        plot_reproduction_number(axes[4], series=d, color_g="C0", color_R="C4", labels=(region_label, "deaths"))
-        plot_doubling_time(axes[5], series=d, color="C0", labels=(region_label, "deaths"))
+        plot_daily_change(ax=axes[2], series=d, color="C0", labels=(region_label, "deaths"),
+                          derived=data.deaths_derived)
+        plot_reproduction_number(axes[4], series=d, color_g="C0", color_R="C4", labels=(region_label, "deaths"),
+                                 derived=data.deaths_derived)
+        plot_doubling_time(axes[5], series=d, color="C0", labels=(region_label, "deaths"),
+                           derived=data.deaths_derived)
     if d is None:
         plot_no_data_available(axes[2], mimic_subplot=axes[1], text='daily change in deaths')
         plot_no_data_available(axes[4], mimic_subplot=axes[3], text='R & growth factor (based on deaths)')
@@ -1432,7 +2110,7 @@ def overview(country, region=None, subregion=None, savefig=False):
         fig.savefig(filename)
 
     if not subregion and not region: # i.e. not a region of Germany
-        axes_compare, res_c, res_d = make_compare_plot(country)
+        axes_compare, res_c, res_d = make_compare_plot(country, pyplot=pyplot)
         return_axes = np.concatenate([axes, axes_compare])
 
     elif country=="Germany":   # Germany specific plots
@@ -1440,23 +2118,24 @@ def overview(country, region=None, subregion=None, savefig=False):
         # We thus compare only against those Laender, that are in the data set:
         # germany = fetch_data_germany()
         # laender = list(germany['Bundesland'].drop_duplicates().sort_values())
-        axes_compare, res_c, red_d = make_compare_plot_germany((region, subregion))
+        axes_compare, res_c, red_d = make_compare_plot_germany((region, subregion), pyplot=pyplot)
         return_axes = np.concatenate([axes, axes_compare])
     elif country=="US" and region is not None:
-        # skip comparison plot for the US states at the moment
+        # skip comparison plot for the US states (and counties) at the moment
         return_axes = axes
         return return_axes, c, d
 
     elif country == 'Hungary':
         # choosing random counties. not sure if this make sense or not because not every county has enough data.
         with_local = choose_random_counties(exclude_region=region, size=18)
-        axes_compare, res_c, red_d = make_compare_plot_hungary(region, compare_with_local=with_local)
+        axes_compare, res_c, red_d = make_compare_plot_hungary(region, compare_with_local=with_local,
+                                                               pyplot=pyplot)
         return_axes = np.concatenate([axes, axes_compare])
         return return_axes, c, d
     else:
         raise NotImplementedError
 
-    fig2 = plt.gcf()
+    fig2 = axes_compare[0].figure
 
     if savefig:
         filename = os.path.join("figures", region_label.replace(" ", "-").replace(",", "-") + '2.svg')
@@ -1465,6 +2144,46 @@ def overview(country, region=None, subregion=None, savefig=False):
     return return_axes, c, d
 
 
+def overview_dependencies(country, region=None, subregion=None):
+    """Return the data that `overview(country, region, subregion)` uses, as
+    list of keys "source:region[:subregion]", with the region itself first.
+
+    Sources are "jhu" (countries), "jhu-us" (US states and counties), "rki"
+    (German Bundesländer and Landkreise) and "hungary". A key stands for all
+    data below it: "rki" is all RKI data, "rki:Bayern" includes "rki:Bayern:SK München".
+    """
+    if country == "Germany" and subregion is not None:
+        own = f"rki:{region}:{subregion}" if region else f"rki:{subregion}"
+        compare = [f"rki:{state}" for state in COMPARE_WITH_LOCAL_GERMANY]
+    elif country == "US" and region is not None:
+        # no comparison plot for the US states and counties
+        own = f"jhu-us:{region}:{subregion}" if subregion else f"jhu-us:{region}"
+        compare = []
+    elif country == "Hungary":
+        # compared with randomly chosen counties, i.e. potentially all of them
+        own, compare = f"hungary:{region}", ["hungary"]
+    elif not region and not subregion:
+        own = f"jhu:{country}"
+        compare = [f"jhu:{other}" for other in COMPARE_WITH]
+    else:
+        raise NotImplementedError
+
+    return [own] + [key for key in compare if key != own]
+
+
+def depends_on(dependencies, changed):
+    """Return True if any of the keys in `dependencies` (see
+    `overview_dependencies`) is affected by a change of any key in
+    `changed`, e.g. "rki:Bayern" is affected by a change of "rki" or of
+    "rki:Bayern:SK München"."""
+    for key in changed:
+        for dependency in dependencies:
+            if key == dependency or key.startswith(dependency + ":") or \
+                    dependency.startswith(key + ":"):
+                return True
+    return False
+
+
 def get_cases_last_week(cases):
     """Given cumulative cases time series, return the number of cases from the last week.
     """
@@ -0,0 +1,122 @@
+"""Synthetic data sets so that tests can run without network access."""
+
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import oscovida as c
+from oscovida import datastore, download
+
+#  the report generators are in tools/, which is not part of the package
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "tools"))
+
+
+def make_jhu_global_frame(days=60):
+    """Return DataFrame shaped like the Johns Hopkins global csv files."""
+    dates = pd.date_range("2020-01-22", periods=days)
+    rows = [(np.nan, "Germany", 51.0, 9.0, 1.20),
+            ("Hubei", "China", 30.9, 112.2, 1.15),
+            ("Beijing", "China", 40.1, 116.4, 1.10),
+            (np.nan, "Korea, South", 35.9, 127.7, 1.12),
+            (np.nan, "Australia", -25.0, 133.0, 1.09),
+            (np.nan, "Poland", 51.9, 19.1, 1.11),
+            (np.nan, "Belarus", 53.7, 27.9, 1.13),
+            (np.nan, "Switzerland", 46.8, 8.2, 1.14),
+            (np.nan, "US", 40.0, -100.0, 1.22),
+            ("Reunion", "France", -21.1, 55.5, 1.05),
+            (np.nan, "France", 46.2, 2.2, 1.18)]
+    records = []
+    for province, country, lat, long, rate in rows:
+        values = np.floor(rate ** np.arange(days)).astype(int)
+        records.append([province, country, lat, long] + list(values))
+    columns = ["Province/State", "Country/Region", "Lat", "Long"] + \
+        [f"{d.month}/{d.day}/{d.strftime('%y')}" for d in dates]
+    return pd.DataFrame(records, columns=columns)
+
+
+def make_jhu_US_frame(days=60, population=False):
+    """Return DataFrame shaped like the Johns Hopkins US csv files."""
+    dates = pd.date_range("2020-01-22", periods=days)
+    rows = [("Autauga", "Alabama", 1.10), ("Baldwin", "Alabama", 1.12),
+            ("Maui", "Hawaii", 1.05), ("Honolulu", "Hawaii", 1.08),
+            ("Bergen", "New Jersey", 1.15), ("Essex", "New Jersey", 1.14)]
+    records = []
+    for i, (county, state, rate) in enumerate(rows):
+        values = np.floor(rate ** np.arange(days)).astype(int)
+        meta = [84000000 + i, "US", "USA", 840, 1000.0 + i, county, state, "US",
+                30.0, -80.0, f"{county}, {state}, US"]
+        if population:
+            meta.append(50000 + i)
+        records.append(meta + list(values))
+    columns = ["UID", "iso2", "iso3", "code3", "FIPS", "Admin2", "Province_State",
+               "Country_Region", "Lat", "Long_", "Combined_Key"]
+    if population:
+        columns.append("Population")
+    columns += [f"{d.month}/{d.day}/{d.strftime('%y')}" for d in dates]
+    return pd.DataFrame(records, columns=columns)
+
+
+@pytest.fixture
+def jhu_offline(tmp_path, monkeypatch):
+    """Serve synthetic Johns Hopkins data from files in tmp_path, and use a
+    fresh local store."""
+    source = tmp_path / "jhu"
+    source.mkdir()
+    deaths = make_jhu_global_frame()
+    cases = deaths.copy()
+    cases.iloc[:, 4:] = cases.iloc[:, 4:] * 10
+    cases.to_csv(source / "time_series_covid19_confirmed_global.csv", index=False)
+    deaths.to_csv(source / "time_series_covid19_deaths_global.csv", index=False)
+    make_jhu_US_frame().to_csv(source / "time_series_covid19_confirmed_US.csv", index=False)
+    make_jhu_US_frame(population=True).to_csv(source / "time_series_covid19_deaths_US.csv",
+                                              index=False)
+
+    monkeypatch.setattr(c.oscovida, "base_url", str(source) + "/")
+    monkeypatch.setattr(datastore, "store_location", str(tmp_path / "store"))
+    monkeypatch.setattr(datastore, "_loaded", {})
+    monkeypatch.setattr(c.oscovida, "region_cache", c.oscovida.RegionCache())
+    monkeypatch.setattr(download, "download_location", str(tmp_path / "downloads"))
+    return source
+
+
+def make_rki_frame(days=40):
+    """Return DataFrame shaped like the data from the Robert Koch Institute:
+    one row per Landkreis, date and age group, only for days with reports."""
+    rng = np.random.RandomState(0)
+    kreise = [("Hamburg", "SK Hamburg"), ("Bayern", "SK München"),
+              ("Bayern", "LK Rosenheim"), ("Berlin", "SK Berlin Mitte"),
+              ("Hessen", "SK Frankfurt am Main"), ("Bremen", "SK Bremen"),
+              ("Nordrhein-Westfalen", "LK Heinsberg"), ("Sachsen-Anhalt", "SK Halle")]
+    dates = pd.date_range("2020-03-01", periods=days)
+    records = []
+    for bundesland, landkreis in kreise:
+        for date in dates:
+            if rng.rand() < 0.3:  # no report on this day
+                continue
+            for altersgruppe in ["A15-A34", "A35-A59"]:
+                records.append([bundesland, landkreis, altersgruppe,
+                                date.strftime("%Y/%m/%d 00:00:00"),
+                                rng.randint(0, 20), rng.randint(0, 2)])
+    columns = ["Bundesland", "Landkreis", "Altersgruppe", "Meldedatum",
+               "AnzahlFall", "AnzahlTodesfall"]
+    return pd.DataFrame(records, columns=columns)
+
+
+@pytest.fixture
+def rki_offline(tmp_path, monkeypatch):
+    """Serve synthetic RKI data from a file in tmp_path, without using the
+    joblib cache, and use a fresh local store."""
+    source = tmp_path / "rki.csv"
+    make_rki_frame().to_csv(source, index=False)
+
+    monkeypatch.setattr(c.oscovida, "rki_url", str(source))
+    monkeypatch.setattr(c.oscovida, "fetch_data_germany", c.oscovida.fetch_data_germany.func)
+    monkeypatch.setattr(c.oscovida, "fetch_data_germany_last_execution", lambda: "version-1")
+    monkeypatch.setattr(datastore, "store_location", str(tmp_path / "store"))
+    monkeypatch.setattr(datastore, "_loaded", {})
+    monkeypatch.setattr(c.oscovida, "region_cache", c.oscovida.RegionCache())
+    monkeypatch.setattr(download, "download_location", str(tmp_path / "downloads"))
+    return source
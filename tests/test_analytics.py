@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import oscovida as c
+from oscovida import analytics, datastore
+
+from conftest import make_jhu_global_frame
+from test_corona import mock_get_country_data_johns_hopkins
+
+
+@pytest.fixture
+def table():
+    """Table with noisy data, one region without cases, and regions with data
+    only for some of the dates."""
+    df = make_jhu_global_frame(days=120).set_index("Country/Region")
+    rng = np.random.RandomState(1)
+    values = df.iloc[:, 3:].astype(float)
+    values += rng.randint(0, 5, values.shape).cumsum(axis=1)
+    values.iloc[3, :] = 0
+    values.iloc[4, :50] = 0
+    df.iloc[:, 3:] = values
+
+    table = datastore.RegionTable.from_wide_frame(df).aggregate()
+    table.first = np.array([0, 5, 0, 10, 0, 0, 3, 0, 0])
+    table.last = np.array([119, 100, 119, 119, 110, 119, 119, 119, 119])
+    return table
+
+
+def assert_same(series, row, index, exact=True):
+    """Compare result of per-series function with row of batched result."""
+    row = pd.Series(row, index=index).dropna()
+    series = series.dropna()
+    assert row.index.equals(series.index)
+    if exact:
+        assert np.array_equal(row.values, series.values)
+    else:
+        assert np.allclose(row.values, series.values, rtol=1e-12, atol=1e-12)
+
+
+def test_region_matrix(table):
+    values = analytics.region_matrix(table)
+    assert values.shape == (9, 120)
+    assert np.isnan(values[1, :5]).all() and np.isnan(values[1, 101:]).all()
+    assert not np.isnan(values[1, 5:101]).any()
+    assert values[1, 5] == table.values[1, 5]
+
+
+def test_rolling_gaussian_mean():
+    cases, deaths = mock_get_country_data_johns_hopkins()
+    values = cases.values.astype(float)
+    values[[0, 10, 11]] = np.nan
+    s = pd.Series(values)
+    for window, std, min_periods, center in [(9, 3, 1, True), (4, 2, 1, True),
+                                             (7, 4, None, True), (7, 2, 3, False)]:
+        expected = s.rolling(window, center=center, win_type="gaussian",
+                             min_periods=min_periods).mean(std=std)
+        result = analytics.rolling_gaussian_mean(values[np.newaxis, :], window, std,
+                                                 min_periods=min_periods, center=center)
+        assert np.array_equal(result[0], expected.values, equal_nan=True)
+
+
+def test_batched_equals_per_series(table):
+    values = analytics.region_matrix(table)
+    index = table.date_index()
+
+    change, smooth, smooth2 = analytics.daily_change(values)
+    growth, growth_smooth = analytics.growth_factor(values)
+    R = analytics.reproduction_number(values)
+    dtime, dtime_smooth = analytics.doubling_time(values)
+
+    for i, label in enumerate(table.labels):
+        series = table.series(label).astype(float)
+
+        (c1, _), (s1, _), (s2, _) = c.compute_daily_change(series)
+        assert_same(c1, change[i], index)
+        assert_same(s1, smooth[i], index)
+        assert_same(s2, smooth2[i], index)
+
+        (f, _), (fs, _) = c.compute_growth_factor(series)
+        assert_same(f, growth[i], index)
+        assert_same(fs, growth_smooth[i], index)
+
+        smooth_diff = series.diff().rolling(7, center=True,
+                                            win_type='gaussian').mean(std=4)
+        assert_same(c.compute_R(smooth_diff), R[i], index, exact=False)
+
+        (d1, _), (d2, _) = c.compute_doubling_time(series)
+        if d1 is None:
+            assert np.isnan(dtime[i]).all() and np.isnan(dtime_smooth[i]).all()
+        else:
+            assert_same(d1, dtime[i], index)
+            assert_same(d2, dtime_smooth[i], index)
+
+    # the region without cases has no doubling time
+    assert np.isnan(dtime[table.positions("Korea, South")[0]]).all()
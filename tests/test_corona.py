@@ -1,10 +1,17 @@
 import datetime
+import subprocess
+import sys
+import time
 import numpy as np
 import pandas as pd
+import pytest
 from pandas import DatetimeIndex
+import matplotlib
 import matplotlib.pyplot as plt
 import oscovida as c
 
+from conftest import make_jhu_US_frame
+
 
 
 def mock_get_country_data_johns_hopkins(country="China"):
@@ -63,6 +70,82 @@ def test_Hungary_overview():
     isinstance(deaths, type(None))
 
 
+def test_US_tables(jhu_offline):
+    assert c.get_US_region_list() == ["Alabama", "Hawaii", "New Jersey"]
+
+    # same as grouping the rows of the original data
+    deaths = c.fetch_deaths_US()
+    cases, deaths_nj = c.get_region_US("New Jersey")
+    reference = deaths[deaths["Province_State"] == "New Jersey"].iloc[:, 11:].sum()
+    assert (deaths_nj.values == reference.values).all()
+    assert deaths_nj.index[0] == pd.Timestamp("2020-01-22")
+    assert deaths_nj.name == "US-New Jersey deaths"
+    assert cases.name == "US-New Jersey cases"
+
+    counties = c.get_US_table("county", "cases")
+    assert counties.labels[:2] == ["Autauga, Alabama", "Baldwin, Alabama"]
+    assert counties.meta.loc["Maui, Hawaii", "Province_State"] == "Hawaii"
+    assert counties.meta.loc["Maui, Hawaii", "County"] == "Maui"
+    assert c.get_US_table("county", "cases") is counties
+
+
+def test_US_counties(jhu_offline):
+    assert c.get_US_counties("Hawaii") == [["Hawaii", "Honolulu"], ["Hawaii", "Maui"]]
+    assert len(c.get_US_counties()) == 6
+
+    deaths = c.fetch_deaths_US()
+    cases, deaths_maui = c.get_region_US("Hawaii", county="Maui")
+    reference = deaths[deaths["Admin2"] == "Maui"].iloc[0, 11:]
+    assert (deaths_maui.values == reference.values).all()
+    assert deaths_maui.name == "US-Hawaii-Maui deaths"
+
+    cases, deaths, region_label = c.get_country_data("US", region="Hawaii", subregion="Maui")
+    assert region_label == "United States: Maui (Hawaii)"
+    assert c.overview_dependencies("US", region="Hawaii", subregion="Maui") == \
+        ["jhu-us:Hawaii:Maui"]
+
+
+def test_US_counties_not_assigned(jhu_offline):
+    # rows for cases that are not assigned to a county
+    for name, population in [("confirmed", False), ("deaths", True)]:
+        df = make_jhu_US_frame(population=population)
+        for i, county in [(0, "Unassigned"), (1, "Out of AL")]:
+            df.loc[len(df)] = df.loc[i]
+            df.loc[len(df) - 1, "Admin2"] = county
+            df.loc[len(df) - 1, "Combined_Key"] = f"{county}, Alabama, US"
+        df.to_csv(jhu_offline / f"time_series_covid19_{name}_US.csv", index=False)
+
+    assert c.get_US_counties("Alabama") == [["Alabama", "Autauga"], ["Alabama", "Baldwin"]]
+    assert len(c.get_US_counties()) == 6
+
+    # they are part of the numbers of the state
+    cases, deaths = c.get_region_US("Alabama")
+    autauga_cases, autauga_deaths = c.get_region_US("Alabama", county="Autauga")
+    baldwin_cases, baldwin_deaths = c.get_region_US("Alabama", "Baldwin")
+    assert (deaths == 2 * (autauga_deaths + baldwin_deaths)).all()
+    assert (cases == 2 * (autauga_cases + baldwin_cases)).all()
+    assert autauga_cases.name == "US-Alabama-Autauga cases"
+    assert baldwin_deaths.name == "US-Alabama-Baldwin deaths"
+
+    with pytest.raises(AssertionError, match="Maui, Alabama not in available"):
+        c.get_region_US("Alabama", county="Maui")
+
+
+def test_build_US_tables():
+    df = make_jhu_US_frame(days=10)
+    # rows that are not assigned to a county count for the state only
+    df.loc[len(df)] = df.loc[0]
+    df.loc[len(df) - 1, "Admin2"] = np.nan
+    table = c.datastore.RegionTable.from_wide_frame(df.set_index("iso2"))
+
+    tables = c.oscovida.build_US_tables(table)
+    assert tables["state"].labels == ["Alabama", "Hawaii", "New Jersey"]
+    assert (tables["state"].series("Alabama").values ==
+            2 * df.iloc[0, 11:].values + df.iloc[1, 11:].values).all()
+    assert len(tables["county"].labels) == 6
+    assert (tables["county"].series("Autauga, Alabama").values == df.iloc[0, 11:].values).all()
+
+
 def test_get_Hungary_region_list():
     x = c.get_counties_hungary()
     assert x[0] == "Bács-Kiskun"
@@ -119,6 +202,106 @@ def test_get_country_data():
     assert region_label == "United Kingdom"
 
 
+def test_get_country_data_johns_hopkins_offline(jhu_offline):
+    cases, deaths = c.get_country_data_johns_hopkins("China")
+    assert cases.name == "China cases"
+    assert deaths.name == "China deaths"
+    assert isinstance(cases.index, DatetimeIndex)
+    assert cases.index[0] == pd.Timestamp("2020-01-22")
+
+    # provinces are summed
+    df = c.fetch_deaths()
+    assert deaths[-1] == df.loc["China"].iloc[:, -1].sum()
+
+    # the country table is computed once per data version
+    table = c.get_country_table("deaths")
+    assert table.source_version == c.fetch_johns_hopkins_table("jhu-deaths-global").version
+    assert c.get_country_table("deaths") is table
+
+
+def test_germany_get_region_offline(rki_offline):
+    germany = c.oscovida.fetch_data_germany()
+
+    for state, landkreis in [(None, "SK Hamburg"), (None, "LK Rosenheim"), ("Bayern", None)]:
+        cases, deaths, region_label = c.germany_get_region(state=state, landkreis=landkreis)
+        assert region_label == f"Germany-{state or landkreis}"
+        assert cases.name == region_label + " cases"
+        assert deaths.name == region_label + " deaths"
+
+        # compare with grouping the rows of the original data
+        if state:
+            rows = germany[germany["Bundesland"] == state]
+        else:
+            rows = germany[germany["Landkreis"] == landkreis]
+        ref_cases = rows["AnzahlFall"].groupby("date").agg("sum").cumsum()
+        ref_deaths = rows["AnzahlTodesfall"].groupby("date").agg("sum").cumsum()
+        assert cases.index[0] == ref_cases.index[0]
+        assert cases.index[-1] == ref_cases.index[-1]
+        assert (cases[ref_cases.index] == ref_cases).all()
+        assert (deaths[ref_deaths.index] == ref_deaths).all()
+        # one data point per day
+        assert len(cases) == (cases.index[-1] - cases.index[0]).days + 1
+
+
+def test_germany_get_region_daily(rki_offline):
+    germany = c.oscovida.fetch_data_germany()
+    rows = germany[germany["Landkreis"] == "LK Rosenheim"]
+    reported = rows["AnzahlFall"].groupby("date").agg("sum").cumsum()
+    days = pd.date_range(reported.index[0], reported.index[-1])
+    without_report = days.difference(reported.index)
+    assert len(without_report) > 0
+
+    # days without a report keep the total of the last report before them,
+    # so the daily change on these days is zero
+    cases, deaths, _ = c.germany_get_region(landkreis="LK Rosenheim")
+    assert list(cases.index) == list(days)
+    assert (cases == reported.reindex(days).ffill()).all()
+    assert (cases.diff()[without_report] == 0).all()
+    assert cases.diff().sum() == reported.iloc[-1] - reported.iloc[0]
+
+    table = c.get_germany_table("landkreis", "cases")
+    assert table.meta.loc["LK Rosenheim", "Bundesland"] == "Bayern"
+    assert c.get_germany_table("landkreis", "cases") is table
+
+
+def test_fetch_data_germany_totals(rki_offline):
+    germany = c.oscovida.fetch_data_germany()
+    # small chunks: the same Landkreis and date appear in several chunks
+    totals = c.oscovida.fetch_data_germany_totals(chunksize=100)
+    assert len(totals) < len(germany)
+    assert totals["AnzahlFall"].sum() == germany["AnzahlFall"].sum()
+
+    expected = c.oscovida.build_germany_tables(germany)
+    for name, table in c.oscovida.build_germany_tables(totals).items():
+        assert table.labels == expected[name].labels
+        assert (table.dates == expected[name].dates).all()
+        assert np.array_equal(table.values, expected[name].values)
+        assert np.array_equal(table.first, expected[name].first)
+        assert np.array_equal(table.last, expected[name].last)
+
+    last_day = c.oscovida.fetch_data_germany_totals(include_last_day=False).index.max()
+    assert last_day == germany.index.max() - pd.Timedelta("1D")
+
+
+def test_germany_regions_from_tables(rki_offline, monkeypatch):
+    germany = c.oscovida.fetch_data_germany()
+    land_kreis = germany[["Bundesland", "Landkreis"]].drop_duplicates()
+    expected = land_kreis.sort_values(["Bundesland", "Landkreis"]).values.tolist()
+
+    assert sorted(c.get_germany_tables()) == ["rki-bundesland-cases", "rki-bundesland-deaths",
+                                              "rki-landkreis-cases", "rki-landkreis-deaths"]
+
+    # once the tables are built, other processes (no tables loaded yet) don't
+    # need the row-level data, and use the memory-mapped tables
+    def fail():
+        raise AssertionError("fetch_data_germany called")
+    monkeypatch.setattr(c.oscovida, "fetch_data_germany", fail)
+    monkeypatch.setattr(c.datastore, "_loaded", {})
+    assert c.get_germany_regions() == expected
+    cases, deaths, _ = c.germany_get_region(landkreis="SK Hamburg")
+    assert isinstance(c.get_germany_table("landkreis", "cases").values, np.memmap)
+
+
 def test_compute_daily_change():
     cases, deaths = mock_get_country_data_johns_hopkins()
     change, smooth, smooth2 = c.compute_daily_change(cases)
@@ -280,3 +463,218 @@ def test_pad_cumulative_series_to_yesterday():
     y2 = c.pad_cumulative_series_to_yesterday(y)
     assert y.shape == (10,)
     assert y2.shape == y.shape
+
+
+def test_overview_without_pyplot(jhu_offline):
+    figures_before = plt.get_fignums()
+    axes, cases, deaths = c.overview("France", pyplot=False)
+    assert plt.get_fignums() == figures_before
+    assert axes[0].figure is not axes[-1].figure
+    assert axes[-1].figure.canvas.get_default_filetype() == "png"
+
+    with c.capture_figures() as figures:
+        c.overview("Poland")
+    assert plt.get_fignums() == figures_before
+    assert len(figures) == 2
+    assert figures[0].axes[0].get_title().startswith("Overview Poland")
+
+
+def test_align_sets_at():
+    index = pd.date_range("2020-03-01", periods=6, name="date")
+    df = pd.DataFrame({"a": [0, 1, 5, 6, 8, 9],
+                       "b": [np.nan, 0, 0, 0, 4, 7],
+                       "c": [0, 0, 0, 0, 0, 0]}, index=index, dtype=float)
+
+    s = c.day0atleast(2, df["a"])
+    assert list(s.index) == [-2, -1, 0, 1, 2, 3]
+    assert list(s.values) == list(df["a"].values)
+    assert len(c.day0atleast(2, df["c"])) == 0
+
+    res = c.align_sets_at(2, df)
+    assert list(res.index) == list(range(-4, 4))
+    assert res.index.name == "date"
+    assert list(res.columns) == ["a", "b", "c"]
+    assert res.loc[0, "a"] == 5 and res.loc[0, "b"] == 4
+    assert res.loc[3, "a"] == 9 and np.isnan(res.loc[3, "b"])
+    assert res.loc[-3, "b"] == 0 and np.isnan(res.loc[-4, "b"])
+    assert np.isnan(res.loc[-3, "a"])
+    assert res["b"].count() == 5
+    assert res["c"].isna().all()
+
+
+def test_get_compare_data(jhu_offline):
+    df_c, df_d = c.get_compare_data(["Germany", "China", "France"], rolling=7)
+    assert list(df_c.columns) == ["Germany", "China", "France"]
+
+    # same as computing the columns one by one
+    for country in df_c.columns:
+        cases, deaths = c.get_country_data_johns_hopkins(country)
+        expected = cases.diff().rolling(7, center=True).mean()
+        pd.testing.assert_series_equal(df_c[country], expected, check_names=False)
+        expected = deaths.diff().rolling(7, center=True).mean()
+        pd.testing.assert_series_equal(df_d[country], expected, check_names=False)
+
+
+def test_get_compare_data_germany(rki_offline):
+    df_c, df_d = c.get_compare_data_germany((None, "LK Rosenheim"),
+                                            ["Bayern", "Hamburg", "Bayern"], rolling=7)
+    assert list(df_c.columns) == ["LK Rosenheim", "Bayern", "Hamburg"]
+
+    # dates of the first region
+    cases, deaths, _ = c.germany_get_region(landkreis="LK Rosenheim")
+    assert df_c.index.equals(cases.index)
+
+    for state, landkreis in [(None, "LK Rosenheim"), ("Bayern", None), ("Hamburg", None)]:
+        cases, deaths, _ = c.germany_get_region(state=state, landkreis=landkreis)
+        expected = cases.diff().rolling(7, center=True).mean().reindex(df_c.index)
+        pd.testing.assert_series_equal(df_c[state or landkreis], expected, check_names=False)
+        expected = deaths.diff().rolling(7, center=True).mean().reindex(df_d.index)
+        pd.testing.assert_series_equal(df_d[state or landkreis], expected, check_names=False)
+
+
+def test_RegionCache():
+    cache = c.RegionCache(maxsize=2)
+    calls = []
+    compute = lambda key: lambda: calls.append(key) or key.upper()
+
+    assert cache.get("a", compute("a")) == "A"
+    assert cache.get("a", compute("a")) == "A"
+    assert cache.get("b", compute("b")) == "B"
+    assert cache.get("a", compute("a")) == "A"
+    # least recently used entry ("b") is evicted
+    assert cache.get("c", compute("c")) == "C"
+    assert cache.get("a", compute("a")) == "A"
+    assert cache.get("b", compute("b")) == "B"
+    assert calls == ["a", "b", "c", "b"]
+    assert cache.info() == {"hits": 3, "misses": 4, "size": 2, "maxsize": 2}
+
+    cache.clear()
+    assert cache.info()["size"] == 0
+
+
+def test_get_country_data_cached(rki_offline, monkeypatch):
+    cases, deaths, label = c.get_country_data("Germany", subregion="LK Rosenheim")
+    info = c.oscovida.region_cache.info()
+    assert info["misses"] == 2  # get_country_data and germany_get_region
+
+    # callers get their own copy
+    cases.name = "changed"
+    cases[:] = 0
+    cases2, deaths2, label2 = c.get_country_data("Germany", subregion="LK Rosenheim")
+    assert cases2.name == "Germany-LK Rosenheim cases"
+    assert cases2.iloc[-1] > 0
+    assert c.oscovida.region_cache.info()["hits"] == info["hits"] + 1
+
+    c.germany_get_region(landkreis="LK Rosenheim", pad2yesterday=True)
+    assert c.oscovida.region_cache.info()["hits"] == info["hits"] + 2
+
+    # new data is not taken from the cache
+    monkeypatch.setattr(c.oscovida, "fetch_data_germany_last_execution", lambda: "version-2")
+    c.get_country_data("Germany", subregion="LK Rosenheim")
+    assert c.oscovida.region_cache.info()["misses"] == info["misses"] + 2
+
+
+def test_overview_data(jhu_offline, monkeypatch):
+    data = c.OverviewData("France")
+    assert data.region_label == "France"
+    assert data.cases.name == "France cases"
+
+    # same results as the individual compute functions
+    cases = data.cases_derived
+    for (derived, _), (expected, _) in zip(cases.daily_change,
+                                           c.compute_daily_change(data.cases)):
+        assert derived.equals(expected)
+    (growth, _), (growth_smooth, _) = c.compute_growth_factor(data.cases)
+    assert cases.growth_factor[0][0].equals(growth)
+    assert cases.growth_factor[1][0].equals(growth_smooth)
+    (dtime, _), (dtime_smooth, label) = c.compute_doubling_time(
+        data.deaths, labels=("France", "deaths"))
+    assert data.deaths_derived.doubling_time[1][0].equals(dtime_smooth)
+    assert data.deaths_derived.doubling_time[1][1] == label
+    assert data.table().equals(c.compose_dataframe_summary(data.cases, data.deaths))
+
+    # overview uses the given data, and computes the daily change only once
+    # per series
+    calls = []
+    compute_daily_change = c.oscovida.compute_daily_change
+    monkeypatch.setattr(c.oscovida, "compute_daily_change",
+                        lambda series: calls.append(series.name) or compute_daily_change(series))
+    axes, cases, deaths = c.overview("France", pyplot=False, data=data)
+    assert cases is data.cases
+    assert calls == []
+
+    c.overview("France", pyplot=False)
+    assert calls == ["France cases", "France deaths"]
+
+
+def test_overview_dependencies():
+    deps = c.overview_dependencies("France")
+    assert deps[0] == "jhu:France"
+    assert "jhu:Germany" in deps and len(deps) == len(c.COMPARE_WITH) + 1
+
+    # a region compared with itself is listed once
+    assert c.overview_dependencies("Germany").count("jhu:Germany") == 1
+
+    deps = c.overview_dependencies("Germany", region="Bayern", subregion="SK München")
+    assert deps[0] == "rki:Bayern:SK München"
+    assert "rki:Hamburg" in deps
+
+    assert c.overview_dependencies("US", region="Alabama") == ["jhu-us:Alabama"]
+    assert c.overview_dependencies("Hungary", region="Baranya") == ["hungary:Baranya", "hungary"]
+
+
+def test_depends_on():
+    deps = c.overview_dependencies("Germany", region="Sachsen", subregion="SK Leipzig")
+    assert c.depends_on(deps, ["rki"])
+    assert c.depends_on(deps, ["rki:Sachsen:SK Leipzig"])
+    # a change in a Landkreis changes the numbers of its Bundesland
+    assert c.depends_on(deps, ["rki:Hamburg:SK Hamburg"])
+    assert not c.depends_on(deps, ["rki:Sachsen:SK Dresden"])
+    assert not c.depends_on(deps, ["jhu", "hungary"])
+    assert not c.depends_on(deps, ["rki:Bay"])
+
+
+def test_import_is_lazy():
+    # matplotlib, IPython and nbconvert take longer to import than everything
+    # else together: they are only imported when they are first used
+    modules = ['matplotlib', 'matplotlib.pyplot', 'IPython', 'nbconvert']
+    code = ("import sys; import oscovida; "
+            f"print(sorted(m for m in {modules} if m in sys.modules))")
+    run = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True,
+                         text=True)
+    assert run.stdout.strip() == "[]"
+
+    # importing oscovida takes not much longer than importing pandas and numpy
+    # (importing matplotlib and IPython as well takes about four times as long)
+    def import_time(module):
+        times = []
+        for i in range(3):
+            start = time.perf_counter()
+            subprocess.run([sys.executable, "-c", f"import {module}"], check=True)
+            times.append(time.perf_counter() - start)
+        return min(times)
+    assert import_time("oscovida") < 2 * import_time("pandas, numpy")
+
+    # the style is set before any thread draws its first figure (even if
+    # setting it takes a while)
+    code = ("import threading, time, matplotlib.style, oscovida; colors = []; "
+            "use = matplotlib.style.use; "
+            "matplotlib.style.use = lambda style: (time.sleep(0.2), use(style)); "
+            "draw = lambda: colors.append(oscovida.oscovida._subplots(pyplot=False)[1]"
+            ".get_facecolor()); "
+            "threads = [threading.Thread(target=draw) for i in range(8)]; "
+            "[t.start() for t in threads]; [t.join() for t in threads]; "
+            "print(sorted(set(colors)))")
+    run = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True,
+                         text=True)
+    ggplot = matplotlib.colors.to_rgba(matplotlib.style.library["ggplot"]["axes.facecolor"])
+    assert run.stdout.strip() == str([ggplot])
+
+    # plotting still works
+    fig, axes = c.oscovida._subplots(2, 1, pyplot=False)
+    assert isinstance(fig, c.oscovida.matplotlib.figure.Figure)
+    assert plt.rcParams["figure.max_open_warning"] == 50
+
+    # attributes that are neither in the module nor a submodule of it
+    assert hasattr(c.oscovida.matplotlib, "missing") is False
+    assert hasattr(c.oscovida.matplotlib, "colors")
@@ -0,0 +1,110 @@
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import oscovida as c
+from oscovida import datastore
+
+from conftest import make_jhu_global_frame
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setattr(datastore, "store_location", str(tmp_path / "store"))
+    monkeypatch.setattr(datastore, "_loaded", {})
+
+
+def test_RegionTable_from_wide_frame():
+    df = make_jhu_global_frame(days=10).set_index("Country/Region")
+    table = datastore.RegionTable.from_wide_frame(df)
+
+    assert table.values.shape == (11, 10)
+    assert table.dates[0] == np.datetime64("2020-01-22")
+    assert table.dates.dtype == np.dtype("datetime64[D]")
+    assert list(table.meta.columns) == ["Province/State", "Lat", "Long"]
+    assert table.to_wide_frame().equals(df)
+
+
+def test_save_load_table(store):
+    df = make_jhu_global_frame(days=10).set_index("Country/Region")
+    table = datastore.RegionTable.from_wide_frame(df)
+
+    assert datastore.load_table("test") is None
+    version = datastore.save_table("test", table)
+    assert datastore.table_version("test") == version
+
+    # read back from disk, not from the in-process copy
+    datastore._loaded.clear()
+    table2 = datastore.load_table("test")
+    assert isinstance(table2.values, np.memmap)
+    assert table2.version == version
+    assert table2.to_wide_frame().equals(df)
+    assert datastore.load_table("test") is table2
+
+    # only one version is kept on disk
+    version2 = datastore.save_table("test", table)
+    assert version2 != version
+    assert sorted(os.listdir(os.path.join(datastore.store_location, "test"))) == \
+        sorted(["CURRENT", version2])
+
+    datastore.clear_store()
+    assert datastore.load_table("test") is None
+
+
+def test_RegionTable_series():
+    df = make_jhu_global_frame(days=10).set_index("Country/Region")
+    table = datastore.RegionTable.from_wide_frame(df)
+
+    s = table.series("Germany", name="Germany deaths")
+    assert s.name == "Germany deaths"
+    assert isinstance(s.index, pd.DatetimeIndex)
+    assert s.index[-1] == pd.Timestamp("2020-01-31")
+    assert "China" in table
+    assert "Atlantis" not in table
+    with pytest.raises(ValueError):
+        table.series("China")
+
+
+def test_RegionTable_frame():
+    values = np.arange(12).reshape(3, 4)
+    table = datastore.RegionTable(labels=["a", "b", "c"],
+                                  dates=pd.date_range("2020-03-01", periods=4).values,
+                                  values=values, first=np.array([0, 1, 0]),
+                                  last=np.array([3, 3, 2]))
+
+    df = table.frame(["c", "b"])
+    assert list(df.columns) == ["c", "b"]
+    assert isinstance(df.index, pd.DatetimeIndex)
+    for label in ["b", "c"]:
+        series = table.series(label)
+        assert df[label].dropna().equals(series.astype(float))
+    assert np.isnan(df.loc["2020-03-04", "c"])
+    assert np.isnan(df.loc["2020-03-01", "b"])
+
+
+def test_fetch_deaths_from_store(jhu_offline):
+    df = c.fetch_deaths()
+    reference = pd.read_csv(jhu_offline / "time_series_covid19_deaths_global.csv",
+                            index_col=1)
+    assert df.equals(reference)
+
+    # second call is served from the store
+    os.remove(jhu_offline / "time_series_covid19_deaths_global.csv")
+    assert c.fetch_deaths().equals(reference)
+
+    df = c.fetch_deaths_US()
+    assert "Population" in df.columns
+    assert df.index.name == "iso2"
+
+
+def test_RegionTable_aggregate():
+    df = make_jhu_global_frame(days=10).set_index("Country/Region")
+    table = datastore.RegionTable.from_wide_frame(df).aggregate()
+
+    assert table.labels == ["Germany", "China", "Korea, South", "Australia", "Poland",
+                            "Belarus", "Switzerland", "US", "France"]
+    assert table.meta is None
+    ref = df.loc["China"].iloc[:, 3:].sum()
+    assert (table.series("China").values == ref.values).all()
@@ -0,0 +1,81 @@
+import pytest
+
+import oscovida as c
+from oscovida import MetadataRegion, metadata
+
+from report_generators import dependencies
+from report_generators.executors import ReportExecutor
+from report_generators.reporters import CountryReport, GermanyReport, USAReport
+
+
+@pytest.fixture
+def pages(tmp_path, monkeypatch):
+    """Metadata of generated pages for countries, German Landkreise and US
+    states, with their dependencies."""
+    monkeypatch.setattr(metadata, "MetadataBackend", "json")
+    monkeypatch.setattr(metadata, "MetadataStorageLocation", str(tmp_path / "metadata"))
+    MetadataRegion.clear_all()
+
+    for title, category, dependencies_of in [
+        ("France", "countries", CountryReport.dependencies_of("France")),
+        ("Germany", "countries", CountryReport.dependencies_of("Germany")),
+        ("Italy", "countries", CountryReport.dependencies_of("Italy")),
+        ("Germany: SK München (Bayern)", "germany",
+         GermanyReport.dependencies_of(["Bayern", "SK München"])),
+        ("Germany: SK Leipzig (Sachsen)", "germany",
+         GermanyReport.dependencies_of(["Sachsen", "SK Leipzig"])),
+        ("United States: Alabama", "us", USAReport.dependencies_of("Alabama")),
+    ]:
+        MetadataRegion(title).update({"category": category, "dependencies": dependencies_of})
+
+
+def test_pages_to_rebuild(pages):
+    germany = ["Germany: SK Leipzig (Sachsen)", "Germany: SK München (Bayern)"]
+    assert dependencies.pages_to_rebuild(["rki"]) == germany
+    #  every country page compares with Germany
+    assert dependencies.pages_to_rebuild(["jhu:Germany"]) == ["France", "Germany", "Italy"]
+    assert dependencies.pages_to_rebuild(["jhu:France"]) == ["France"]
+    #  every Landkreis page compares with Bayern
+    assert dependencies.pages_to_rebuild(["rki:Bayern:SK München"]) == germany
+    assert dependencies.pages_to_rebuild(["rki:Sachsen:SK Leipzig"]) == \
+        ["Germany: SK Leipzig (Sachsen)"]
+    assert dependencies.pages_to_rebuild(["jhu-us"]) == ["United States: Alabama"]
+    assert dependencies.pages_to_rebuild(["jhu:France", "jhu-us:Alabama"]) == \
+        ["France", "United States: Alabama"]
+    assert dependencies.pages_to_rebuild(["hungary"]) == []
+
+    assert dependencies.pages_to_rebuild(["jhu:Germany"], category="germany") == []
+
+
+def test_select_changed():
+    countries = ["France", "Germany", "Italy"]
+    executor = ReportExecutor(Reporter=CountryReport, wwwroot="wwwroot", changed=["jhu:Italy"])
+    assert executor.select_changed(countries) == ["Italy"]
+    executor.changed = ["rki"]
+    assert executor.select_changed(countries) == []
+    executor.changed = []
+    assert executor.select_changed(countries) == countries
+
+    landkreise = [["Bayern", "SK München"], ["Sachsen", "SK Leipzig"]]
+    executor = ReportExecutor(Reporter=GermanyReport, wwwroot="wwwroot", changed=["rki"])
+    assert executor.select_changed(landkreise) == landkreise
+    executor.changed = ["rki:Sachsen:SK Leipzig"]
+    assert executor.select_changed(landkreise) == [["Sachsen", "SK Leipzig"]]
+    executor.changed = ["jhu:Germany"]
+    assert executor.select_changed(landkreise) == []
+
+
+def test_dependency_hash(jhu_offline, monkeypatch):
+    monkeypatch.setattr(dependencies, "_hashes", {})
+    france = dependencies.dependency_hash("jhu:France")
+    assert france != dependencies.dependency_hash("jhu:Poland")
+    assert dependencies.dependency_hash("jhu") != france
+
+    #  computed once per run ...
+    cases, deaths, _ = c.get_country_data("France")
+    monkeypatch.setattr(dependencies, "dependency_data", lambda key: (cases + 1, deaths))
+    assert dependencies.dependency_hash("jhu:France") == france
+
+    #  ... until the cache is cleared
+    dependencies.clear_cache()
+    assert dependencies.dependency_hash("jhu:France") != france
@@ -0,0 +1,226 @@
+import concurrent.futures
+import email.utils
+import functools
+import hashlib
+import http.server
+import os
+import threading
+
+import pandas as pd
+import pytest
+
+import oscovida as c
+from oscovida import datastore, download
+
+from conftest import make_jhu_global_frame
+
+
+class ConditionalRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Serve files with ETag and Last-Modified headers, and reply with
+    304 Not Modified to matching conditional requests."""
+
+    requests = []
+    # path -> number of requests that fail with 503 before it is served
+    failures = {}
+
+    def send_head(self):
+        if self.failures.get(self.path):
+            self.failures[self.path] -= 1
+            self.requests.append((self.path, 503))
+            self.send_error(503)
+            return None
+
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        with open(path, "rb") as f_in:
+            content = f_in.read()
+        etag = '"' + hashlib.md5(content).hexdigest() + '"'
+        last_modified = email.utils.formatdate(os.stat(path).st_mtime, usegmt=True)
+
+        if self.headers.get("If-None-Match") == etag:
+            self.requests.append((self.path, 304))
+            self.send_response(304)
+            self.end_headers()
+            return None
+
+        self.requests.append((self.path, 200))
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(content)))
+        self.send_header("ETag", etag)
+        self.send_header("Last-Modified", last_modified)
+        self.end_headers()
+        self.wfile.write(content)
+        return None
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def http_server(tmp_path, monkeypatch):
+    """Local stand-in for the upstream data servers, serving files from
+    tmp_path/www. Yields the base url."""
+    www = tmp_path / "www"
+    www.mkdir()
+    handler = functools.partial(ConditionalRequestHandler, directory=str(www))
+    ConditionalRequestHandler.requests = []
+    ConditionalRequestHandler.failures = {}
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    monkeypatch.setattr(download, "download_location", str(tmp_path / "downloads"))
+    monkeypatch.setattr(datastore, "store_location", str(tmp_path / "store"))
+    monkeypatch.setattr(datastore, "_loaded", {})
+
+    yield f"http://127.0.0.1:{server.server_address[1]}/"
+    server.shutdown()
+
+
+def test_download_conditional(http_server, tmp_path):
+    (tmp_path / "www" / "data.csv").write_text("a,b\n1,2\n")
+
+    path, changed = download.download(http_server + "data.csv", "data.csv")
+    assert changed
+    assert open(path).read() == "a,b\n1,2\n"
+    assert download.download_info("data.csv")["etag"]
+
+    path, changed = download.download(http_server + "data.csv", "data.csv")
+    assert not changed
+    assert open(path).read() == "a,b\n1,2\n"
+    assert ConditionalRequestHandler.requests == [("/data.csv", 200), ("/data.csv", 304)]
+
+    (tmp_path / "www" / "data.csv").write_text("a,b\n1,2\n3,4\n")
+    path, changed = download.download(http_server + "data.csv", "data.csv")
+    assert changed
+    assert open(path).read() == "a,b\n1,2\n3,4\n"
+
+
+def test_download_local_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "download_location", str(tmp_path / "downloads"))
+    (tmp_path / "data.csv").write_text("a,b\n1,2\n")
+
+    path, changed = download.download(str(tmp_path / "data.csv"), "data.csv")
+    assert changed
+    path, changed = download.download(str(tmp_path / "data.csv"), "data.csv")
+    assert not changed
+
+
+def test_download_concurrently(tmp_path, monkeypatch):
+    # threads (or processes) refreshing the same file at the same time write
+    # to temporary files of their own
+    monkeypatch.setattr(download, "download_location", str(tmp_path / "downloads"))
+    content = "a,b\n" + "1,2\n" * 100000
+    (tmp_path / "data.csv").write_text(content)
+
+    def fetch(i):
+        return download.download(str(tmp_path / "data.csv"), "data.csv")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(fetch, range(16)))
+    assert all(open(path).read() == content for path, changed in results)
+    assert sorted(os.listdir(tmp_path / "downloads")) == ["data.csv", "data.csv.info.json"]
+
+
+def test_refresh_johns_hopkins(http_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(c.oscovida, "base_url", http_server)
+    filename = c.johns_hopkins_files["jhu-deaths-global"]
+    make_jhu_global_frame(days=30).to_csv(tmp_path / "www" / filename, index=False)
+
+    assert c.refresh_johns_hopkins("jhu-deaths-global")
+    table = datastore.load_table("jhu-deaths-global")
+    assert len(table.dates) == 30
+
+    # no change upstream: nothing is downloaded, store is untouched
+    assert not c.refresh_johns_hopkins("jhu-deaths-global")
+    assert datastore.load_table("jhu-deaths-global").version == table.version
+
+    # two more days
+    make_jhu_global_frame(days=32).to_csv(tmp_path / "www" / filename, index=False)
+    assert c.refresh_johns_hopkins("jhu-deaths-global")
+    table2 = datastore.load_table("jhu-deaths-global")
+    assert len(table2.dates) == 32
+    reference = pd.read_csv(tmp_path / "www" / filename, index_col=1)
+    assert table2.to_wide_frame().equals(reference)
+
+
+def test_download_many(http_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(download.time, "sleep", lambda seconds: None)
+    for name in ["a.csv", "b.csv", "c.csv"]:
+        (tmp_path / "www" / name).write_text(f"{name}\n")
+    files = {name: http_server + name for name in ["a.csv", "b.csv", "c.csv"]}
+
+    ConditionalRequestHandler.failures = {"/b.csv": 2}
+    results = download.download_many(files, retries=2)
+    assert sorted(results) == ["a.csv", "b.csv", "c.csv"]
+    assert all(changed for path, changed in results.values())
+    assert open(results["b.csv"][0]).read() == "b.csv\n"
+    assert ConditionalRequestHandler.requests.count(("/b.csv", 503)) == 2
+
+    results = download.download_many(files)
+    assert not any(changed for path, changed in results.values())
+
+    # still failing after all retries
+    ConditionalRequestHandler.failures = {"/c.csv": 3}
+    with pytest.raises(RuntimeError, match="c.csv"):
+        download.download_many(files, retries=2)
+    with pytest.raises(RuntimeError, match="missing.csv"):
+        download.download_many({"missing.csv": http_server + "missing.csv"})
+
+
+def test_refresh_data(http_server, tmp_path, monkeypatch):
+    monkeypatch.setattr(c.oscovida, "base_url", http_server)
+    for name, filename in c.johns_hopkins_files.items():
+        make_jhu_global_frame(days=30).to_csv(tmp_path / "www" / filename, index=False)
+
+    assert c.refresh_data(sources=("jhu",)) == {"jhu": True}
+    assert len(datastore.load_table("jhu-cases-US").dates) == 30
+
+    assert c.refresh_data(sources=("jhu",)) == {"jhu": False}
+    filename = c.johns_hopkins_files["jhu-deaths-global"]
+    make_jhu_global_frame(days=31).to_csv(tmp_path / "www" / filename, index=False)
+    assert c.refresh_data(sources=("jhu",)) == {"jhu": True}
+    assert len(datastore.load_table("jhu-deaths-global").dates) == 31
+
+
+def test_prefetch_data_fallback(jhu_offline, rki_offline, monkeypatch, caplog):
+    monkeypatch.setattr(download.time, "sleep", lambda seconds: None)
+    monkeypatch.setattr(c.oscovida, "rki_url", str(rki_offline) + ".missing")
+
+    # a failing source does not stop the others
+    assert c.prefetch_data(("jhu", "rki"), progress=False) == {"jhu": True, "rki": False}
+    assert "Could not refresh the rki data" in caplog.text
+    assert "No rki data available" in caplog.text
+
+    # the server is down: the data downloaded before is used
+    monkeypatch.setattr(c.oscovida, "base_url", str(jhu_offline) + ".missing/")
+    caplog.clear()
+    assert c.prefetch_data(("jhu",), progress=False) == {"jhu": False}
+    assert "Could not refresh the jhu data" in caplog.text
+    assert "No jhu data available" not in caplog.text
+    cases, deaths, _ = c.get_country_data("France")
+    assert len(cases) == 60
+
+
+def test_update_table(tmp_path, monkeypatch):
+    monkeypatch.setattr(datastore, "store_location", str(tmp_path / "store"))
+    monkeypatch.setattr(datastore, "_loaded", {})
+
+    def table(days):
+        df = make_jhu_global_frame(days=days).set_index("Country/Region")
+        return datastore.RegionTable.from_wide_frame(df)
+
+    assert datastore.update_table("t", table(10)) is None
+    version = datastore.table_version("t")
+    assert datastore.update_table("t", table(10)) == 0
+    assert datastore.table_version("t") == version
+    assert datastore.update_table("t", table(12)) == 2
+    assert len(datastore.load_table("t").dates) == 12
+
+    # history has been revised: replace the table
+    revised = table(13)
+    revised.values[0, 0] += 1
+    assert datastore.update_table("t", revised) is None
+    assert datastore.load_table("t").values[0, 0] == revised.values[0, 0]
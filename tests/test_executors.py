@@ -0,0 +1,179 @@
+import os
+import threading
+import time
+from collections import Counter
+
+import pytest
+
+from oscovida import metadata
+
+from report_generators.executors import ReportExecutor
+from report_generators.profiling import stage
+
+
+class StubReport:
+    """Reporter that only writes which process and thread created the report
+    of a region into the file wwwroot/<region>.
+
+    Regions starting with "slow" take longer, "bad" ones always fail,
+    "flaky" ones fail in the first attempt and "same" ones are unchanged.
+    """
+
+    category = "stub"
+    kernel_warmup = ""
+
+    def __init__(self, region, wwwroot, verbose=False):
+        self.region = region
+        self.path = os.path.join(wwwroot, region)
+
+    @staticmethod
+    def dependencies_of(region):
+        return [f"stub:{region}"]
+
+    def is_unchanged(self):
+        return self.region.startswith("same")
+
+    def generate(self, kernel_name="", engine="kernel", kernel_pool=None):
+        with stage("execute"):
+            time.sleep(0.5 if self.region.startswith("slow") else 0.01)
+        if self.region.startswith("bad"):
+            raise RuntimeError(f"{self.region} failed")
+        if self.region.startswith("flaky") and not os.path.exists(self.path + ".tried"):
+            open(self.path + ".tried", "w").close()
+            raise RuntimeError(f"{self.region} failed")
+        with open(self.path, "a") as f_out:
+            f_out.write(f"{os.getpid()} {threading.current_thread().name}\n")
+
+
+def created_by(wwwroot, region):
+    with open(os.path.join(wwwroot, region)) as f_in:
+        return f_in.read().splitlines()
+
+
+@pytest.fixture
+def wwwroot(tmp_path, monkeypatch):
+    #  the executor selects the (module wide) metadata backend
+    monkeypatch.setattr(metadata, "MetadataBackend", "json")
+    return str(tmp_path)
+
+
+def test_executor_threads_balance_load(wwwroot):
+    regions = ["slow"] + [f"fast{i}" for i in range(20)]
+    executor = ReportExecutor(
+        Reporter=StubReport, wwwroot=wwwroot, workers=2, disable_pbar=True
+    )
+    executor.create_html_reports(regions)
+
+    assert executor.processed == len(regions)
+    assert executor.failed == []
+    workers = Counter(created_by(wwwroot, region)[0] for region in regions)
+    assert len(workers) == 2
+    #  the worker busy with the slow region does not have a backlog of its
+    #  own: the other worker takes (almost) all the fast regions
+    slow_worker = created_by(wwwroot, "slow")[0]
+    assert workers[slow_worker] <= 2
+
+
+def test_executor_threads_failures(wwwroot):
+    regions = ["a", "bad", "flaky", "same"]
+    executor = ReportExecutor(
+        Reporter=StubReport, wwwroot=wwwroot, workers=2, attempts=2, disable_pbar=True
+    )
+    executor.create_html_reports(regions)
+
+    assert executor.processed == 4
+    assert executor.failed == ["bad"]
+    assert len(created_by(wwwroot, "flaky")) == 1
+    assert not os.path.exists(os.path.join(wwwroot, "same"))
+
+    summary = executor.trace.summary()
+    assert summary["attempts"] == 6
+    assert summary["skipped"] == 1
+    assert summary["retried"] == 2
+    assert summary["errors"] == 3
+
+
+def test_executor_processes(wwwroot):
+    regions = ["a", "bad", "flaky", "same", "b", "c"]
+    executor = ReportExecutor(
+        Reporter=StubReport,
+        wwwroot=wwwroot,
+        workers=2,
+        pool="processes",
+        attempts=2,
+        disable_pbar=True,
+    )
+    executor.create_html_reports(regions)
+
+    assert executor.processed == len(regions)
+    assert executor.failed == ["bad"]
+    pids = {created_by(wwwroot, region)[0].split()[0] for region in ["a", "b", "c", "flaky"]}
+    assert str(os.getpid()) not in pids
+
+    #  the records of the attempts are sent back from the worker processes
+    records = executor.trace.records
+    assert sorted((r["region"], r["attempt"]) for r in records) == [
+        ("a", 0), ("b", 0), ("bad", 0), ("bad", 1), ("c", 0),
+        ("flaky", 0), ("flaky", 1), ("same", 0),
+    ]
+    assert executor.trace.summary()["skipped"] == 1
+    assert all(
+        r["stages"]["execute"]["wall"] >= 0.01 for r in records if r["status"] != "skipped"
+    )
+
+
+
+class KernelStubReport(StubReport):
+    """Reporter that writes the id and pid of the kernel it is given."""
+
+    def generate(self, kernel_name="", engine="kernel", kernel_pool=None):
+        with kernel_pool.kernel() as km:
+            with open(self.path, "a") as f_out:
+                f_out.write(f"{km.kernel_id} {km.provisioner.pid}\n")
+
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    return True
+
+
+def test_executor_processes_kernel_pool(wwwroot):
+    pytest.importorskip("ipykernel")
+    regions = ["a", "b", "c", "d", "e", "f"]
+    executor = ReportExecutor(
+        Reporter=KernelStubReport,
+        wwwroot=wwwroot,
+        workers=2,
+        pool="processes",
+        engine="kernel-pool",
+        disable_pbar=True,
+    )
+    executor.create_html_reports(regions)
+    assert executor.failed == []
+
+    #  one kernel per worker process, not per region, and all of them are
+    #  shut down with the worker processes
+    kernels = {tuple(created_by(wwwroot, region)[0].split()) for region in regions}
+    assert 1 <= len(kernels) <= 2
+    assert not any(is_running(int(pid)) for kernel_id, pid in kernels)
+
+
+def test_executor_expiry_hours(wwwroot, caplog):
+    #  deprecated: has no effect
+    executor = ReportExecutor(Reporter=StubReport, wwwroot=wwwroot, expiry_hours=2)
+    assert "expiry_hours is deprecated" in caplog.text
+    assert not hasattr(executor, "expiry_hours")
+
+
+def test_executor_select_changed(wwwroot):
+    executor = ReportExecutor(
+        Reporter=StubReport, wwwroot=wwwroot, changed=["stub:b"], disable_pbar=True
+    )
+    executor.create_html_reports(["a", "b"])
+
+    assert executor.processed == 1
+    assert os.path.exists(os.path.join(wwwroot, "b"))
+    assert not os.path.exists(os.path.join(wwwroot, "a"))
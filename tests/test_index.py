@@ -0,0 +1,72 @@
+import pandas as pd
+
+from report_generators.index import create_markdown_index_page, create_markdown_page_links
+
+
+def make_regions(n):
+    return pd.DataFrame(
+        {
+            "one-line-summary": [f"US: State : County {i:02}" for i in range(n)],
+            "html-file": [f"US-State-County-{i:02}.html" for i in range(n)],
+            "max-cases": [1000 + i for i in range(n)],
+            "max-deaths": [10 + i for i in range(n)],
+            "cases-last-week": [100 + i for i in range(n)],
+        },
+        index=[f"United States: County {i:02} (State)" for i in range(n)],
+    )
+
+
+def read_page(path):
+    """Return header (as dictionary) and body of markdown page."""
+    with open(path) as f_in:
+        header, body = f_in.read().split("\n\n", 1)
+    return dict(line.split(": ", 1) for line in header.splitlines()), body.lstrip("\n")
+
+
+def test_create_markdown_page_links():
+    assert create_markdown_page_links("us-counties", 3, 1) == \
+        "Pages: 1 | [2](us-counties-2) | [3](us-counties-3)"
+    assert create_markdown_page_links("us-counties", 3, 2) == \
+        "Pages: [1](us-counties) | 2 | [3](us-counties-3)"
+
+
+def test_create_markdown_index_page(tmp_path):
+    path = str(tmp_path / "us-counties.md")
+
+    #  no more regions than fit on a page
+    assert create_markdown_index_page(make_regions(3), "us-counties",
+                                      pelican_file_path=path, page_size=3) == path
+    header, body = read_page(path)
+    assert header["save-as"] == "us-counties"
+    assert "Pages:" not in body
+    assert body.count("US: State : County") == 3
+
+
+def test_create_markdown_index_page_paginated(tmp_path):
+    path = str(tmp_path / "us-counties.md")
+    regions = make_regions(5).iloc[::-1]  # sorted by name on the pages
+
+    assert create_markdown_index_page(regions, "us-counties",
+                                      pelican_file_path=path, page_size=2) == path
+    assert sorted(p.name for p in tmp_path.iterdir()) == \
+        ["us-counties-2.md", "us-counties-3.md", "us-counties.md"]
+
+    pages = [read_page(str(tmp_path / name))
+             for name in ["us-counties.md", "us-counties-2.md", "us-counties-3.md"]]
+    titles = [header["title"] for header, body in pages]
+    assert titles[0] == "Tracking plots:  United States counties"
+    assert titles[1] == "Tracking plots:  United States counties (page 2 of 3)"
+    assert [header["save-as"] for header, body in pages] == \
+        ["us-counties", "us-counties-2", "us-counties-3"]
+    assert [header["slug"] for header, body in pages] == \
+        ["us-counties", "us-counties-2", "us-counties-3"]
+
+    for page, (header, body) in enumerate(pages, start=1):
+        links = create_markdown_page_links("us-counties", 3, page)
+        assert body.startswith(links + "\n\n")
+        assert body.rstrip().endswith(links)
+
+    counties = [[f"County {i:02}" for i in range(5) if f"County {i:02}]" in body]
+                for header, body in pages]
+    assert counties == [["County 00", "County 01"], ["County 02", "County 03"], ["County 04"]]
+    assert "(html/US-State-County-04.html)" in pages[2][1]
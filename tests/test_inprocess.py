@@ -0,0 +1,107 @@
+import io
+import sys
+import threading
+
+import nbformat
+import pytest
+
+from report_generators.inprocess import InProcessNotebookRunner, _ThreadLocalStdout
+
+
+def make_notebook(*sources):
+    nb = nbformat.v4.new_notebook()
+    nb.cells = [nbformat.v4.new_markdown_cell("# Report")] + [
+        nbformat.v4.new_code_cell(source) for source in sources
+    ]
+    return nb
+
+
+@pytest.fixture
+def stdout(monkeypatch):
+    #  the runner replaces sys.stdout: restore it after the test
+    monkeypatch.setattr(sys, "stdout", sys.stdout)
+
+
+def test_thread_local_stdout():
+    default = io.StringIO()
+    stdout = _ThreadLocalStdout(default)
+    stdout.local.buffer = io.StringIO()
+
+    thread = threading.Thread(target=lambda: print("other thread", file=stdout))
+    thread.start()
+    thread.join()
+    print("this thread", file=stdout)
+
+    assert stdout.local.buffer.getvalue() == "this thread\n"
+    assert default.getvalue() == "other thread\n"
+
+
+def test_run_notebook(stdout):
+    nb = make_notebook(
+        "%config InlineBackend.figure_formats = ['svg']\n"
+        "%matplotlib inline\n"
+        "x = 6 * 7\n"
+        "print('hello')\n"
+        "x",
+        "x;",
+        "1 / 0",
+        "print(x + 1)",
+    )
+    nb = InProcessNotebookRunner().run(nb)
+    cells = nb.cells[1:]
+
+    assert nb.cells[0].cell_type == "markdown"
+    assert [cell.execution_count for cell in cells] == [1, 2, 3, 4]
+
+    assert [output.output_type for output in cells[0].outputs] == ["stream", "execute_result"]
+    assert cells[0].outputs[0].text == "hello\n"
+    assert cells[0].outputs[1].data["text/plain"] == "42"
+    assert cells[0].outputs[1].execution_count == 1
+
+    #  a semicolon suppresses the result
+    assert cells[1].outputs == []
+
+    #  execution carries on after an error
+    assert cells[2].outputs[0].output_type == "error"
+    assert cells[2].outputs[0].ename == "ZeroDivisionError"
+    assert cells[3].outputs[0].text == "43\n"
+
+
+def test_run_notebook_figures(jhu_offline, stdout):
+    nb = make_notebook(
+        "from oscovida import *",
+        "axes, cases, deaths = overview('Poland')",
+    )
+    nb = InProcessNotebookRunner().run(nb)
+
+    #  overview draws two figures (and may print some text)
+    outputs = [output for output in nb.cells[2].outputs if output.output_type != "stream"]
+    assert [output.output_type for output in outputs] == ["display_data"] * 2
+    assert outputs[0].data["image/svg+xml"].lstrip().startswith("<?xml")
+    assert "Figure" in outputs[0].data["text/plain"]
+
+
+def test_run_notebooks_in_threads(stdout):
+    names = ["first", "second"]
+    notebooks = {
+        name: make_notebook(
+            "import time\n"
+            "for i in range(5):\n"
+            f"    print('{name}', i)\n"
+            "    time.sleep(0.01)",
+            f"'{name}'",
+        )
+        for name in names
+    }
+
+    threads = [
+        threading.Thread(target=InProcessNotebookRunner().run, args=(notebooks[name],))
+        for name in names
+    ]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+
+    for name in names:
+        cells = notebooks[name].cells[1:]
+        assert cells[0].outputs[0].text == "".join(f"{name} {i}\n" for i in range(5))
+        assert cells[1].outputs[0].data["text/plain"] == f"'{name}'"
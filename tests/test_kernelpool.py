@@ -0,0 +1,77 @@
+import atexit
+
+import pytest
+
+from report_generators.kernelpool import KernelPool
+
+
+class FakeKernel:
+    """Stands in for the KernelManager of a started kernel."""
+
+    def __init__(self, kernel_id):
+        self.kernel_id = kernel_id
+        self.alive = True
+        self.shut_down = False
+
+    def is_alive(self):
+        return self.alive
+
+    def shutdown_kernel(self, now=False):
+        self.shut_down = True
+
+
+@pytest.fixture
+def pool():
+    """KernelPool of size 1 that starts fake kernels."""
+    pool = KernelPool(size=1)
+    pool.started = []
+
+    def start_kernel():
+        if pool.started and pool.started[-1].alive is None:
+            raise RuntimeError("kernel could not be started")
+        pool.started.append(FakeKernel(len(pool.started)))
+        return pool.started[-1]
+
+    pool._start_kernel = start_kernel
+    pool._run = lambda km, code: None
+    yield pool
+    pool.shutdown()
+
+
+def test_kernel_is_reused(pool):
+    with pool.kernel() as km:
+        pass
+    with pool.kernel() as km2:
+        assert km2 is km
+    assert len(pool.started) == 1
+
+
+def test_dead_kernel_is_removed(pool):
+    #  the error of the notebook is raised, and no new kernel is started
+    #  (which could fail and hide it)
+    with pytest.raises(ValueError, match="notebook"):
+        with pool.kernel() as km:
+            km.alive = None  # died, and starting another one fails
+            raise ValueError("error in notebook")
+    assert km.shut_down
+    assert pool.kernels == []
+    assert len(pool.started) == 1
+
+    #  a new kernel is started when one is needed
+    km.alive = False
+    with pool.kernel() as km2:
+        assert km2 is not km
+    assert pool.kernels == [km2]
+
+
+def test_shutdown(monkeypatch):
+    registered = []
+    monkeypatch.setattr(atexit, "register", registered.append)
+    monkeypatch.setattr(atexit, "unregister", registered.remove)
+
+    pools = [KernelPool(size=1) for i in range(3)]
+    assert len(registered) == 3
+    #  pools that have been shut down are not kept until the process exits
+    for pool in pools:
+        pool.shutdown()
+    assert registered == []
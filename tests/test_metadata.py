@@ -8,7 +8,7 @@ import numpy as np
 import pandas as pd
 
 
-from oscovida import MetadataRegion
+from oscovida import MetadataRegion, metadata
 
 
 def test_MetadataRegion_basics():
@@ -95,3 +95,91 @@ def test_MetadataRegion_get_all_as_dataframe():
     # but need to sort the table to be sure rows are in the
     # same order:
     assert ref.sort_index().equals(actual.sort_index())
+
+
+def test_MetadataRegion_update_writes_once(monkeypatch):
+    m = MetadataRegion("Germany", "w")
+    writes = []
+    monkeypatch.setattr(json, "dump", lambda d, f, **kwargs: writes.append(dict(d)) or
+                        f.write(json.dumps(d, **kwargs)))
+
+    m.update({"html": "html-pfad", "ipynb": "ipynb-pfad", "max-cases": 10})
+    assert len(writes) == 1
+    assert MetadataRegion("Germany").as_dict() == writes[0]
+
+    with m.transaction():
+        m["html"] = "other"
+        m.mark_as_updated()
+        # nothing written yet
+        assert MetadataRegion("Germany")["html"] == "html-pfad"
+    assert len(writes) == 2
+    assert MetadataRegion("Germany")["html"] == "other"
+
+    # changes are discarded if the transaction fails
+    with pytest.raises(RuntimeError):
+        with m.transaction():
+            m["html"] = "broken"
+            raise RuntimeError()
+    assert m["html"] == "other"
+    assert len(writes) == 2
+
+    # no temporary files are left behind
+    assert all(f.endswith("-meta.json") for f in os.listdir("oscovida-metadata/regions"))
+
+
+@pytest.fixture
+def sqlite_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(metadata, "MetadataDatabase", str(tmp_path / "regions.sqlite"))
+    metadata.set_backend("sqlite")
+    yield
+    metadata.set_backend("json")
+
+
+def test_MetadataRegion_sqlite(sqlite_backend):
+    MetadataRegion.clear_all()
+    m = MetadataRegion("Germany", "w")
+    m.update({"html": "html-pfad", "category": "world"})
+    m = MetadataRegion("Hamburg", "w")
+    m.update({"html": "hamburg-pfad", "category": "germany"})
+    m.mark_as_updated()
+
+    m = MetadataRegion("Germany")
+    assert m.as_dict() == {"html": "html-pfad", "category": "world"}
+    m["ipynb"] = "ipynb-pfad"
+    assert MetadataRegion("Germany")["ipynb"] == "ipynb-pfad"
+    assert MetadataRegion("Hamburg").last_updated_hours_ago() * 3600 < 1
+    assert sorted(MetadataRegion.get_all()) == ["Germany", "Hamburg"]
+
+    world = MetadataRegion.get_all_as_dataframe(category="world")
+    assert list(world.index) == ["Germany"]
+    assert world.loc["Germany", "ipynb"] == "ipynb-pfad"
+
+    since = datetime.datetime.now() - datetime.timedelta(hours=1)
+    assert list(MetadataRegion.get_all_as_dataframe(updated_since=since).index) == ["Hamburg"]
+
+    MetadataRegion.clear_all()
+    assert MetadataRegion.get_all() == []
+
+
+def test_MetadataRegion_get_all_as_dataframe_category():
+    MetadataRegion.clear_all()
+    MetadataRegion("Germany", "w").update({"category": "world"})
+    MetadataRegion("Hamburg", "w").update({"category": "germany"})
+    MetadataRegion("Bayern", "w").update({"category": "germany"})
+
+    germany = MetadataRegion.get_all_as_dataframe(category="germany")
+    assert sorted(germany.index) == ["Bayern", "Hamburg"]
+
+
+def test_MetadataRegion_update_unchanged_does_not_write(monkeypatch):
+    m = MetadataRegion("Germany", "w")
+    m.update({"html": "html-pfad", "max-cases": 10})
+    writes = []
+    monkeypatch.setattr(json, "dump", lambda d, f, **kwargs: writes.append(dict(d)))
+
+    m.update({"html": "html-pfad", "max-cases": 10})
+    m.update({"html": "html-pfad"})
+    assert writes == []
+
+    m.update({"max-cases": 11})
+    assert len(writes) == 1
@@ -0,0 +1,104 @@
+import csv
+import json
+
+import numpy as np
+import pytest
+
+from report_generators.profiling import ReportTrace, stage
+
+
+def make_record(region, wall, attempt=0, status="ok"):
+    return {
+        "region": region,
+        "attempt": attempt,
+        "status": status,
+        "start": 0.0,
+        "wall": wall,
+        "cpu": wall / 2,
+        "stages": {"execute": {"wall": wall * 0.8, "cpu": 0.0}},
+    }
+
+
+def test_stage():
+    #  outside of an attempt nothing is recorded
+    with stage("execute"):
+        pass
+
+    trace = ReportTrace()
+    with trace.attempt(["Bayern", "SK München"], 0):
+        with stage("init"):
+            sum(range(100000))
+        with stage("execute"):
+            pass
+        with stage("execute"):
+            pass
+    with trace.attempt("Poland", 0) as record:
+        record["status"] = "skipped"
+    with pytest.raises(ValueError):
+        with trace.attempt("Poland", 1):
+            raise ValueError("no data")
+
+    munich, skipped, error = trace.records
+    assert munich["region"] == "SK München"
+    assert munich["status"] == "ok"
+    assert sorted(munich["stages"]) == ["execute", "init"]
+    assert munich["stages"]["init"]["cpu"] > 0
+    assert munich["wall"] >= munich["stages"]["init"]["wall"]
+    assert skipped["status"] == "skipped"
+    assert error["status"] == "error"
+    assert error["error"] == "ValueError: no data"
+
+
+def test_write(tmp_path):
+    trace = ReportTrace()
+    trace.add([make_record("France", 2.0), make_record("Poland", 1.0, status="skipped")])
+
+    path = str(tmp_path / "trace.jsonl")
+    trace.write(path)
+    trace.write(path)  # appended
+    with open(path) as f_in:
+        records = [json.loads(line) for line in f_in]
+    assert records == trace.records * 2
+
+    path = str(tmp_path / "trace.csv")
+    trace.write(path)
+    trace.write(path)  # without a second header
+    with open(path) as f_in:
+        rows = list(csv.DictReader(f_in))
+    assert len(rows) == 8  # execute and total, for 2 records, twice
+    assert rows[0]["region"] == "France"
+    assert rows[0]["stage"] == "execute"
+    assert float(rows[0]["wall"]) == pytest.approx(1.6)
+    assert rows[1]["stage"] == "total"
+    assert float(rows[1]["cpu"]) == pytest.approx(1.0)
+    assert rows[3]["status"] == "skipped"
+
+
+def test_summary(capsys):
+    trace = ReportTrace()
+    trace.add([make_record(f"region {i}", float(i)) for i in range(1, 101)])
+    trace.add([
+        make_record("region 1", 1000.0, status="skipped"),
+        make_record("region 2", 1000.0, status="error"),
+        make_record("region 2", 2.0, attempt=1),
+    ])
+
+    s = trace.summary(slowest=2)
+    assert s["attempts"] == 103
+    assert s["skipped"] == 1
+    assert s["retried"] == 1
+    assert s["errors"] == 1
+    #  skipped attempts are not part of the timings, failed ones are
+    total = s["stages"]["total"]
+    assert total["n"] == 102
+    walls = list(range(1, 101)) + [1000.0, 2.0]
+    assert total["p50"] == pytest.approx(np.percentile(walls, 50)) == 50.5
+    assert total["p95"] == pytest.approx(np.percentile(walls, 95))
+    assert total["max"] == 1000.0
+    assert s["stages"]["execute"]["cpu_p50"] == 0.0
+    assert s["slowest"] == [("region 2", 0, 1000.0), ("region 100", 0, 100.0)]
+
+    trace.print_summary()
+    out = capsys.readouterr().out
+    assert "103 attempts: 1 skipped, 1 retries, 1 errors" in out
+    assert "caller cpu p50" in out
@@ -0,0 +1,125 @@
+import os
+
+import pytest
+
+import oscovida as c
+from oscovida import metadata
+
+from report_generators import dependencies, reporters
+from report_generators.executors import ReportExecutor
+from report_generators.reporters import CountryReport, USAReport, USCountyReport
+
+
+@pytest.fixture
+def reports(jhu_offline, tmp_path, monkeypatch):
+    """Directory with wwwroot and a report template, and fresh metadata.
+    Yields the path of the template."""
+    monkeypatch.setattr(metadata, "MetadataBackend", "json")
+    monkeypatch.setattr(metadata, "MetadataStorageLocation", str(tmp_path / "metadata"))
+    monkeypatch.setattr(dependencies, "_hashes", {})
+    #  only compare with countries in the synthetic data
+    monkeypatch.setattr(c.oscovida, "COMPARE_WITH", ["Germany", "Poland", "China"])
+
+    (tmp_path / "wwwroot" / "html").mkdir(parents=True)
+    (tmp_path / "wwwroot" / "ipynb").mkdir()
+    template = tmp_path / "template-report.py"
+    template.write_text("# {TITLE}\noverview({OVERVIEW_ARGS})\n")
+    monkeypatch.chdir(tmp_path)
+    return str(template)
+
+
+def test_fingerprint(reports, monkeypatch):
+    report = CountryReport("France", wwwroot="wwwroot")
+    fingerprint = report.fingerprint(reports)
+    assert fingerprint == CountryReport("France", wwwroot="wwwroot").fingerprint(reports)
+    assert fingerprint != CountryReport("Poland", wwwroot="wwwroot").fingerprint(reports)
+
+    #  the data of the region
+    changed = CountryReport("France", wwwroot="wwwroot")
+    changed.input_series[0] = changed.input_series[0] + 1
+    assert changed.fingerprint(reports) != fingerprint
+
+    #  the data of the regions it is compared with
+    with monkeypatch.context() as m:
+        m.setattr(reporters, "dependency_hash", lambda key: key)
+        assert report.fingerprint(reports) != fingerprint
+
+    #  the template
+    with open(reports, "a") as f_out:
+        f_out.write("print(1)\n")
+    assert report.fingerprint(reports) != fingerprint
+    fingerprint = report.fingerprint(reports)
+
+    #  the version of oscovida
+    monkeypatch.setattr(c, "__version__", "0.0.0")
+    assert report.fingerprint(reports) != fingerprint
+
+
+def test_is_unchanged(reports):
+    report = CountryReport("France", wwwroot="wwwroot")
+    assert not report.is_unchanged(reports)
+
+    report.metadata["fingerprint"] = report.fingerprint(reports)
+    assert not report.is_unchanged(reports)  # the html file is missing
+
+    open(report.output_html_path, "w").close()
+    assert report.is_unchanged(reports)
+    #  also for the report of the next run, which reads the metadata
+    assert CountryReport("France", wwwroot="wwwroot").is_unchanged(reports)
+
+
+def test_executor_skips_unchanged(reports, monkeypatch):
+    generated = []
+
+    def generate(self, **kwargs):
+        #  like BaseReport.generate, without executing the notebook
+        generated.append(self.country)
+        open(self.output_html_path, "w").close()
+        self.metadata["fingerprint"] = self.fingerprint()
+
+    monkeypatch.setattr(CountryReport, "generate", generate)
+    executor = ReportExecutor(Reporter=CountryReport, wwwroot="wwwroot", disable_pbar=True)
+
+    executor.create_html_reports(["France", "Poland"])
+    assert generated == ["France", "Poland"]
+
+    executor.create_html_reports(["France", "Poland"])
+    assert generated == ["France", "Poland"]
+    assert executor.trace.summary()["skipped"] == 2
+
+    #  the html file has been removed
+    os.remove(os.path.join("wwwroot", "html", "Poland.html"))
+    executor.create_html_reports(["France", "Poland"])
+    assert generated == ["France", "Poland", "Poland"]
+
+    executor.force = True
+    executor.create_html_reports(["France", "Poland"])
+    assert generated == ["France", "Poland", "Poland", "France", "Poland"]
+
+
+def test_us_county_report(reports):
+    report = USCountyReport(["New Jersey", "Bergen"], wwwroot="wwwroot")
+    assert report.category == "us-counties"
+    assert report.title == "United States: Bergen (New Jersey)"
+    assert report.output_file_name == "US-New-Jersey-Bergen.ipynb"
+    assert report.output_ipynb_path == os.path.join("wwwroot", "ipynb", "US-New-Jersey-Bergen.ipynb")
+    assert report.output_html_path == os.path.join("wwwroot", "html", "US-New-Jersey-Bergen.html")
+    assert report.mapping["OVERVIEW_ARGS"] == \
+        'country="US", region="New Jersey", subregion="Bergen"'
+    assert report.dependencies == ["jhu-us:New Jersey:Bergen"]
+
+    cases, deaths = c.get_region_US("New Jersey", county="Bergen")
+    meta = report.metadata.as_dict()
+    assert meta["category"] == "us-counties"
+    assert meta["region"] == "New Jersey"
+    assert meta["subregion"] == "Bergen"
+    assert meta["one-line-summary"] == "US: New Jersey : Bergen"
+    assert meta["max-cases"] == cases[-1]
+
+    #  the state reports are named as before
+    report = USAReport("New Jersey", wwwroot="wwwroot")
+    assert report.output_file_name == "US-New-Jersey.ipynb"
+    assert report.metadata.as_dict()["subregion"] == "None"
+
+    with pytest.raises(AssertionError, match="Essex"):
+        USCountyReport(["Hawaii", "Essex"], wwwroot="wwwroot")
@@ -0,0 +1,493 @@
+"""Benchmark the report pipeline, stage by stage, on synthetic data.
+
+Synthetic data sets shaped like the Johns Hopkins, RKI and Hungary csv files
+(of realistic size by default) are served from a local HTTP server, so the
+benchmark runs offline and is repeatable. Everything is done in a temporary
+working directory (cachedir, oscovida-metadata, wwwroot).
+
+Stages that are timed:
+
+- fetch:*       download and parse the data (cold cache), and refresh_data()
+                when nothing has changed
+- extract:*     get_country_data / germany_get_region / get_region_US /
+                get_region_hungary for a sample of regions
+- analytics:*   compute_daily_change, compute_growth_factor, compute_R,
+                compute_doubling_time per region, and the batched versions
+                (oscovida.analytics) for all countries at once
+- plot:*        overview (incl. comparison plot), the comparison plot alone,
+                and rendering the figures to SVG
+- report:*      creating the report object (incl. metadata), generating,
+                executing and exporting the notebook to html
+- index:create  creating the markdown index page
+
+Each run appends one line of JSON with the timings (and git commit, date and
+package versions) to the output file, so that runs for different commits
+can be compared:
+
+    python benchmark.py --scale 0.2 --regions 5 --output benchmark.jsonl
+"""
+import collections
+import contextlib
+import datetime
+import functools
+import http.server
+import io
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import click
+import numpy as np
+import pandas as pd
+
+TOOLS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+LAENDER = ["Baden-Württemberg", "Bayern", "Berlin", "Brandenburg", "Bremen",
+           "Hamburg", "Hessen", "Mecklenburg-Vorpommern", "Niedersachsen",
+           "Nordrhein-Westfalen", "Rheinland-Pfalz", "Saarland", "Sachsen",
+           "Sachsen-Anhalt", "Schleswig-Holstein", "Thüringen"]
+
+# countries used in the comparison plots, and some with provinces
+COUNTRIES = ["Germany", "Australia", "Poland", "Korea, South", "Belarus",
+             "Switzerland", "US", "China", "France", "Italy", "Hungary"]
+PROVINCES = {"China": 33, "Canada": 14, "France": 11, "United Kingdom": 12,
+             "Australia": 8, "Netherlands": 4, "Denmark": 3}
+
+
+class StageTimer:
+    """Collect wall clock times for named stages:
+
+        timer = StageTimer()
+        with timer("plot:overview"):
+            overview("Germany")
+    """
+
+    def __init__(self):
+        self.timings = collections.defaultdict(list)
+
+    @contextlib.contextmanager
+    def __call__(self, stage):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[stage].append(time.perf_counter() - start)
+
+    def summary(self):
+        return {stage: {"n": len(t), "total": sum(t), "mean": statistics.mean(t),
+                        "median": statistics.median(t), "min": min(t), "max": max(t)}
+                for stage, t in self.timings.items()}
+
+    def print_summary(self):
+        print(f"{'stage':30} {'n':>5} {'total [s]':>10} {'mean [s]':>10} {'max [s]':>10}")
+        for stage, s in self.summary().items():
+            print(f"{stage:30} {s['n']:5} {s['total']:10.3f} {s['mean']:10.4f} {s['max']:10.4f}")
+
+
+# Synthetic data
+
+def _dates(days):
+    """`days` dates, ending yesterday (as the real data)."""
+    yesterday = pd.Timestamp(datetime.date.today()) - pd.Timedelta(days=1)
+    return pd.date_range(end=yesterday, periods=days)
+
+
+def _daily_numbers(rng, n, days, level=1000):
+    """Return (n, days) array of new cases per day: two waves per region."""
+    t = np.arange(days)
+    rate = np.zeros((n, days))
+    for _ in range(2):
+        peak = rng.uniform(0.1, 1.0, (n, 1)) * days
+        width = rng.uniform(5, 30, (n, 1))
+        height = level * 10 ** rng.uniform(-2, 1, (n, 1))
+        rate += height * np.exp(-0.5 * ((t - peak) / width) ** 2)
+    return rng.poisson(rate)
+
+
+def _jhu_columns(dates):
+    return [f"{d.month}/{d.day}/{d.strftime('%y')}" for d in dates]
+
+
+def make_jhu_global(rng, days, scale):
+    n_countries = max(int(190 * scale), len(COUNTRIES))
+    countries = COUNTRIES + [f"Country {i:03}" for i in range(n_countries - len(COUNTRIES))]
+    rows = []
+    for country in countries:
+        provinces = PROVINCES.get(country, 0)
+        rows += [(np.nan, country)] + [(f"{country} {p}", country) for p in range(provinces)]
+    meta = pd.DataFrame(rows, columns=["Province/State", "Country/Region"])
+    meta["Lat"] = rng.uniform(-60, 70, len(meta)).round(4)
+    meta["Long"] = rng.uniform(-180, 180, len(meta)).round(4)
+
+    cases = _daily_numbers(rng, len(meta), days).cumsum(axis=1)
+    deaths = (cases * rng.uniform(0.005, 0.05, (len(meta), 1))).astype(int)
+    columns = _jhu_columns(_dates(days))
+    return [pd.concat([meta, pd.DataFrame(values, columns=columns)], axis=1)
+            for values in (cases, deaths)]
+
+
+def make_jhu_US(rng, days, scale):
+    states = ["New Jersey", "New York", "California", "Texas"] + \
+        [f"State {i:02}" for i in range(54)]
+    counties_per_state = max(int(57 * scale), 1)
+    rows = [(f"County {j:03}", state) for state in states for j in range(counties_per_state)]
+    n = len(rows)
+    meta = pd.DataFrame({
+        "UID": 84000000 + np.arange(n), "iso2": "US", "iso3": "USA", "code3": 840,
+        "FIPS": 1000.0 + np.arange(n), "Admin2": [r[0] for r in rows],
+        "Province_State": [r[1] for r in rows], "Country_Region": "US",
+        "Lat": rng.uniform(20, 60, n).round(4), "Long_": rng.uniform(-160, -70, n).round(4),
+        "Combined_Key": [f"{county}, {state}, US" for county, state in rows]})
+
+    cases = _daily_numbers(rng, n, days, level=20).cumsum(axis=1)
+    deaths = (cases * rng.uniform(0.005, 0.05, (n, 1))).astype(int)
+    columns = _jhu_columns(_dates(days))
+    meta_deaths = meta.copy()
+    meta_deaths["Population"] = rng.randint(1000, 1000000, n)
+    return (pd.concat([meta, pd.DataFrame(cases, columns=columns)], axis=1),
+            pd.concat([meta_deaths, pd.DataFrame(deaths, columns=columns)], axis=1))
+
+
+def make_rki(rng, days, scale):
+    """One row per Landkreis, day, age group and sex with new cases."""
+    n_kreise = max(int(412 * scale), len(LAENDER))
+    kreise = [f"{'SK' if i % 3 == 0 else 'LK'} Kreis {i:03}" for i in range(n_kreise)]
+    land = np.arange(n_kreise) % len(LAENDER)
+    dates = _dates(days)
+    groups = [(a, s) for a in ["A00-A04", "A05-A14", "A15-A34", "A35-A59", "A60-A79", "A80+"]
+              for s in ["M", "W"]]
+
+    daily = _daily_numbers(rng, n_kreise, days, level=30)
+    # split cases of each Kreis and day between age groups/sexes
+    share = rng.dirichlet(np.ones(len(groups)), size=(n_kreise, days))
+    cases = rng.binomial(np.repeat(daily[:, :, None], len(groups), axis=2), share)
+    deaths = rng.binomial(cases, 0.02)
+
+    k, d, g = np.nonzero(cases)
+    n = len(k)
+    meldedatum = dates[d].strftime("%Y/%m/%d 00:00:00")
+    return pd.DataFrame({
+        "ObjectId": np.arange(n), "IdBundesland": land[k] + 1,
+        "Bundesland": np.array(LAENDER)[land[k]], "Landkreis": np.array(kreise)[k],
+        "Altersgruppe": np.array([a for a, s in groups])[g],
+        "Geschlecht": np.array([s for a, s in groups])[g],
+        "AnzahlFall": cases[k, d, g], "AnzahlTodesfall": deaths[k, d, g],
+        "Meldedatum": meldedatum, "IdLandkreis": 1000 + k,
+        "Datenstand": datetime.date.today().strftime("%d.%m.%Y, 00:00 Uhr"),
+        "NeuerFall": 0, "NeuerTodesfall": -9, "Refdatum": meldedatum,
+        "NeuGenesen": 0, "AnzahlGenesen": cases[k, d, g] - deaths[k, d, g],
+        "IstErkrankungsbeginn": rng.randint(0, 2, n), "Altersgruppe2": "nicht übermittelt"})
+
+
+def make_hungary(rng, days, counties):
+    cases = _daily_numbers(rng, len(counties), days, level=20).cumsum(axis=1)
+    df = pd.DataFrame(cases.T, columns=counties)
+    df.insert(0, "Dátum", _dates(days).strftime("%Y-%m-%d"))
+    # the real file ends with a copy of the header
+    df.loc[len(df)] = df.columns
+    return df
+
+
+def write_data(directory, days, scale, seed=0):
+    """Write synthetic data files to `directory`."""
+    from oscovida import get_counties_hungary
+
+    rng = np.random.RandomState(seed)
+    cases, deaths = make_jhu_global(rng, days, scale)
+    cases.to_csv(os.path.join(directory, "time_series_covid19_confirmed_global.csv"), index=False)
+    deaths.to_csv(os.path.join(directory, "time_series_covid19_deaths_global.csv"), index=False)
+    cases, deaths = make_jhu_US(rng, days, scale)
+    cases.to_csv(os.path.join(directory, "time_series_covid19_confirmed_US.csv"), index=False)
+    deaths.to_csv(os.path.join(directory, "time_series_covid19_deaths_US.csv"), index=False)
+    make_rki(rng, days, scale).to_csv(os.path.join(directory, "rki.csv"), index=False)
+    make_hungary(rng, days, get_counties_hungary()).to_csv(
+        os.path.join(directory, "hungary.csv"), index=False)
+
+
+class _QuietHandler(http.server.SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+@contextlib.contextmanager
+def serve_directory(directory):
+    """Serve files in `directory` over HTTP (with Last-Modified headers, so
+    that conditional requests work), yield base URL."""
+    handler = functools.partial(_QuietHandler, directory=directory)
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield f"http://127.0.0.1:{server.server_address[1]}/"
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+# Stages
+
+def _sample(items, n):
+    """n items, spread evenly over `items`."""
+    items = list(items)
+    if len(items) <= n:
+        return items
+    return [items[i] for i in np.linspace(0, len(items) - 1, n).astype(int)]
+
+
+def bench_fetch(timer):
+    import oscovida as c
+
+    c.clear_cache()
+    with timer("fetch:jhu"):
+        c.fetch_deaths(), c.fetch_cases(), c.fetch_deaths_US(), c.fetch_cases_US()
+    with timer("fetch:jhu-countries"):
+        c.get_country_table("deaths"), c.get_country_table("cases")
+    with timer("fetch:jhu-us-tables"):
+        c.get_US_tables()
+    with timer("fetch:rki"):
+        c.fetch_data_germany()
+    with timer("fetch:rki-tables"):
+        c.get_germany_tables()
+    with timer("fetch:hungary"):
+        c.fetch_data_hungary()
+    with timer("fetch:refresh-unchanged"):
+        changed = c.refresh_data()
+    assert not any(changed.values()), changed
+
+    # all of the above again, with concurrent downloads
+    c.clear_cache()
+    with timer("fetch:prefetch-all"):
+        c.prefetch_data(progress=False)
+
+
+def select_regions(n):
+    """Sample of n regions per category, as passed to the Report classes."""
+    import oscovida as c
+
+    kreise = sorted(c.get_germany_regions(), key=lambda land_kreis: land_kreis[1])
+    return {
+        "countries": _sample(sorted(set(c.fetch_deaths().index)), n),
+        "germany": _sample(kreise, n),
+        "us": _sample(c.get_US_region_list(), n),
+        "hungary": _sample(c.get_counties_hungary(), n),
+    }
+
+
+def _get_data(category, region):
+    import oscovida as c
+
+    if category == "countries":
+        return c.get_country_data(region)
+    elif category == "germany":
+        return c.get_country_data("Germany", subregion=region[1])
+    elif category == "us":
+        return c.get_country_data("US", region=region)
+    return c.get_country_data("Hungary", region=region)
+
+
+def _overview_args(category, region):
+    if category == "countries":
+        return dict(country=region)
+    elif category == "germany":
+        return dict(country="Germany", subregion=region[1])
+    elif category == "us":
+        return dict(country="US", region=region)
+    return dict(country="Hungary", region=region)
+
+
+def bench_regions(timer, regions):
+    import oscovida as c
+    from oscovida import analytics
+
+    for category, names in regions.items():
+        for region in names:
+            with timer(f"extract:{category}"):
+                cases, deaths, label = _get_data(category, region)
+
+            for series in [cases, deaths]:
+                if series is None:
+                    continue
+                with timer("analytics:daily_change"):
+                    c.compute_daily_change(series)
+                with timer("analytics:growth_factor"):
+                    c.compute_growth_factor(series)
+                with timer("analytics:R"):
+                    smooth_diff = series.diff().rolling(7, center=True,
+                                                        win_type='gaussian').mean(std=4)
+                    c.compute_R(smooth_diff)
+                with timer("analytics:doubling_time"):
+                    c.compute_doubling_time(series)
+
+    for kind in ["cases", "deaths"]:
+        with timer("analytics:batched-all-countries"):
+            values = analytics.region_matrix(c.get_country_table(kind))
+            analytics.daily_change(values)
+            analytics.growth_factor(values)
+            analytics.reproduction_number(values)
+            analytics.doubling_time(values)
+
+
+def bench_plots(timer, regions):
+    import oscovida as c
+
+    for category, names in regions.items():
+        for region in names:
+            with c.capture_figures() as figures:
+                with timer(f"plot:overview:{category}"):
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        c.overview(**_overview_args(category, region))
+            with timer("plot:svg"):
+                for fig in figures:
+                    fig.savefig(io.StringIO(), format="svg", bbox_inches="tight")
+
+        # (there is no comparison plot for US states)
+        for region in names[:1] if category != "us" else []:
+            with c.capture_figures():
+                with timer(f"plot:compare:{category}"):
+                    if category == "countries":
+                        c.make_compare_plot(region)
+                    elif category == "germany":
+                        c.make_compare_plot_germany((None, region[1]))
+                    elif category == "hungary":
+                        c.make_compare_plot_hungary(
+                            region, compare_with_local=c.choose_random_counties(region, 18))
+
+
+def bench_reports(timer, regions, engine):
+    import nbformat
+    from nbconvert import HTMLExporter
+    from nbconvert.writers import FilesWriter
+    from oscovida import MetadataRegion
+    from report_generators.index import create_markdown_index_page
+    from report_generators.kernelpool import WARMUP_CODE, KernelPool
+    from report_generators.reporters import (CountryReport, GermanyReport,
+                                             HungaryReport, USAReport)
+
+    Reporters = {"countries": CountryReport, "germany": GermanyReport,
+                 "us": USAReport, "hungary": HungaryReport}
+    template_file = os.path.join(TOOLS_DIR, "template-report.py")
+    for directory in ["wwwroot/ipynb", "wwwroot/html", "pelican/content"]:
+        os.makedirs(directory, exist_ok=True)
+
+    for category, names in regions.items():
+        Reporter = Reporters[category]
+        kernel_pool = None
+        if engine == "kernel-pool":
+            kernel_pool = KernelPool(1, warmup_code=WARMUP_CODE + "\n" + Reporter.kernel_warmup)
+            with timer("report:start-kernel-pool"):
+                kernel_pool.start()
+
+        for region in names:
+            with timer("report:init"):
+                report = Reporter(region, wwwroot="wwwroot")
+            with timer("report:notebook"):
+                report.generate_notebook(template_file=template_file)
+            with open(report.output_ipynb_path) as f:
+                nb = nbformat.read(f, as_version=4)
+            with timer(f"report:execute:{engine}"):
+                nb = report.execute_notebook(nb, engine=engine, kernel_pool=kernel_pool)
+            with timer("report:html"):
+                body, resources = HTMLExporter().from_notebook_node(nb)
+                FilesWriter().write(body, resources, report.output_html_path.replace(".html", ""))
+                report.metadata["html-file"] = os.path.basename(report.output_html_path)
+
+        if kernel_pool is not None:
+            kernel_pool.shutdown()
+
+        with timer("index:create"):
+            create_markdown_index_page(
+                MetadataRegion.get_all_as_dataframe(category=Reporter.category),
+                Reporter.category)
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=TOOLS_DIR, check=True,
+                                capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    import matplotlib
+    return {
+        "commit": commit,
+        "date": datetime.datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "versions": {"pandas": pd.__version__, "numpy": np.__version__,
+                     "matplotlib": matplotlib.__version__},
+    }
+
+
+@click.command()
+@click.option("--days", default=250, show_default=True, help="Number of days in the data sets.")
+@click.option("--scale", default=1.0, show_default=True,
+              help="Size of the data sets relative to the real ones (number of regions).")
+@click.option("--regions", default=10, show_default=True,
+              help="Number of regions per category for the per-region stages.")
+@click.option("--engine", default="kernel", show_default=True,
+              type=click.Choice(["kernel", "kernel-pool", "inprocess"]),
+              help="How to execute the report notebooks.")
+@click.option("--skip-reports", is_flag=True, help="Skip creating the report notebooks.")
+@click.option("--output", default="benchmark.jsonl", show_default=True,
+              help="File to append the results to (one JSON object per line).")
+def main(days, scale, regions, engine, skip_reports, output):
+    import matplotlib
+    matplotlib.use("Agg")
+
+    output = os.path.abspath(output)
+    sys.path.insert(0, TOOLS_DIR)
+    parameters = dict(days=days, scale=scale, regions=regions, engine=engine,
+                      skip_reports=skip_reports)
+    timer = StageTimer()
+
+    with tempfile.TemporaryDirectory(prefix="oscovida-benchmark-") as workdir:
+        data_dir = os.path.join(workdir, "data")
+        os.makedirs(data_dir)
+        # all caches are relative to the current directory
+        os.chdir(workdir)
+
+        # in a new process, as the kernels and the CLI do
+        for i in range(3):
+            with timer("setup:import-oscovida"):
+                subprocess.run([sys.executable, "-c", "import oscovida"], check=True)
+        import oscovida as c
+
+        print(f"Writing synthetic data to {data_dir}")
+        with timer("setup:write-data"):
+            write_data(data_dir, days, scale)
+
+        with serve_directory(data_dir) as url, \
+                contextlib.redirect_stdout(io.StringIO()) as log:
+            c.oscovida.base_url = url
+            c.oscovida.rki_url = url + "rki.csv"
+            c.oscovida.hungary_url = url + "hungary.csv"
+            bench_fetch(timer)
+        print(log.getvalue(), end="")
+
+        selected = select_regions(regions)
+        print("Processing regions")
+        bench_regions(timer, selected)
+        bench_plots(timer, selected)
+        if not skip_reports:
+            bench_reports(timer, selected, engine)
+
+        os.chdir(TOOLS_DIR)
+
+    timer.print_summary()
+    region_cache = c.region_cache.info()
+    print(f"Region cache: {region_cache['hits']} hits, {region_cache['misses']} misses")
+    result = dict(environment(), parameters=parameters, stages=timer.summary(),
+                  region_cache=region_cache)
+    with open(output, "a") as f_out:
+        f_out.write(json.dumps(result) + "\n")
+    print(f"Results appended to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,12 @@
 import oscovida as osc
 
-# force download of new data
-osc.clear_cache()
+# download data that has changed upstream (use osc.clear_cache() to force
+# a download of all data)
+osc.refresh_data()
 
-# clear all metadata entries (cache used to compose markdown after html notebooks have been created)
-osc.MetadataRegion.clear_all()
+# The metadata entries (used to compose markdown after html notebooks have
+# been created) are kept: their fingerprints let the report generators skip
+# regions whose data, template and oscovida version have not changed. To
+# start from scratch (e.g. after regions have been removed upstream), use
+# osc.MetadataRegion.clear_all()
 
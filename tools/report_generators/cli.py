@@ -9,10 +9,28 @@ import oscovida
 
 from .executors import ReportExecutor
 from .reporters import (AllRegions, CountryReport, GermanyReport,
-                        HungaryReport, USAReport)
+                        HungaryReport, USAReport, USCountyReport)
 
 ALL_REGIONS = ["countries", "germany", "usa", "hungary", "all-regions-md", "all"]
 
+#  Only generated if asked for, not as part of "all": the ~3300 pages of the
+#  US counties take too long with the default engine (use `--engine
+#  inprocess` or `--engine kernel-pool`)
+OPT_IN_REGIONS = ["usa-counties"]
+
+#  data sources (see oscovida.refresh_data) used by the reports of each region
+DATA_SOURCES = {
+    "countries": ["jhu"],
+    "germany": ["rki"],
+    "usa": ["jhu"],
+    "usa-counties": ["jhu"],
+    "hungary": ["hungary"],
+    "all-regions-md": [],
+}
+
+#  index pages with more regions are split into pages of this size
+INDEX_PAGE_SIZE = 1000
+
 
 def does_wwwroot_exist(wwwroot, create=False):
     if not os.path.exists(wwwroot):
@@ -45,9 +63,7 @@ def get_country_list():
     return sorted(countries.drop_duplicates())
 
 
-def generate_reports_countries(
-    *, workers, kernel_name, wwwroot, force, disable_pbar, debug
-):
+def generate_reports_countries(*, debug, **executor_args):
     d = oscovida.fetch_deaths()
     c = oscovida.fetch_cases()
 
@@ -60,14 +76,9 @@ def generate_reports_countries(
 
     cre = ReportExecutor(
         Reporter=CountryReport,
-        kernel_name=kernel_name,
-        wwwroot=wwwroot,
-        expiry_hours=2,
         attempts=3,
-        workers=workers,
-        force=force,
-        disable_pbar=disable_pbar,
         debug=debug,
+        **executor_args,
     )
 
     if debug:
@@ -79,16 +90,13 @@ def generate_reports_countries(
 
 
 def get_germany_regions_list():
-    data_germany = oscovida.fetch_data_germany()
-    land_kreis = data_germany[["Bundesland", "Landkreis"]]
-    ordered = land_kreis.sort_values(["Bundesland", "Landkreis"])
-    return ordered.drop_duplicates().values.tolist()
+    return oscovida.get_germany_regions()
 
 
-def generate_reports_germany(
-    *, workers, kernel_name, wwwroot, force, disable_pbar, debug
-):
-    _ = oscovida.fetch_data_germany()
+def generate_reports_germany(*, debug, **executor_args):
+    #  Build the tables once, before the workers start: the workers only
+    #  open them from the store (memory-mapped, shared between processes)
+    _ = oscovida.get_germany_tables()
 
     #  TODO: The get_x_list methods should be part of Reporter class
     germany_regions = get_germany_regions_list()
@@ -117,14 +125,9 @@ def generate_reports_germany(
 
     gre = ReportExecutor(
         Reporter=GermanyReport,
-        kernel_name=kernel_name,
-        wwwroot=wwwroot,
-        expiry_hours=2,
         attempts=3,
-        workers=workers,
-        force=force,
-        disable_pbar=disable_pbar,
         debug=debug,
+        **executor_args,
     )
 
     if debug:
@@ -135,25 +138,17 @@ def generate_reports_germany(
     gre.create_markdown_index_page()
 
 
-def generate_reports_usa(
-    *, workers, kernel_name, wwwroot, force, disable_pbar, debug
-):
-    _ = oscovida.fetch_cases_US()
-    _ = oscovida.fetch_deaths_US()
+def generate_reports_usa(*, debug, **executor_args):
+    _ = oscovida.get_US_tables()
 
     #  TODO: The get_x_list methods should be part of Reporter class
     states = oscovida.get_US_region_list()
 
     usre = ReportExecutor(
         Reporter=USAReport,
-        kernel_name=kernel_name,
-        wwwroot=wwwroot,
-        expiry_hours=2,
         attempts=3,
-        workers=workers,
-        force=force,
-        disable_pbar=disable_pbar,
         debug=debug,
+        **executor_args,
     )
 
     if debug:
@@ -164,7 +159,30 @@ def generate_reports_usa(
     usre.create_markdown_index_page()
 
 
-def generate_reports_hungary(*, workers, kernel_name, wwwroot, force, disable_pbar, debug):
+def generate_reports_usa_counties(*, debug, **executor_args):
+    #  Build the tables once, before the workers start: the workers only
+    #  open them from the store (memory-mapped, shared between processes)
+    _ = oscovida.get_US_tables()
+
+    #  TODO: The get_x_list methods should be part of Reporter class
+    counties = oscovida.get_US_counties()
+
+    usce = ReportExecutor(
+        Reporter=USCountyReport,
+        attempts=3,
+        debug=debug,
+        **executor_args,
+    )
+
+    if debug:
+        counties = counties[:10]
+
+    usce.create_html_reports(counties)
+
+    usce.create_markdown_index_page(page_size=INDEX_PAGE_SIZE)
+
+
+def generate_reports_hungary(*, debug, **executor_args):
     _ = oscovida.fetch_data_hungary()
 
     #  TODO: The get_x_list methods should be part of Reporter class
@@ -172,14 +190,9 @@ def generate_reports_hungary(*, workers, kernel_name, wwwroot, force, disable_pb
 
     hre = ReportExecutor(
         Reporter=HungaryReport,
-        kernel_name=kernel_name,
-        wwwroot=wwwroot,
-        expiry_hours=2,
         attempts=3,
-        workers=workers,
-        force=force,
-        disable_pbar=disable_pbar,
         debug=debug,
+        **executor_args,
     )
 
     if debug:
@@ -190,30 +203,26 @@ def generate_reports_hungary(*, workers, kernel_name, wwwroot, force, disable_pb
     hre.create_markdown_index_page()
 
 def generate_markdown_all_regions(
-    *, workers, kernel_name, wwwroot, force, disable_pbar, debug
+    *, debug, wwwroot, metadata_backend, changed, trace_file, **executor_args
 ):
-    arre = ReportExecutor(Reporter=AllRegions, wwwroot=wwwroot)
+    arre = ReportExecutor(
+        Reporter=AllRegions, wwwroot=wwwroot, metadata_backend=metadata_backend
+    )
 
-    arre.create_markdown_index_page()
+    arre.create_markdown_index_page(page_size=INDEX_PAGE_SIZE)
 
 
-def generate(*, region, workers, kernel_name, wwwroot, force, disable_pbar, debug):
+def generate(*, region, **kwargs):
     mapping = {
         "countries": generate_reports_countries,
         "germany": generate_reports_germany,
         "usa": generate_reports_usa,
+        "usa-counties": generate_reports_usa_counties,
         "hungary": generate_reports_hungary,
         "all-regions-md": generate_markdown_all_regions,
     }
 
-    mapping[region](
-        workers=workers,
-        kernel_name=kernel_name,
-        wwwroot=wwwroot,
-        disable_pbar=disable_pbar,
-        force=force,
-        debug=debug,
-    )
+    mapping[region](**kwargs)
 
 
 @click.command()
@@ -221,11 +230,12 @@ def generate(*, region, workers, kernel_name, wwwroot, force, disable_pbar, debu
     "--regions",
     "-r",
     type=click.Choice(
-        ALL_REGIONS,
+        ALL_REGIONS + OPT_IN_REGIONS,
         case_sensitive=False
     ),
     multiple=True,
-    help="Region(s) to generate reports for.",
+    help="Region(s) to generate reports for. `all` does not include "
+         "`usa-counties`, which should be used with `--engine inprocess`.",
 )
 @click.option(
     "--workers",
@@ -233,6 +243,13 @@ def generate(*, region, workers, kernel_name, wwwroot, force, disable_pbar, debu
     help="Number of workers to use, `auto` uses nproc-2, set to 1 or False to "
          "use a single process.",
 )
+@click.option(
+    "--pool",
+    default="threads",
+    type=click.Choice(["threads", "processes"]),
+    help="Run workers as threads or as processes. Workers take the next "
+         "region from a shared queue when they are done with one.",
+)
 @click.option(
     "--wwwroot",
     default="./wwwroot",
@@ -249,6 +266,41 @@ def generate(*, region, workers, kernel_name, wwwroot, force, disable_pbar, debu
     default="",
     help="Create wwwroot directory if it does not exist.",
 )
+@click.option(
+    "--engine",
+    default="kernel",
+    type=click.Choice(["kernel", "kernel-pool", "inprocess"]),
+    help="Execute notebooks in a new Jupyter kernel each, in warm kernels that "
+         "are reused for many notebooks (one per worker), or directly in the "
+         "worker process (faster: no kernel start-up and imports per notebook, "
+         "recommended for the ~3300 pages of usa-counties).",
+)
+@click.option(
+    "--metadata-backend",
+    default="json",
+    type=click.Choice(["json", "sqlite"]),
+    help="Store the metadata of the regions in one json file per region, or "
+         "in a single SQLite database (faster to query for many regions).",
+)
+@click.option(
+    "--changed",
+    multiple=True,
+    help="Only regenerate reports that use this data, e.g. `rki`, `jhu-us`, "
+         "`jhu:Germany` or `rki:Bayern` (can be given several times).",
+)
+@click.option(
+    "--prefetch/--no-prefetch",
+    default=True,
+    help="Download all data concurrently (and prepare the tables) before the "
+         "first report is generated. If a source can not be downloaded, the "
+         "data downloaded before is used.",
+)
+@click.option(
+    "--trace",
+    default=None,
+    help="Append the time spent in each stage for every region and attempt "
+         "to this file (csv if it ends with .csv, otherwise JSON lines).",
+)
 @click.option(
     "--disable-pbar",
     default=False,
@@ -266,7 +318,7 @@ def generate(*, region, workers, kernel_name, wwwroot, force, disable_pbar, debu
     "--force",
     default=False,
     is_flag=True,
-    help="Force notebook re-execution even if recently executed.",
+    help="Force notebook re-execution even if the data has not changed.",
 )
 @click.option(
     "--debug",
@@ -279,7 +331,13 @@ def cli(
     *,
     workers,
     regions,
+    pool="threads",
     kernel_name="",
+    engine="kernel",
+    metadata_backend="json",
+    changed=(),
+    prefetch=True,
+    trace=None,
     wwwroot="wwwroot",
     create_wwwroot=False,
     disable_pbar=False,
@@ -327,6 +385,10 @@ def cli(
         workers = max(workers - 2, 1)
     elif workers =="max":
         workers = os.cpu_count()
+    elif workers.lower() == "false":
+        workers = 0
+    else:
+        workers = int(workers)
 
     if workers:
         logging.info(f"Using {workers} processes")
@@ -339,11 +401,20 @@ def cli(
 
     logging.info(f"Processed args: {locals()}")
 
+    if prefetch:
+        sources = sorted({s for region in regions for s in DATA_SOURCES[region]})
+        oscovida.prefetch_data(sources)
+
     for region in regions:
         generate(
             region=region,
             workers=workers,
+            pool=pool,
             kernel_name=kernel_name,
+            engine=engine,
+            metadata_backend=metadata_backend,
+            changed=changed,
+            trace_file=trace,
             wwwroot=wwwroot,
             disable_pbar=disable_pbar,
             force=force,
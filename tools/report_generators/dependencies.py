@@ -0,0 +1,107 @@
+"""Data that the report pages depend on.
+
+A page does not only show the data of its own region: the comparison plot
+also shows other regions (see `oscovida.overview_dependencies`). The keys of
+all data a page uses are stored in its metadata ("dependencies"), and are
+part of its fingerprint (see `BaseReport.fingerprint`), so that a page is
+regenerated when any of it changes.
+
+When only some of the data has changed (for example only the RKI data), the
+pages that need to be regenerated are those that depend on it:
+
+    pages_to_rebuild(["rki"])  # titles of pages using any RKI data
+"""
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+import oscovida
+
+#  hash of the data for every key, computed once per run: the data of the
+#  compared regions is the same for many pages
+_hashes = {}
+_hashes_lock = threading.Lock()
+
+
+def dependency_data(key):
+    """Return tuple of Series/DataFrames/arrays with the data for dependency
+    `key`."""
+    source, _, name = key.partition(":")
+    if source == "jhu":
+        if not name:
+            return (
+                oscovida.get_country_table("cases").values,
+                oscovida.get_country_table("deaths").values,
+            )
+        return oscovida.get_country_data(name)[:2]
+    elif source == "jhu-us":
+        if not name:
+            return tuple(
+                table.values for table in oscovida.get_US_tables().values()
+            )
+        state, _, county = name.partition(":")
+        return oscovida.get_region_US(state, county=county or None)
+    elif source == "rki":
+        if not name:
+            return tuple(
+                table.values for table in oscovida.get_germany_tables().values()
+            )
+        state, _, landkreis = name.partition(":")
+        if landkreis:
+            return oscovida.germany_get_region(landkreis=landkreis)[:2]
+        return oscovida.germany_get_region(state=state)[:2]
+    elif source == "hungary":
+        if not name:
+            return (oscovida.fetch_data_hungary(),)
+        return oscovida.get_region_hungary(name)[:2]
+    raise NotImplementedError(f"Unknown data source {source} in {key}")
+
+
+def update_hash(h, objects):
+    """Update hashlib object `h` with the contents of `objects` (pandas
+    objects or NumPy arrays)."""
+    for obj in objects:
+        if obj is None:
+            h.update(b"None")
+        elif isinstance(obj, np.ndarray):
+            h.update(str(obj.shape).encode())
+            h.update(np.ascontiguousarray(obj).tobytes())
+        else:
+            h.update(pd.util.hash_pandas_object(obj, index=True).values.tobytes())
+
+
+def dependency_hash(key):
+    """Return hash of the data for dependency `key` (cached, see
+    `clear_cache`)."""
+    with _hashes_lock:
+        if key in _hashes:
+            return _hashes[key]
+
+    h = hashlib.sha256()
+    update_hash(h, dependency_data(key))
+
+    with _hashes_lock:
+        _hashes[key] = h.hexdigest()
+    return _hashes[key]
+
+
+def clear_cache():
+    """Forget the hashes, e.g. after new data has been downloaded."""
+    with _hashes_lock:
+        _hashes.clear()
+
+
+def pages_to_rebuild(changed, category=None):
+    """Return titles of the generated pages (of `category`, or all) that
+    depend on any of the data keys in `changed`."""
+    pages = oscovida.MetadataRegion.get_all_as_dataframe(category=category)
+    if "dependencies" not in pages.columns:
+        return []
+    return sorted(
+        title
+        for title, dependencies in pages["dependencies"].items()
+        if isinstance(dependencies, list)
+        and oscovida.depends_on(dependencies, changed)
+    )
@@ -1,14 +1,38 @@
 import logging
+import multiprocessing.util
+import queue
 import threading
 import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from typing import List, Union
 
 from pandas import DataFrame
 from tqdm.auto import tqdm
 
-from oscovida import MetadataRegion
+from oscovida import MetadataRegion, depends_on
+from oscovida.metadata import set_backend
 
+from . import dependencies
 from .index import create_markdown_index_page
+from .kernelpool import WARMUP_CODE, KernelPool
+from .profiling import ReportTrace, stage
+
+#  The warm kernels of a worker process of the process pool (engine
+#  "kernel-pool"), see _init_worker_process
+_worker_kernel_pool = None
+
+
+def _init_worker_process(kernel_name, warmup_code):
+    """Initializer of the worker processes: all regions processed by the
+    worker use the same warm kernel, which is shut down when it exits."""
+    global _worker_kernel_pool
+    _worker_kernel_pool = KernelPool(
+        size=1, kernel_name=kernel_name, warmup_code=warmup_code
+    )
+    #  atexit handlers are not called in worker processes, finalizers are
+    multiprocessing.util.Finalize(
+        None, _worker_kernel_pool.shutdown, exitpriority=10
+    )
 
 
 class ReportExecutor:
@@ -18,35 +42,74 @@ class ReportExecutor:
         Reporter,
         wwwroot,
         kernel_name="",
-        expiry_hours=2,
+        engine="kernel",
         attempts=3,
         workers=0,
+        pool="threads",
+        metadata_backend="json",
+        changed=(),
+        trace_file=None,
         force=False,
         verbose=False,
         disable_pbar=False,
         debug=False,
+        expiry_hours=None,
     ) -> None:
+        if expiry_hours is not None:
+            #  Reports are regenerated when their data changes, see
+            #  BaseReport.is_unchanged
+            logging.warning(
+                "expiry_hours is deprecated and has no effect: reports are "
+                "only regenerated if their data, the template or oscovida "
+                "have changed (use force=True to regenerate all)"
+            )
+
         self.Reporter = Reporter
         self.kernel_name = kernel_name
+        self.engine = engine
         self.wwwroot = wwwroot
-        self.expiry_hours = expiry_hours
         self.attempts = attempts
         self.workers = workers
+        self.pool = pool
+        self.metadata_backend = metadata_backend
+        self.changed = list(changed)
+        self.trace_file = trace_file
         self.force = force
         self.verbose = verbose
         self.disable_pbar = disable_pbar
         self.debug = debug
 
+        self.kernel_pool = None
+        self.trace = ReportTrace()
+        self.__stop__ = threading.Event()
+
+        set_backend(metadata_backend)
+
+    def __getstate__(self):
+        #  Needed to send the executor to worker processes: events and
+        #  threads can not be pickled
+        state = self.__dict__.copy()
+        state.pop("__stop__", None)
+        state.pop("threads", None)
+        #  worker processes use the kernel of the process, which is started
+        #  once (see _init_worker_process), not one for every region
+        state["kernel_pool"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__stop__ = threading.Event()
+        #  worker processes may not have inherited the module state
+        set_backend(self.metadata_backend)
+
     @property
     def metadata_regions(self) -> DataFrame:
-        regions_all = MetadataRegion.get_all_as_dataframe()
-
         if self.Reporter.category == "all-regions":
-            selected_regions = regions_all
+            selected_regions = MetadataRegion.get_all_as_dataframe()
         else:
-            selected_regions = regions_all[
-                regions_all["category"] == self.Reporter.category
-            ]
+            selected_regions = MetadataRegion.get_all_as_dataframe(
+                category=self.Reporter.category
+            )
 
         #  TODO : Not correct as regions actually returns the regions stored in
         #  the metadata, not the regions to be analysed. This should be
@@ -65,17 +128,25 @@ class ReportExecutor:
 
             logging.info(f"Processing {region} attempt {attempt}")
             try:
-                report = self.Reporter(
-                    region, wwwroot=self.wwwroot, verbose=self.verbose
-                )
+                with self.trace.attempt(region, attempt) as record:
+                    with stage("init"):
+                        report = self.Reporter(
+                            region, wwwroot=self.wwwroot, verbose=self.verbose
+                        )
 
-                recently_generated = (
-                    report.metadata.last_updated_hours_ago() < self.expiry_hours
-                )
-                if recently_generated and not self.force:
-                    break
+                    #  Skip the region if its data, the template and oscovida
+                    #  are the same as when the report was generated last time
+                    with stage("fingerprint"):
+                        unchanged = report.is_unchanged()
+                    if unchanged and not self.force:
+                        record["status"] = "skipped"
+                        break
 
-                report.generate(kernel_name=self.kernel_name)
+                    report.generate(
+                        kernel_name=self.kernel_name,
+                        engine=self.engine,
+                        kernel_pool=self._get_kernel_pool(size=1),
+                    )
                 break  #  Without this break if force is on it will keep attempting
             except Exception as e:
                 if e == KeyboardInterrupt:
@@ -89,6 +160,42 @@ class ReportExecutor:
                     f"Processing {region} error {type(e)}, retrying {attempt+1}"
                 )
 
+    def _create_html_report_traced(
+        self, region: Union[List[str], List[List[str]]]
+    ) -> tuple:
+        #  Runs in a worker process: return the trace records (which would
+        #  otherwise stay in the worker) and whether the region failed
+        try:
+            self._create_html_report_single(region)
+            failed = False
+        except Exception:
+            failed = True
+        return self.trace.records, failed
+
+    def _get_kernel_pool(self, size: int) -> KernelPool:
+        """Return the pool of warm kernels (for engine "kernel-pool"), create
+        it with `size` kernels if needed."""
+        if self.engine != "kernel-pool":
+            return None
+
+        if _worker_kernel_pool is not None:
+            return _worker_kernel_pool
+
+        if self.kernel_pool is None:
+            self.kernel_pool = KernelPool(
+                size=size,
+                kernel_name=self.kernel_name,
+                warmup_code=self.kernel_warmup_code,
+            )
+        return self.kernel_pool
+
+    @property
+    def kernel_warmup_code(self) -> str:
+        warmup_code = WARMUP_CODE
+        if self.Reporter.kernel_warmup:
+            warmup_code += "\n" + self.Reporter.kernel_warmup
+        return warmup_code
+
     def _create_html_reports_serial(
         self, regions: Union[List[str], List[List[str]]]
     ) -> None:
@@ -114,43 +221,56 @@ class ReportExecutor:
                     pbar.set_description(f"Processing {region_str}")
 
                 self._create_html_report_single(region)
+                self.processed += 1
         except KeyboardInterrupt:
             logging.warning(f"stopped {KeyboardInterrupt}")
 
+    def _create_html_reports_worker(
+        self, work: queue.Queue, pbar, pbar_lock: threading.Lock
+    ) -> None:
+        #  Each worker takes the next region from the shared queue as soon as
+        #  it is done with the previous one, so that no worker sits idle while
+        #  others still have a backlog of (possibly slow) regions
+        while not self.__stop__.is_set():
+            try:
+                region = work.get_nowait()
+            except queue.Empty:
+                break
+
+            region_str = region[-1] if type(region) == list else region
+            logging.info(f"Processing {region_str}")
+            try:
+                self._create_html_report_single(region)
+            except KeyboardInterrupt:
+                break
+            except Exception:
+                self.failed.append(region)
+            finally:
+                with pbar_lock:
+                    self.processed += 1
+                    if pbar is not None:
+                        pbar.update(1)
+
     def _create_html_reports_parallel(
         self, regions: Union[List[str], List[List[str]]]
     ) -> None:
-        self.__stop__ = threading.Event()
+        self.__stop__.clear()
 
-        padding = self.workers - (len(regions) % self.workers)
-        regions = regions + ([None] * padding)
-        per_worker = int(len(regions) / self.workers)
+        work = queue.Queue()
+        for region in regions:
+            work.put(region)
 
-        #  Weird way to create an evenly distributed list
-        regions_per_worker = [[] for p in range(self.workers)]
-        [
-            regions_per_worker[w].append(r)
-            for w, r in zip(list(range(self.workers)) * per_worker, regions)
-        ]
-        regions_per_worker = [
-            list(filter(None.__ne__, worker)) for worker in regions_per_worker
-        ]
-        regions_per_worker = list(filter(None, regions_per_worker))
+        pbar = None if self.disable_pbar else tqdm(total=len(regions))
+        pbar_lock = threading.Lock()
 
         self.threads = []
 
-        print(f"Using {self.workers} workers with tasks:")
-        for n in range(len(regions_per_worker)):
-            thread_name = f"OscovidaWorker {n}"
-            if len(regions_per_worker[n]) > 5:
-                print(f"\t{thread_name}: {len(regions_per_worker[n])} regions...")
-            else:
-                print(f"\t{thread_name}: {regions_per_worker[n]}")
-
+        print(f"Using {self.workers} worker threads for {len(regions)} regions")
+        for n in range(min(self.workers, len(regions))):
             t = threading.Thread(
-                target=self._create_html_reports_serial,
-                args=(tuple(regions_per_worker[n]),),
-                name=thread_name,
+                target=self._create_html_reports_worker,
+                args=(work, pbar, pbar_lock),
+                name=f"OscovidaWorker {n}",
             )
 
             self.threads.append(t)
@@ -160,13 +280,82 @@ class ReportExecutor:
 
         return None
 
+    def _create_html_reports_processes(
+        self, regions: Union[List[str], List[List[str]]]
+    ) -> None:
+        #  The process pool hands out regions one at a time from its internal
+        #  queue, so the load is balanced in the same way as for the threads
+        print(f"Using {self.workers} worker processes for {len(regions)} regions")
+        pbar = None if self.disable_pbar else tqdm(total=len(regions))
+
+        initializer, initargs = None, ()
+        if self.engine == "kernel-pool":
+            initializer = _init_worker_process
+            initargs = (self.kernel_name, self.kernel_warmup_code)
+
+        with ProcessPoolExecutor(
+            max_workers=self.workers, initializer=initializer, initargs=initargs
+        ) as pool:
+            futures = {
+                pool.submit(self._create_html_report_traced, region): region
+                for region in regions
+            }
+            try:
+                for future in as_completed(futures):
+                    if future.exception() is not None:
+                        self.failed.append(futures[future])
+                    else:
+                        records, failed = future.result()
+                        self.trace.add(records)
+                        if failed:
+                            self.failed.append(futures[future])
+                    self.processed += 1
+                    if pbar is not None:
+                        pbar.update(1)
+            except KeyboardInterrupt:
+                [future.cancel() for future in futures]
+                logging.warning(f"stopped")
+
+    def select_changed(
+        self, regions: Union[List[str], List[List[str]]]
+    ) -> Union[List[str], List[List[str]]]:
+        """Return the regions whose reports depend on the data that has
+        changed (`self.changed`, e.g. ["rki"] or ["jhu:Germany"]), all
+        regions if nothing is specified."""
+        if not self.changed:
+            return regions
+
+        selected = [
+            region
+            for region in regions
+            if depends_on(self.Reporter.dependencies_of(region), self.changed)
+        ]
+        print(
+            f"{len(selected)} of {len(regions)} regions depend on {self.changed}"
+        )
+        return selected
+
     def create_html_reports(
         self, regions: Union[List[str], List[List[str]]]
     ) -> None:
-        if self.workers:
-            #  Works with both ThreadPoolExecutor and ProcessPoolExecutor
-            #  for this task multithreading and multiprocessing perform
-            #  about the same
+        self.processed = 0
+        self.failed = []
+        self.trace = ReportTrace()
+        start = time.time()
+
+        #  the data may have changed since the last run
+        dependencies.clear_cache()
+        regions = self.select_changed(regions)
+
+        if self.engine == "kernel-pool" and self.pool != "processes":
+            #  one warm kernel per worker thread, started before the first
+            #  region is processed
+            print(f"Starting {max(self.workers, 1)} kernel(s)")
+            self._get_kernel_pool(size=max(self.workers, 1)).start()
+
+        if self.workers and self.pool == "processes":
+            self._create_html_reports_processes(regions)
+        elif self.workers:
             self._create_html_reports_parallel(regions)
             while any([thread.is_alive() for thread in self.threads]):
                 try:
@@ -178,12 +367,34 @@ class ReportExecutor:
         else:
             self._create_html_reports_serial(regions)
 
+        if self.kernel_pool is not None:
+            self.kernel_pool.shutdown()
+            self.kernel_pool = None
+
+        self.report_throughput(time.time() - start)
+
+        if self.trace_file:
+            self.trace.write(self.trace_file)
+        self.trace.print_summary()
+
+    def report_throughput(self, duration: float) -> None:
+        throughput = self.processed / duration if duration > 0 else 0
+        skipped = self.trace.summary()["skipped"]
+        print(
+            f"Processed {self.processed} regions in {duration:.1f} seconds "
+            f"({throughput * 60:.1f} regions per minute, "
+            f"{skipped} unchanged, {len(self.failed)} failed)"
+        )
+        if self.failed:
+            logging.warning(f"Failed regions: {self.failed}")
+
     def create_markdown_index_page(
         self,
         save_as: str = None,
         slug: str = None,
         pelican_file_path: str = None,
         title_prefix: str = "Tracking plots: ",
+        page_size: int = None,
     ) -> None:
         create_markdown_index_page(
             self.metadata_regions,
@@ -192,4 +403,5 @@ class ReportExecutor:
             slug,
             pelican_file_path,
             title_prefix,
+            page_size,
         )
@@ -67,6 +67,33 @@ def create_markdown_index_list(regions: DataFrame):
     return regions5.to_markdown()
 
 
+def create_markdown_page_links(save_as: str, n_pages: int, page: int) -> str:
+    """Return markdown line with links to all pages of a paginated index,
+    like `Pages: 1 | [2](germany-2) | [3](germany-3)` on the first page."""
+    links = []
+    for n in range(1, n_pages + 1):
+        page_save_as = save_as if n == 1 else f"{save_as}-{n}"
+        links.append(str(n) if n == page else f"[{n}]({page_save_as})")
+    return "Pages: " + " | ".join(links)
+
+
+def write_markdown_page(pelican_file_path, title, tags, save_as, slug, md_content):
+    with open(pelican_file_path, "tw") as f:
+        f.write(f"title: {title}\n")
+        # f.write(f"category: Data\n")  - have stopped using categories (22 April 2020)
+        f.write(f"tags: {tags}\n")
+        f.write(f"save-as: {save_as}\n")
+        f.write(f"slug: {slug}\n")
+        date_time = datetime.datetime.now().strftime("%Y/%m/%d %H:%M")
+        f.write(f"date: {date_time}\n")
+        f.write("\n")
+        f.write("\n")
+        f.write(md_content)
+        f.write("\n")
+
+    logging.info(f"Created markdown index file {pelican_file_path}")
+
+
 def create_markdown_index_page(
     regions: DataFrame,
     category: str,
@@ -74,6 +101,7 @@ def create_markdown_index_page(
     slug=None,
     pelican_file_path=None,
     title_prefix="Tracking plots: ",
+    page_size=None,
 ):
     """Create pelican markdown file, like this:
 
@@ -81,19 +109,26 @@ def create_markdown_index_page(
     tags: Data, Plots, Germany
     save-as: germany
     date: 2020-04-11 08:00
-    """
 
-    md_content = create_markdown_index_list(regions)
+    If there are more than `page_size` regions, the table is split (sorted
+    by name) over several pages, which link to each other: the first page is
+    written to `pelican_file_path` and saved as `save_as`, page n to
+    `pelican_file_path` with "-n" before ".md", saved as `save_as`-n.
+
+    Returns the path of the (first) markdown file.
+    """
 
     title_map = {
         "countries": title_prefix + " Countries of the world",
         "germany": title_prefix + " Germany",
         "us": title_prefix + " United States",
+        "us-counties": title_prefix + " United States counties",
         "hungary": title_prefix + " Hungary",
         "all-regions": title_prefix + " All regions and countries",
     }
 
     title = title_map[category]
+    tags = f"Data, Plots, {title}"
 
     if save_as is None:
         save_as = category
@@ -103,21 +138,27 @@ def create_markdown_index_page(
     if pelican_file_path is None:
         pelican_file_path = f"pelican/content/{category}.md"
 
-    index_path = os.path.join(pelican_file_path)
-
-    with open(index_path, "tw") as f:
-        f.write(f"title: {title}\n")
-        # f.write(f"category: Data\n")  - have stopped using categories (22 April 2020)
-        f.write(f"tags: Data, Plots, {title}\n")
-        f.write(f"save-as: {save_as}\n")
-        f.write(f"slug: {slug}\n")
-        date_time = datetime.datetime.now().strftime("%Y/%m/%d %H:%M")
-        f.write(f"date: {date_time}\n")
-        f.write("\n")
-        f.write("\n")
-        f.write(md_content)
-        f.write("\n")
-
-    logging.info(f"Created markdown index file {pelican_file_path}")
+    if page_size is None or len(regions) <= page_size:
+        md_content = create_markdown_index_list(regions)
+        write_markdown_page(pelican_file_path, title, tags, save_as, slug, md_content)
+        return os.path.join(pelican_file_path)
+
+    regions = regions.sort_values("one-line-summary")
+    n_pages = (len(regions) + page_size - 1) // page_size
+    root, ext = os.path.splitext(pelican_file_path)
+    for page in range(1, n_pages + 1):
+        page_links = create_markdown_page_links(save_as, n_pages, page)
+        md_content = create_markdown_index_list(
+            regions[(page - 1) * page_size : page * page_size]
+        )
+        suffix = "" if page == 1 else f"-{page}"
+        write_markdown_page(
+            root + suffix + ext,
+            title if page == 1 else f"{title} (page {page} of {n_pages})",
+            tags,
+            save_as + suffix,
+            slug + suffix,
+            page_links + "\n\n" + md_content + "\n\n" + page_links,
+        )
 
     return os.path.join(pelican_file_path)
@@ -0,0 +1,158 @@
+"""Execute report notebooks in the current process, without a Jupyter kernel.
+
+Starting a kernel for every notebook means that every notebook imports
+oscovida, matplotlib and pandas again and reloads the data before it can
+draw anything. Here, the code cells are executed directly in the (long
+lived) worker, and the outputs the kernel would have produced are created
+by us: text printed to stdout, figures as SVG (as with
+`%config InlineBackend.figure_formats = ['svg']`) and the rich
+representation of the value of the last expression in a cell.
+
+Only what the report templates need is supported: IPython magics (lines
+starting with `%`) are skipped, and only figures created by the oscovida
+plotting functions are shown. Those are created without pyplot (see
+`oscovida.capture_figures`), so notebooks can be executed in parallel
+threads, and figures are freed as soon as they have been rendered.
+"""
+import ast
+import io
+import sys
+import threading
+import traceback
+
+import matplotlib
+
+matplotlib.use("Agg")
+
+import nbformat
+from IPython.core.formatters import DisplayFormatter
+
+import oscovida
+
+_stdout_lock = threading.Lock()
+
+
+class _ThreadLocalStdout(io.TextIOBase):
+    """Replacement for sys.stdout that sends output to a per-thread buffer
+    (if one has been set), so that notebooks executed in parallel threads
+    capture only their own output."""
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def write(self, s):
+        buffer = getattr(self.local, "buffer", None)
+        return (buffer if buffer is not None else self.default).write(s)
+
+    def flush(self):
+        buffer = getattr(self.local, "buffer", None)
+        (buffer if buffer is not None else self.default).flush()
+
+
+def _capture_stdout():
+    with _stdout_lock:
+        if not isinstance(sys.stdout, _ThreadLocalStdout):
+            sys.stdout = _ThreadLocalStdout(sys.stdout)
+    return sys.stdout
+
+
+def _strip_magics(source):
+    return "\n".join(
+        "" if line.lstrip().startswith("%") else line for line in source.splitlines()
+    )
+
+
+def _figure_output(fig):
+    buffer = io.StringIO()
+    fig.savefig(buffer, format="svg", bbox_inches="tight")
+    return nbformat.v4.new_output(
+        "display_data",
+        data={"image/svg+xml": buffer.getvalue(), "text/plain": repr(fig)},
+    )
+
+
+class InProcessNotebookRunner:
+    """Execute all code cells of a notebook in a fresh namespace in the
+    current process, and add the outputs to the cells.
+
+    Exceptions in a cell are recorded as error output, and execution carries
+    on with the next cell (like `ExecutePreprocessor.allow_errors = True`).
+    """
+
+    def __init__(self):
+        self.formatter = DisplayFormatter()
+
+    def run(self, nb):
+        namespace = {"__name__": "__main__"}
+        stdout = _capture_stdout()
+
+        for execution_count, cell in enumerate(
+            (c for c in nb.cells if c.cell_type == "code"), start=1
+        ):
+            cell.outputs = []
+            cell.execution_count = execution_count
+
+            stdout.local.buffer = io.StringIO()
+            try:
+                with oscovida.capture_figures() as figures:
+                    try:
+                        result = self._run_cell(cell.source, namespace)
+                    except Exception as e:
+                        result = None
+                        error = e
+                    else:
+                        error = None
+                figure_outputs = [_figure_output(fig) for fig in figures]
+            finally:
+                text = stdout.local.buffer.getvalue()
+                stdout.local.buffer = None
+
+            if text:
+                cell.outputs.append(
+                    nbformat.v4.new_output("stream", name="stdout", text=text)
+                )
+            cell.outputs.extend(figure_outputs)
+            if result is not None:
+                data, metadata = self.formatter.format(result)
+                cell.outputs.append(
+                    nbformat.v4.new_output(
+                        "execute_result",
+                        data=data,
+                        metadata=metadata,
+                        execution_count=execution_count,
+                    )
+                )
+            if error is not None:
+                cell.outputs.append(
+                    nbformat.v4.new_output(
+                        "error",
+                        ename=type(error).__name__,
+                        evalue=str(error),
+                        traceback=traceback.format_exception(
+                            type(error), error, error.__traceback__
+                        ),
+                    )
+                )
+
+        return nb
+
+    @staticmethod
+    def _run_cell(source, namespace):
+        """Execute source, return value of the last expression (None if the
+        last statement is not an expression or ends with a semicolon)."""
+        source = _strip_magics(source)
+        tree = ast.parse(source)
+        if not tree.body:
+            return None
+
+        last = tree.body[-1]
+        if isinstance(last, ast.Expr) and not source.rstrip().endswith(";"):
+            body = ast.Module(body=tree.body[:-1], type_ignores=[])
+            exec(compile(body, "<cell>", "exec"), namespace)
+            return eval(
+                compile(ast.Expression(body=last.value), "<cell>", "eval"), namespace
+            )
+
+        exec(compile(tree, "<cell>", "exec"), namespace)
+        return None
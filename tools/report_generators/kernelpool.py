@@ -0,0 +1,158 @@
+"""A pool of pre-started Jupyter kernels for executing report notebooks.
+
+Starting a new kernel for every notebook means that every notebook pays for
+booting the kernel, importing oscovida (and with it pandas and matplotlib)
+and loading the data, before the first cell can run: a few seconds per
+region. The kernels in the pool are started once, have `from oscovida import *`
+(and any other warm-up code) executed, and are then lent out to execute one
+notebook at a time. In between, the user namespace of the kernel is reset
+so that no variables or figures leak from one report into the next. Modules
+stay imported, and data already loaded in them stays loaded.
+"""
+import atexit
+import contextlib
+import logging
+import queue
+import threading
+
+from jupyter_client import KernelManager
+
+WARMUP_CODE = "from oscovida import *"
+
+#  Executed (without storing history) before a kernel is lent out again
+RESET_CODE = """\
+%reset -f
+import matplotlib.pyplot as _plt
+_plt.close("all")
+del _plt
+get_ipython().execution_count = 1
+"""
+
+
+class KernelPool:
+    """Pool of `size` warm kernels of type `kernel_name` (default kernel if
+    empty). Use `kernel()` to borrow one:
+
+        pool = KernelPool(4, warmup_code="from oscovida import *")
+        with pool.kernel() as km:
+            ExecutePreprocessor().preprocess(nb, km=km)
+        pool.shutdown()
+    """
+
+    def __init__(
+        self, size=1, kernel_name="", warmup_code=WARMUP_CODE, timeout=600
+    ):
+        self.size = size
+        self.kernel_name = kernel_name
+        self.warmup_code = warmup_code
+        self.timeout = timeout
+
+        self.kernels = []
+        self.available = queue.Queue()
+        self.lock = threading.Lock()
+
+        atexit.register(self.shutdown)
+
+    def _run(self, km, code):
+        """Execute `code` in the kernel of `km`, raise RuntimeError if it fails."""
+        #  a client of the manager checks if the kernel process is alive,
+        #  instead of relying on heartbeats (which are missed while a busy
+        #  machine starts several kernels, "Kernel died before replying")
+        kc = km.blocking_client()
+        kc.start_channels()
+        try:
+            kc.wait_for_ready(timeout=self.timeout)
+            reply = kc.execute_interactive(
+                code,
+                store_history=False,
+                timeout=self.timeout,
+                output_hook=lambda msg: None,
+            )
+        finally:
+            kc.stop_channels()
+
+        if reply["content"]["status"] != "ok":
+            raise RuntimeError(
+                f"Error in kernel: {reply['content'].get('ename')} "
+                f"{reply['content'].get('evalue')}"
+            )
+
+    def _start_kernel(self):
+        #  nbclient expects an asynchronous client for kernels it is given
+        km = KernelManager(
+            client_class="jupyter_client.asynchronous.AsyncKernelClient"
+        )
+        if self.kernel_name:
+            km.kernel_name = self.kernel_name
+        km.start_kernel()
+        try:
+            self._run(km, self.warmup_code)
+        except Exception:
+            km.shutdown_kernel(now=True)
+            raise
+        logging.info(f"Started kernel {km.kernel_id}")
+        return km
+
+    def start(self):
+        """Start all kernels of the pool (otherwise they are started as needed)."""
+        with self.lock:
+            while len(self.kernels) < self.size:
+                km = self._start_kernel()
+                self.kernels.append(km)
+                self.available.put(km)
+
+    def _acquire(self):
+        while True:
+            with self.lock:
+                if self.available.empty() and len(self.kernels) < self.size:
+                    km = self._start_kernel()
+                    self.kernels.append(km)
+                    return km
+            try:
+                #  check again from time to time: a broken kernel that has
+                #  been removed is not put back (see _release)
+                return self.available.get(timeout=1)
+            except queue.Empty:
+                pass
+
+    def _release(self, km):
+        """Reset kernel and put it back into the pool. Kernels that have died
+        or can not be reset are removed from the pool: a new kernel is started
+        by `_acquire` when it is needed (not here, so that an error starting
+        it does not hide the error of the notebook)."""
+        try:
+            if not km.is_alive():
+                raise RuntimeError("Kernel died")
+            self._run(km, RESET_CODE)
+        except Exception as e:
+            logging.warning(f"Removing kernel {km.kernel_id}: {e}")
+            with self.lock:
+                self.kernels.remove(km)
+            try:
+                km.shutdown_kernel(now=True)
+            except Exception as e:
+                logging.warning(f"Could not shut down kernel {km.kernel_id}: {e}")
+            return
+        self.available.put(km)
+
+    @contextlib.contextmanager
+    def kernel(self):
+        """Borrow a warm kernel (as KernelManager) for the duration of the
+        with-block."""
+        km = self._acquire()
+        try:
+            yield km
+        finally:
+            self._release(km)
+
+    def shutdown(self):
+        #  the pool may be discarded long before the process exits
+        atexit.unregister(self.shutdown)
+        with self.lock:
+            for km in self.kernels:
+                try:
+                    km.shutdown_kernel(now=True)
+                except Exception as e:
+                    logging.warning(f"Could not shut down kernel {km.kernel_id}: {e}")
+            self.kernels = []
+            self.available = queue.Queue()
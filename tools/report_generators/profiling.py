@@ -0,0 +1,198 @@
+"""Timings of the stages of report generation, per region and attempt.
+
+The executor opens a record for every attempt to create a report
+(`ReportTrace.attempt`), and the report code marks its stages:
+
+    with stage("execute"):
+        nb = execute_notebook(nb)
+
+For each stage the wall clock time and the CPU time of the calling thread
+are added to the record of the attempt that is running in the same thread.
+Outside of an attempt, `stage` does nothing. Time spent in other processes
+is not included in the CPU time: with the "kernel" and "kernel-pool"
+engines the notebook runs in the kernel, and the CPU time of the execute
+stage is close to zero (the thread only waits).
+
+Stages:
+
+- init: creating the Reporter, which loads the data and updates the metadata
+- fingerprint: checking if the data has changed since the last report
+- notebook: creating the notebook from the template
+- execute: executing the notebook
+- html-export: converting the notebook to html
+- write: writing the html file
+
+Records can be written to a JSON lines or csv file, and summarised:
+
+    {"region": "Germany", "attempt": 0, "status": "ok", "wall": 6.1, "cpu": 5.8,
+     "stages": {"init": {"wall": 0.2, "cpu": 0.2}, ...}}
+"""
+import contextlib
+import csv
+import json
+import os
+import threading
+import time
+import traceback
+
+import numpy as np
+
+_current = threading.local()
+
+
+@contextlib.contextmanager
+def stage(name):
+    """Add wall clock and CPU time (of the calling thread) of the with-block
+    to stage `name` of the current attempt (if any)."""
+    record = getattr(_current, "record", None)
+    if record is None:
+        yield
+        return
+
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        timing = record["stages"].setdefault(name, {"wall": 0.0, "cpu": 0.0})
+        timing["wall"] += time.perf_counter() - wall
+        timing["cpu"] += time.thread_time() - cpu
+
+
+def _percentile(values, q):
+    return float(np.percentile(values, q)) if values else float("nan")
+
+
+class ReportTrace:
+    """Records of all attempts to create reports."""
+
+    def __init__(self):
+        self.records = []
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        #  Sent to worker processes: they collect their own records, which
+        #  are sent back and merged with `add`
+        return {"records": []}
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    @contextlib.contextmanager
+    def attempt(self, region, attempt):
+        """Record the stages of attempt number `attempt` (starting with 0)
+        for `region`. Yields the record: set record["status"] to "skipped"
+        if no report is created. Exceptions are recorded and re-raised."""
+        region_str = region[-1] if type(region) == list else region
+        record = {
+            "region": region_str,
+            "attempt": attempt,
+            "status": "ok",
+            "start": time.time(),
+            "stages": {},
+        }
+        wall, cpu = time.perf_counter(), time.thread_time()
+        _current.record = record
+        try:
+            yield record
+        except BaseException as e:
+            record["status"] = "error"
+            record["error"] = "".join(
+                traceback.format_exception_only(type(e), e)
+            ).strip()
+            raise
+        finally:
+            _current.record = None
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.thread_time() - cpu
+            self.add([record])
+
+    def add(self, records):
+        with self.lock:
+            self.records.extend(records)
+
+    def write(self, path):
+        """Append records to `path`: one row per attempt and stage if it
+        ends with .csv, otherwise one JSON object per line."""
+        with self.lock:
+            records = list(self.records)
+
+        if path.endswith(".csv"):
+            new_file = not os.path.exists(path) or os.path.getsize(path) == 0
+            with open(path, "a", newline="") as f_out:
+                writer = csv.writer(f_out)
+                if new_file:
+                    writer.writerow(
+                        ["region", "attempt", "status", "start", "stage", "wall", "cpu"]
+                    )
+                for r in records:
+                    stages = dict(r["stages"], total={"wall": r["wall"], "cpu": r["cpu"]})
+                    for name, timing in stages.items():
+                        writer.writerow(
+                            [r["region"], r["attempt"], r["status"], r["start"],
+                             name, timing["wall"], timing["cpu"]]
+                        )
+        else:
+            with open(path, "a") as f_out:
+                for r in records:
+                    f_out.write(json.dumps(r) + "\n")
+
+    def summary(self, slowest=5):
+        """Return dictionary with p50/p95/max of the wall clock times and the
+        p50 of the CPU times of the calling thread per stage (for attempts
+        that created a report), counts of skipped, retried and failed
+        attempts, and the slowest regions."""
+        with self.lock:
+            records = list(self.records)
+
+        done = [r for r in records if r["status"] != "skipped"]
+        stages = {}
+        for r in done:
+            for name, timing in dict(
+                r["stages"], total={"wall": r["wall"], "cpu": r["cpu"]}
+            ).items():
+                stages.setdefault(name, {"wall": [], "cpu": []})
+                stages[name]["wall"].append(timing["wall"])
+                stages[name]["cpu"].append(timing["cpu"])
+
+        return {
+            "attempts": len(records),
+            "skipped": sum(r["status"] == "skipped" for r in records),
+            "retried": sum(r["attempt"] > 0 for r in records),
+            "errors": sum(r["status"] == "error" for r in records),
+            "stages": {
+                name: {
+                    "n": len(t["wall"]),
+                    "p50": _percentile(t["wall"], 50),
+                    "p95": _percentile(t["wall"], 95),
+                    "max": max(t["wall"]),
+                    "cpu_p50": _percentile(t["cpu"], 50),
+                }
+                for name, t in stages.items()
+            },
+            "slowest": [
+                (r["region"], r["attempt"], r["wall"])
+                for r in sorted(done, key=lambda r: r["wall"], reverse=True)[:slowest]
+            ],
+        }
+
+    def print_summary(self, slowest=5):
+        s = self.summary(slowest=slowest)
+        print(
+            f"{s['attempts']} attempts: {s['skipped']} skipped, "
+            f"{s['retried']} retries, {s['errors']} errors"
+        )
+        if not s["stages"]:
+            return
+        #  the CPU time does not include kernels or other processes
+        print(
+            f"{'stage':12} {'n':>5} {'p50 [s]':>9} {'p95 [s]':>9} "
+            f"{'max [s]':>9} {'caller cpu p50 [s]':>19}"
+        )
+        for name, t in s["stages"].items():
+            print(
+                f"{name:12} {t['n']:5} {t['p50']:9.2f} {t['p95']:9.2f} "
+                f"{t['max']:9.2f} {t['cpu_p50']:19.2f}"
+            )
+        print("Slowest regions:")
+        for region, attempt, wall in s["slowest"]:
+            print(f"  {wall:7.2f} s  {region} (attempt {attempt})")
@@ -1,3 +1,4 @@
+import hashlib
 import json
 import os
 
@@ -9,8 +10,16 @@ from nbconvert.writers import FilesWriter
 
 import oscovida
 
+from .dependencies import dependency_hash, update_hash
+from .inprocess import InProcessNotebookRunner
+from .profiling import stage
+
 
 class BaseReport:
+    #  Code to load the data in the kernels of a KernelPool, before the first
+    #  notebook is executed (in addition to `from oscovida import *`)
+    kernel_warmup = ""
+
     def __init__(
         self,
         *,
@@ -18,8 +27,6 @@ class BaseReport:
         title,
         overview_function,
         overview_args,
-        data_load_function,
-        data_load_args,
         output_file,
         wwwroot,
         verbose=False,
@@ -31,9 +38,6 @@ class BaseReport:
         self.overview_function = overview_function
         self.overview_args = overview_args
 
-        self.data_load_function = data_load_function
-        self.data_load_args = data_load_args
-
         self.output_file_name = self.sanitise(output_file) + ".ipynb"
         self.output_ipynb_path = os.path.join(wwwroot, "ipynb", self.output_file_name)
         self.output_html_path = os.path.join(
@@ -42,6 +46,8 @@ class BaseReport:
 
         self.metadata = oscovida.MetadataRegion(self.title)
 
+        #  the data shown in the report, set in init_metadata
+        self.input_series = []
         self.init_metadata()
 
     @staticmethod
@@ -71,17 +77,50 @@ class BaseReport:
             "BINDER_URL": self.get_binder_url,
             "OVERVIEW_FUNCTION": self.overview_function,
             "OVERVIEW_ARGS": self.overview_args,
-            "DATA_LOAD_FUNCTION": self.data_load_function,
-            "DATA_LOAD_ARGS": self.data_load_args,
         }
 
-    def _init_metadata(self, meta):
-        [self.metadata.__setitem__(k, v) for (k, v) in meta.items()]
+    def _init_metadata(self, meta, series=()):
+        self.input_series = list(series)
+        self.metadata.update(meta)
 
     def init_metadata(self):
         raise NotImplementedError()
 
+    @staticmethod
+    def dependencies_of(region):
+        """Return keys of the data that the report for `region` uses, see
+        `oscovida.overview_dependencies`."""
+        raise NotImplementedError()
+
+    def fingerprint(self, template_file="./template-report.py"):
+        """Return hash of everything the report is generated from: the
+        input series, the data of the regions it is compared with, the
+        template and the oscovida version. If it is the same as for the last
+        generated report, the report would not change."""
+        h = hashlib.sha256()
+        h.update(oscovida.__version__.encode())
+        with open(template_file, "rb") as f:
+            h.update(f.read())
+        for key, value in sorted(self.mapping.items()):
+            h.update(f"{key}={value}".encode())
+        update_hash(h, self.input_series)
+        #  the first dependency is the region itself, i.e. the input series
+        for key in self.dependencies[1:]:
+            h.update(f"{key}={dependency_hash(key)}".encode())
+        return h.hexdigest()
+
+    def is_unchanged(self, template_file="./template-report.py"):
+        """True if the report has been generated before from the same data,
+        template and oscovida version, and the html file still exists."""
+        return self.metadata.as_dict().get("fingerprint") == self.fingerprint(
+            template_file
+        ) and os.path.exists(self.output_html_path)
+
     def generate_notebook(self, template_file="./template-report.py"):
+        with stage("notebook"):
+            self._generate_notebook(template_file)
+
+    def _generate_notebook(self, template_file):
         with open(template_file, "r") as f:
             template_str = f.read()
 
@@ -96,55 +135,97 @@ class BaseReport:
             print(f"Written file to {self.output_file_name}") if self.verbose else None
             self.metadata["ipynb-name"] = os.path.basename(self.output_ipynb_path)
 
-    def generate_html(self, kernel_name=""):
+    def execute_notebook(
+        self, nb, kernel_name="", engine="kernel", kernel_pool=None
+    ):
+        """Execute notebook, either in a new Jupyter kernel (engine="kernel"),
+        in a warm kernel borrowed from `kernel_pool` (engine="kernel-pool",
+        see kernelpool.py) or directly in this process (engine="inprocess",
+        see inprocess.py)."""
+        if engine == "inprocess":
+            return InProcessNotebookRunner().run(nb)
+
         nb_executor = ExecutePreprocessor(kernel_name=kernel_name)
         nb_executor.allow_errors = True
 
+        if engine == "kernel-pool":
+            with kernel_pool.kernel() as km:
+                try:
+                    return nb_executor.preprocess(nb, km=km)[0]
+                finally:
+                    #  the kernel stays alive, but the client is not needed
+                    if nb_executor.kc is not None:
+                        nb_executor.kc.stop_channels()
+
+        return nb_executor.preprocess(nb)[0]
+
+    def generate_html(self, kernel_name="", engine="kernel", kernel_pool=None):
         html_exporter = HTMLExporter()
         html_writer = FilesWriter()
 
         with open(self.output_ipynb_path) as f:
             nb = nbformat.read(f, as_version=4)
-            nb = nb_executor.preprocess(nb)[0]
-            body, resources = html_exporter.from_notebook_node(nb)
+            with stage("execute"):
+                nb = self.execute_notebook(
+                    nb, kernel_name=kernel_name, engine=engine, kernel_pool=kernel_pool
+                )
+            with stage("html-export"):
+                body, resources = html_exporter.from_notebook_node(nb)
             #  HTML writer automatically adds .html to the end, so get rid of it
-            html_writer.write(
-                body, resources, self.output_html_path.replace(".html", "")
-            )
+            with stage("write"):
+                html_writer.write(
+                    body, resources, self.output_html_path.replace(".html", "")
+                )
 
             print(f"Written file to {self.output_html_path}") if self.verbose else None
             self.metadata["html-file"] = os.path.basename(self.output_html_path)
             self.metadata.mark_as_updated()
 
-    def generate(self, kernel_name="", template_file="./template-report.py"):
-        self.generate_notebook(template_file=template_file)
-        self.generate_html(kernel_name=kernel_name)
+    def generate(
+        self,
+        kernel_name="",
+        template_file="./template-report.py",
+        engine="kernel",
+        kernel_pool=None,
+    ):
+        #  write the metadata once, when the report is complete
+        with self.metadata.transaction():
+            self.generate_notebook(template_file=template_file)
+            self.generate_html(
+                kernel_name=kernel_name, engine=engine, kernel_pool=kernel_pool
+            )
+            self.metadata["dependencies"] = self.dependencies
+            self.metadata["fingerprint"] = self.fingerprint(template_file)
 
 
 class CountryReport(BaseReport):
     category = "countries"
+    kernel_warmup = 'get_country_table("deaths"); get_country_table("cases")'
 
     def __init__(self, country, wwwroot="wwwroot", verbose=False):
         self.check_country_is_known(country)
+        self.dependencies = self.dependencies_of(country)
 
         super().__init__(
             country=country,
             title=country,
             overview_function="overview",
             overview_args=f'"{country}"',
-            data_load_function="get_country_data",
-            data_load_args=f'"{country}"',
             output_file=f"{country}",
             wwwroot=wwwroot,
             verbose=verbose,
         )
 
+    @staticmethod
+    def dependencies_of(region):
+        return oscovida.overview_dependencies(region)
+
     @staticmethod
     def check_country_is_known(country):
-        d = oscovida.fetch_deaths()
+        d = oscovida.get_country_table("deaths")
         assert (
-            country in d.index
-        ), f"{country} is unknown. Known countries are {sorted(d.index)}"
+            country in d
+        ), f"{country} is unknown. Known countries are {sorted(d.labels)}"
 
     def init_metadata(self):
         cases, deaths, region_label = oscovida.get_country_data(self.country)
@@ -160,12 +241,14 @@ class CountryReport(BaseReport):
                 "subregion": str(None),
                 "one-line-summary": one_line_summary,  # used as title in table
                 "cases-last-week": int(oscovida.get_cases_last_week(cases)),
-            }
+            },
+            series=(cases, deaths),
         )
 
 
 class GermanyReport(BaseReport):
     category = "germany"
+    kernel_warmup = "get_germany_tables()"
 
     def __init__(self, region, wwwroot="wwwroot", verbose=False):
         self.region = region[0]  #  Bundesland
@@ -173,14 +256,13 @@ class GermanyReport(BaseReport):
 
         self.germany_check_region_is_known(self.region)
         self.germany_check_subregion__is_known(self.subregion)
+        self.dependencies = self.dependencies_of(region)
 
         super().__init__(
             country="Germany",
             title=f"Germany: {self.subregion} ({self.region})",
             overview_function="overview",
             overview_args=f'country="Germany", subregion="{self.subregion}"',
-            data_load_function="germany_get_region",
-            data_load_args=f'landkreis="{self.subregion}"',
             output_file=f"Germany-{self.region}-{self.subregion}",
             wwwroot=wwwroot,
             verbose=verbose,
@@ -203,45 +285,79 @@ class GermanyReport(BaseReport):
                 "subregion": self.subregion,
                 "one-line-summary": one_line_summary,  # used as title in table
                 "cases-last-week": int(oscovida.get_cases_last_week(cases)),
-            }
+            },
+            series=(cases, deaths),
+        )
+
+    @staticmethod
+    def dependencies_of(region):
+        return oscovida.overview_dependencies(
+            "Germany", region=region[0], subregion=region[1]
         )
 
     @staticmethod
     def germany_check_region_is_known(region):
-        d = oscovida.fetch_data_germany()
-        assert region in list(
-            d["Bundesland"].drop_duplicates()
-        ), f"{region} is unknown."
+        d = oscovida.get_germany_table("bundesland", "cases")
+        assert region in d, f"{region} is unknown."
 
     @staticmethod
     def germany_check_subregion__is_known(subregion):
-        d = oscovida.fetch_data_germany()
-        assert subregion in list(
-            d["Landkreis"].drop_duplicates()
-        ), f"{subregion} is unknown."
+        d = oscovida.get_germany_table("landkreis", "cases")
+        assert subregion in d, f"{subregion} is unknown."
 
 
 class USAReport(BaseReport):
     category = "us"
+    kernel_warmup = "get_US_tables()"
 
     def __init__(self, region, wwwroot="wwwroot", verbose=False):
-        self.region = region
+        #  region is a state, or [state, county] for a county
+        if isinstance(region, str):
+            self.region, self.subregion = region, None
+            title, output_file = f"United States: {region}", f"US-{region}"
+            overview_args = f'country="US", region="{region}"'
+        else:
+            self.region, self.subregion = region
+            title = f"United States: {self.subregion} ({self.region})"
+            output_file = f"US-{self.region}-{self.subregion}"
+            overview_args = (
+                f'country="US", region="{self.region}", subregion="{self.subregion}"'
+            )
+
+        self.check_region_is_known(self.region, self.subregion)
+        self.dependencies = self.dependencies_of(region)
 
         super().__init__(
             country="USA",
-            title=f"United States: {region}",
+            title=title,
             overview_function="overview",
-            overview_args=f'country="US", region="{region}"',
-            data_load_function="get_country_data",
-            data_load_args=f'"US", "{region}"',
-            output_file=f"US-{region}",
+            overview_args=overview_args,
+            output_file=output_file,
             wwwroot=wwwroot,
             verbose=verbose,
         )
 
+    @staticmethod
+    def dependencies_of(region):
+        if isinstance(region, str):
+            return oscovida.overview_dependencies("US", region=region)
+        return oscovida.overview_dependencies("US", region=region[0], subregion=region[1])
+
+    @staticmethod
+    def check_region_is_known(state, county=None):
+        if county is None:
+            d = oscovida.get_US_table("state", "deaths")
+            assert state in d, f"{state} is unknown."
+        else:
+            d = oscovida.get_US_table("county", "deaths")
+            assert f"{county}, {state}" in d, f"{county} ({state}) is unknown."
+
     def init_metadata(self):
-        cases, deaths = oscovida.get_region_US(self.region)
-        one_line_summary = f"US: {self.region}"
+        cases, deaths = oscovida.get_region_US(self.region, county=self.subregion)
+        if self.subregion is None:
+            one_line_summary = f"US: {self.region}"
+        else:
+            one_line_summary = f"US: {self.region} : {self.subregion}"
 
         self._init_metadata(
             meta={
@@ -250,38 +366,49 @@ class USAReport(BaseReport):
                 "max-deaths": int(deaths[-1]),
                 "max-cases": int(cases[-1]),
                 "region": self.region,
-                "subregion": str(None),
+                "subregion": str(self.subregion),
                 "one-line-summary": one_line_summary,  # used as title in table
                 "cases-last-week": int(oscovida.get_cases_last_week(cases)),
-            }
+            },
+            series=(cases, deaths),
         )
 
 
+class USCountyReport(USAReport):
+    """Report for a county in the US, region is [state, county]."""
+
+    category = "us-counties"
+
+
 class HungaryReport(BaseReport):
     category = "hungary"
+    kernel_warmup = "fetch_data_hungary()"
 
     def __init__(self, region, wwwroot="wwwroot", verbose=False):
         self.region = region
+        self.dependencies = self.dependencies_of(region)
 
         super().__init__(
             country="Hungary",
             title=f"Hungary: {region}",
             overview_function="overview",
             overview_args=f'country="Hungary", region="{region}"',
-            data_load_function="get_region_hungary",
-            data_load_args=f'county="{region}"',
             output_file=f"Hungary-{region}",
             wwwroot=wwwroot,
             verbose=verbose,
         )
 
+    @staticmethod
+    def dependencies_of(region):
+        return oscovida.overview_dependencies("Hungary", region=region)
+
     @staticmethod
     def hungary_check_region_name_is_known(region):
         counties = oscovida.get_counties_hungary()
         assert region in counties, f"{region} is unknown. Known regions are {counties}"
 
     def init_metadata(self):
-        cases, _, _ = oscovida.get_country_data("Hungary", region=self.region)
+        cases, deaths, _ = oscovida.get_country_data("Hungary", region=self.region)
 
         self._init_metadata(
             meta={
@@ -293,7 +420,8 @@ class HungaryReport(BaseReport):
                 "subregion": str(None),
                 "one-line-summary": f"Hungary: {self.region}",  # used as title in table
                 "cases-last-week": int(oscovida.get_cases_last_week(cases)),
-            }
+            },
+            series=(cases, deaths),
         )
 
 
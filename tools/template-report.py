@@ -18,14 +18,15 @@ print(f"Notebook executed on: {{start.strftime('%d/%m/%Y %H:%M:%S%Z')}} {{time.t
 from oscovida import *
 
 # %%
-{OVERVIEW_FUNCTION}({OVERVIEW_ARGS});
+# load the data, and compute everything shown in the plots once
+data = OverviewData({OVERVIEW_ARGS})
+{OVERVIEW_FUNCTION}({OVERVIEW_ARGS}, data=data);
 
 # %%
-# load the data
-cases, deaths, region_label = {DATA_LOAD_FUNCTION}({DATA_LOAD_ARGS})
+cases, deaths, region_label = data.cases, data.deaths, data.region_label
 
 # compose into one table
-table = compose_dataframe_summary(cases, deaths)
+table = data.table()
 
 # show tables with up to 500 rows
 pd.set_option("max_rows", 500)